@@ -0,0 +1,261 @@
+"""
+准入控制
+
+在调用星火大模型之前限制同时进行的调用数，超出的请求进入有界的等待队列：
+1. 有空闲名额时直接调用
+2. 名额已满时排队等待（先到先得），前一个调用结束时把名额直接交给队首
+3. 队列已满，或排队超过 ADMISSION_QUEUE_TIMEOUT 时，立即返回429
+
+429响应的 Retry-After 按“当前积压的调用数 × 平均服务时间 ÷ 并发名额”估算，
+平均服务时间是最近成功调用耗时的指数加权移动平均（EWMA）。
+
+限制按进程生效：gunicorn多worker时每个worker各自计数。
+同步调用（WSGI线程）和协程（asgi.py）共用同一个控制器。
+
+作者：AI助手
+日期：2025年
+"""
+
+import asyncio
+import collections
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from log_config import get_logger, log_event
+from metrics import (
+    ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, STAGE_QUEUE_WAIT, UPSTREAM_INFLIGHT, observe_stage
+)
+
+
+# ==================== 配置 ====================
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "64"))              # 每个进程同时调用大模型的上限
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "128"))                   # 等待队列长度上限
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))          # 排队等待的最长时间（秒）
+ADMISSION_INITIAL_SERVICE_TIME = float(os.getenv("ADMISSION_INITIAL_SERVICE_TIME", "20"))  # 还没有观测数据时假定的调用耗时（秒）
+ADMISSION_EWMA_ALPHA = 0.2  # 新观测值的权重
+
+# 拒绝原因
+REJECT_QUEUE_FULL = "queue_full"
+REJECT_QUEUE_TIMEOUT = "queue_timeout"
+
+logger = get_logger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """
+    请求未获准调用大模型
+
+    属性:
+        reason: REJECT_QUEUE_FULL 或 REJECT_QUEUE_TIMEOUT
+        retry_after: 建议的重试等待时间（整数秒）
+    """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"服务繁忙（{reason}），请在 {retry_after} 秒后重试")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """队列中的一个等待者：线程用Event等待，协程用Future等待"""
+
+    def __init__(self, loop=None):
+        self.admitted = False
+        self._loop = loop
+        if loop is None:
+            self._event = threading.Event()
+        else:
+            self._future = loop.create_future()
+
+    def wake(self):
+        """可在任意线程调用"""
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def wait(self, timeout):
+        self._event.wait(timeout)
+
+    async def wait_async(self, timeout):
+        try:
+            await asyncio.wait_for(self._future, timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class AdmissionController:
+    """
+    并发名额和等待队列
+
+    属性:
+        max_inflight: 同时调用的上限
+        max_queue: 等待队列长度上限
+        inflight: 正在调用的数量
+        service_time: 调用耗时的EWMA（秒）
+    """
+
+    def __init__(self, max_inflight=None, max_queue=None, queue_timeout=None):
+        self.max_inflight = max(1, ADMISSION_MAX_INFLIGHT if max_inflight is None else max_inflight)
+        self.max_queue = ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout = ADMISSION_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.inflight = 0
+        self.service_time = ADMISSION_INITIAL_SERVICE_TIME
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """按当前积压估算多少秒后有名额（至少1秒）"""
+        backlog = self.inflight + len(self._waiters)
+        return max(1, math.ceil(backlog * self.service_time / self.max_inflight))
+
+    def _reject(self, reason):
+        """在持有锁时调用"""
+        ADMISSION_REJECTED.labels(reason=reason).inc()
+        error = AdmissionRejected(reason, self.retry_after())
+        log_event(logger, logging.WARNING, "admission_rejected", reason=reason,
+                  inflight=self.inflight, queued=len(self._waiters), retry_after=error.retry_after)
+        return error
+
+    def precheck(self):
+        """
+        请求开始时的快速检查：队列已满时直接拒绝，不再读取上传文件
+
+        抛出:
+            AdmissionRejected
+        """
+        with self._lock:
+            if self.inflight >= self.max_inflight and len(self._waiters) >= self.max_queue:
+                raise self._reject(REJECT_QUEUE_FULL)
+
+    def _enter(self, loop=None):
+        """
+        申请名额
+
+        返回:
+            None表示已获得名额，否则为需要等待的_Waiter
+        """
+        with self._lock:
+            if self.inflight < self.max_inflight and not self._waiters:
+                self.inflight += 1
+                UPSTREAM_INFLIGHT.inc()
+                return None
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject(REJECT_QUEUE_FULL)
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            ADMISSION_QUEUE_DEPTH.inc()
+            return waiter
+
+    def _abandon(self, waiter):
+        """
+        等待结束但未获得名额（超时或请求被取消）时离开队列
+
+        返回:
+            是否在离开前恰好获得了名额
+        """
+        with self._lock:
+            if waiter.admitted:
+                return True
+            self._waiters.remove(waiter)
+            ADMISSION_QUEUE_DEPTH.dec()
+            return False
+
+    def _release(self, service_seconds):
+        """
+        归还名额：有人排队时直接交给队首，否则名额数减1
+
+        参数:
+            service_seconds: 本次调用耗时，失败的调用为None（不计入平均服务时间）
+        """
+        with self._lock:
+            if service_seconds is not None:
+                self.service_time += ADMISSION_EWMA_ALPHA * (service_seconds - self.service_time)
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                ADMISSION_QUEUE_DEPTH.dec()
+                waiter.admitted = True
+                waiter.wake()
+            else:
+                self.inflight -= 1
+                UPSTREAM_INFLIGHT.dec()
+
+    def _wait_timeout(self, deadline):
+        """排队的最长时间：不超过队列超时和请求期限的剩余时间"""
+        if deadline is None:
+            return self.queue_timeout
+        return min(self.queue_timeout, deadline.time_left())
+
+    def _after_wait(self, waiter, queued_at, deadline):
+        """等待结束：获得名额时记录排队耗时，否则按原因抛出异常"""
+        if not self._abandon(waiter):
+            if deadline is not None:
+                deadline.check()  # 请求已超时或客户端已断开
+            with self._lock:
+                raise self._reject(REJECT_QUEUE_TIMEOUT)
+        observe_stage(STAGE_QUEUE_WAIT, time.perf_counter() - queued_at, queued_at)
+
+    @contextmanager
+    def slot(self, deadline=None):
+        """
+        在获得名额期间执行代码块（线程中使用）
+
+        参数:
+            deadline: 当前请求的期限，请求被取消时停止排队
+
+        抛出:
+            AdmissionRejected, DeadlineExceeded
+        """
+        queued_at = time.perf_counter()
+        waiter = self._enter()
+        if waiter is not None:
+            unregister = deadline.on_cancel(waiter.wake) if deadline is not None else None
+            try:
+                waiter.wait(self._wait_timeout(deadline))
+            finally:
+                if unregister is not None:
+                    unregister()
+            self._after_wait(waiter, queued_at, deadline)
+
+        started = time.perf_counter()
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            self._release(time.perf_counter() - started if succeeded else None)
+
+    @asynccontextmanager
+    async def slot_async(self, deadline=None):
+        """slot() 的协程版本，排队时不占用线程"""
+        queued_at = time.perf_counter()
+        waiter = self._enter(asyncio.get_running_loop())
+        if waiter is not None:
+            unregister = deadline.on_cancel(waiter.wake) if deadline is not None else None
+            try:
+                await waiter.wait_async(self._wait_timeout(deadline))
+            except asyncio.CancelledError:
+                # 整个请求被取消：离开队列，已经拿到的名额交还
+                if self._abandon(waiter):
+                    self._release(None)
+                raise
+            finally:
+                if unregister is not None:
+                    unregister()
+            self._after_wait(waiter, queued_at, deadline)
+
+        started = time.perf_counter()
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            self._release(time.perf_counter() - started if succeeded else None)
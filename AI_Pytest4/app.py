@@ -2,45 +2,75 @@
 AI 智能年度总结生成器 - Flask后端应用
 
 这个文件是整个应用的核心，包含以下主要功能：
-1. 与科大讯飞星火大模型的WebSocket通信
-2. 用户输入处理（文本和文件上传）
+1. 用户输入处理（文本和文件上传）
+2. 调用科大讯飞星火大模型（HTTP客户端见 spark_http_client.py，WebSocket客户端见 spark_ws_client.py）
 3. Word文档模板填充和生成
 4. Web API接口提供
 
+应用通过 create_app() 创建。导入本模块没有副作用（不检查凭证、不打印、不创建客户端），
+python-docx、websocket-client 等较慢的库在第一次用到时才导入，模板和客户端也在第一次使用时才创建。
+
 作者：AI助手
 日期：2025年
 """
 
 # 导入必要的Python标准库
-import websocket          # WebSocket客户端，用于与星火大模型通信
+import contextvars        # 并行渲染多个模板时沿用请求上下文
+import copy              # 每次调用WebSocket客户端时使用浅拷贝
 import datetime          # 日期时间处理
-import hashlib           # 哈希算法，用于API签名
-import base64            # Base64编码，用于API认证
-import hmac              # HMAC签名算法
 import json              # JSON数据处理
-from urllib.parse import urlencode, quote_plus  # URL编码工具
-import ssl               # SSL安全连接
 import io                # 内存中的文件操作
+import logging           # 日志级别常量
+import math              # 估算重试等待时间
 import os                # 操作系统接口，用于环境变量
+import re                # 正则表达式，用于校验请求ID
+import sqlite3           # 幂等键登记不可用时降级处理
+import threading         # 延迟创建共享对象时加锁
+import unicodedata       # 构造下载文件名的ASCII回退
+import zipfile           # 多模板请求的文档打包
+from concurrent.futures import ThreadPoolExecutor  # 并行渲染多个模板
+from urllib.parse import quote  # 构造下载文件名的UTF-8编码
 
 # 导入第三方库
 from dotenv import load_dotenv  # 加载.env环境变量文件
-from flask import Flask, request, jsonify, send_file, render_template  # Flask Web框架
-from docx import Document       # python-docx库，用于处理Word文档
-from docx.shared import Inches  # Word文档尺寸设置（虽然当前未直接使用，但为扩展预留）
+from flask import Flask, current_app, request, jsonify, send_file, render_template  # Flask Web框架
+
+# 导入本项目模块
+from admission import AdmissionController, AdmissionRejected
+from deadline import (
+    DeadlineExceeded, REASON_DISCONNECTED, STAGE_INGEST, STAGE_RENDER, deadline_stage, end_deadline, start_deadline
+)
+from content_parsing import parse_model_reply
+from document_renderer import load_filled_document, render_precompiled, render_summary_document, resolve_placeholders
+from docx_pool import DocxPool, DocxPoolUnavailable
+from docx_stream import DOCX_STREAMING, DocxStream
+from incremental import INCREMENTAL_EXTRACTION, ChunkStore
+from idempotency import (
+    CONFLICT_IN_PROGRESS, IDEMPOTENCY_KEY_MAX_LENGTH, IdempotencyConflict, IdempotencyStore, request_fingerprint
+)
+from job_store import STATUS_DONE, STATUS_FAILED, STATUS_RUNNING, Job, JobBusy, JobStore
+from log_config import get_logger, log_event, redact, setup_logging
+from metrics import (
+    INFLIGHT_REQUESTS, REQUESTS_TOTAL, STAGE_JSON_PARSE, STAGE_PARSE_INPUT, STAGE_UPSTREAM,
+    record_cache_lookup, record_deadline_exceeded, render_metrics, stage_timer
+)
+from tracing import current_trace, end_trace, start_trace
+from render_cache import RenderCache, make_cache_key
+from singleflight import SingleFlight, client_signature, flight_key
+from template_registry import DEFAULT_TEMPLATE_ID, TemplateNotFoundError, TemplateRegistry
+from upload_encoding import UPLOAD_ERROR_KEY, DecompressingMiddleware
+from warmup import Warmup
 
 # 加载.env文件中的环境变量到系统环境中
 # 这样我们就可以通过os.getenv()读取配置信息，而不需要在代码中硬编码敏感信息
+# 必须在读取下面的配置常量之前执行；不会覆盖已经存在的环境变量
 load_dotenv()
 
-# ==================== 配置部分 ====================
-# 从环境变量获取科大讯飞星火大模型的API凭证
-# 这些信息需要在讯飞开放平台(www.xfyun.cn)注册应用后获得
-APPID = os.getenv("SPARK_APPID")           # 应用ID
-APISecret = os.getenv("SPARK_APISECRET")   # API密钥，用于签名
-APIKey = os.getenv("SPARK_APIKEY")         # API密钥，用于身份验证
+logger = get_logger(__name__)
 
+# ==================== 配置部分 ====================
 # 检查必要的API凭证是否已配置
+# 凭证需要在讯飞开放平台(www.xfyun.cn)注册应用后获得
 def check_api_credentials():
     """检查API凭证配置"""
     protocol = os.getenv("API_PROTOCOL", "HTTP").upper()
@@ -62,7 +92,7 @@ def check_api_credentials():
             return True
     else:
         # 检查WebSocket协议凭证
-        if not APPID or not APISecret or not APIKey:
+        if not all(os.getenv(var) for var in ("SPARK_APPID", "SPARK_APISECRET", "SPARK_APIKEY")):
             print("❌ 错误：缺少WebSocket协议API凭证配置")
             print("请确保已设置以下环境变量：")
             print("  - SPARK_APPID")
@@ -77,428 +107,32 @@ def check_api_credentials():
             print("✅ WebSocket协议API凭证配置检查通过")
             return True
 
-# 执行凭证检查
-credentials_ok = check_api_credentials()
-
-# 星火大模型API的服务器配置（可选，有默认值）
-SPARK_HOST = os.getenv("SPARK_HOST", "spark-api.xf-yun.com")      # API主机地址
-SPARK_DOMAIN = os.getenv("SPARK_DOMAIN", "generalv3.5")           # 模型版本域名
-SPARK_API_PATH = os.getenv("SPARK_API_PATH", "/v3.5/chat")        # API路径
-SPARK_URL = f"wss://{SPARK_HOST}{SPARK_API_PATH}"                 # 完整的WebSocket URL
-
-print(f"🔗 API配置: {SPARK_HOST}{SPARK_API_PATH} (域名: {SPARK_DOMAIN})")
-
-# ==================== 工具函数 ====================
-def generate_spark_auth_url(host, path, api_key, api_secret):
-    """
-    生成科大讯飞星火大模型的签名认证URL
-    
-    这个函数实现了讯飞API要求的签名认证流程：
-    1. 获取当前GMT时间
-    2. 构造待签名字符串
-    3. 使用HMAC-SHA256算法签名
-    4. Base64编码
-    5. 构造最终的认证URL
-    
-    参数:
-        host: API主机地址
-        path: API路径
-        api_key: API密钥
-        api_secret: API密钥
-    
-    返回:
-        完整的带认证参数的WebSocket URL
-    """
-    # 获取当前时间，必须是GMT格式（格林威治标准时间）
-    now = datetime.datetime.now(datetime.timezone.utc)
-    date = now.strftime('%a, %d %b %Y %H:%M:%S GMT')
-
-    # 构造待签名的字符串，格式固定
-    signature_origin = f"host: {host}\ndate: {date}\nGET {path} HTTP/1.1"
-
-    # 使用HMAC-SHA256算法对待签名字符串进行签名
-    signature_sha256 = hmac.new(
-        api_secret.encode('utf-8'),           # 密钥
-        signature_origin.encode('utf-8'),     # 待签名数据
-        hashlib.sha256                        # 签名算法
-    ).digest()
-    
-    # 将签名结果进行Base64编码
-    signature_base64 = base64.b64encode(signature_sha256).decode('utf-8')
-
-    # 构造Authorization头部信息
-    authorization_origin = (
-        f'api_key="{api_key}", '
-        f'algorithm="hmac-sha256", '
-        f'headers="host date request-line", '
-        f'signature="{signature_base64}"'
-    )
-    
-    # 对Authorization信息进行Base64编码
-    authorization_base64 = base64.b64encode(authorization_origin.encode('utf-8')).decode('utf-8')
-
-    # 构造URL参数
-    params = {
-        "host": host,
-        "date": date,
-        "authorization": authorization_base64
-    }
-    
-    # 返回完整的认证URL
-    return f"{SPARK_URL}?{urlencode(params)}"
-
-
-# ==================== WebSocket客户端类 ====================
-class SparkWebSocketClient:
-    """
-    科大讯飞星火大模型WebSocket客户端类
-    
-    这个类封装了与星火大模型的WebSocket通信逻辑，包括：
-    - 连接建立和认证
-    - 消息发送和接收
-    - 响应内容拼接
-    - 错误处理
-    """
-    
-    def __init__(self, appid, api_key, api_secret, domain, host, api_path):
-        """
-        初始化WebSocket客户端
-        
-        参数:
-            appid: 应用ID
-            api_key: API密钥
-            api_secret: API密钥
-            domain: 模型域名
-            host: 主机地址
-            api_path: API路径
-        """
-        self.appid = appid
-        self.api_key = api_key
-        self.api_secret = api_secret
-        self.domain = domain
-        self.host = host
-        self.api_path = api_path
-        
-        # 用于存储AI响应的变量
-        self.result_content = ""      # 拼接AI的完整响应内容
-        self.is_completed = False     # 标记响应是否完成
-        self.error_message = None     # 存储错误信息
-        self.user_input_prompt = ""   # 存储用户输入的提示词
-
-    def on_open(self, ws):
-        """
-        WebSocket连接建立时的回调函数
-        
-        当WebSocket连接成功建立后，这个函数会被自动调用
-        主要任务是构造请求消息并发送给星火大模型
-        """
-        print("WebSocket连接已建立，正在发送请求...")
-        
-        # 构建发送给星火大模型的请求消息（JSON格式）
-        message_json = {
-            "header": {
-                "app_id": self.appid,  # 应用ID
-            },
-            "parameter": {
-                "chat": {
-                    "domain": self.domain,      # 模型版本
-                    "temperature": 0.5,         # 控制生成内容的随机性，0-1之间，越小越确定
-                    "max_tokens": 4096,         # 最大生成Token数量
-                    "top_k": 4,                # 从k个最可能的词中选择
-                }
-            },
-            "payload": {
-                "message": {
-                    "text": [
-                        # 系统角色：定义AI助手的身份和任务
-                        {
-                            "role": "system", 
-                            "content": (
-                                "你是一个专业的企业年度总结报告智能助手。"
-                                "你的任务是根据用户提供的原始工作内容，"
-                                "提炼并总结出年度总结报告的关键信息，"
-                                "并以结构化的JSON格式输出。"
-                                "确保内容真实、简洁、客观。"
-                                "如果某个部分信息不足，请留空或简要说明。"
-                                "对于列表形式的字段，请输出JSON数组。"
-                            )
-                        },
-                        # 用户角色：包含用户输入和具体的JSON格式要求
-                        {
-                            "role": "user", 
-                            "content": self.user_input_prompt
-                        }
-                    ]
-                }
-            }
-        }
-        
-        # 将消息转换为JSON字符串并发送
-        try:
-            message_str = json.dumps(message_json, ensure_ascii=False)
-            print(f"发送请求消息: {message_str[:200]}...")  # 只打印前200个字符
-            ws.send(message_str)
-            print("请求消息发送成功")
-        except Exception as e:
-            self.error_message = f"发送请求消息失败: {str(e)}"
-            print(self.error_message)
-            self.is_completed = True
-            ws.close()
-
-    def on_message(self, ws, message):
-        """
-        接收到WebSocket消息时的回调函数
-
-        星火大模型会分多次发送响应内容，这个函数负责：
-        1. 解析每次收到的消息
-        2. 检查是否有错误
-        3. 拼接响应内容
-        4. 判断是否响应完成
-        """
-        try:
-            # 打印原始响应消息用于调试
-            print(f"收到WebSocket消息: {message}")
-
-            # 解析收到的JSON消息
-            response_data = json.loads(message)
-
-            # 检查响应数据结构
-            if 'header' not in response_data:
-                self.error_message = "响应数据缺少header字段"
-                print(f"错误: {self.error_message}")
-                print(f"响应数据结构: {response_data}")
-                self.is_completed = True
-                ws.close()
-                return
-
-            header = response_data['header']
-
-            # 检查API调用是否成功（错误码为0表示成功）
-            if header.get('code', -1) != 0:
-                error_code = header.get('code', '未知')
-                error_msg = header.get('message', '未知错误')
-                self.error_message = f"API请求失败，错误码: {error_code}, 错误信息: {error_msg}"
-                print(self.error_message)
-                self.is_completed = True
-                ws.close()
-                return
-
-            # 检查payload字段是否存在
-            if 'payload' not in response_data:
-                self.error_message = "响应数据缺少payload字段"
-                print(f"错误: {self.error_message}")
-                print(f"响应数据结构: {response_data}")
-                self.is_completed = True
-                ws.close()
-                return
-
-            payload = response_data['payload']
-
-            # 检查choices字段是否存在
-            if 'choices' not in payload:
-                self.error_message = "payload中缺少choices字段"
-                print(f"错误: {self.error_message}")
-                print(f"payload结构: {payload}")
-                self.is_completed = True
-                ws.close()
-                return
-
-            # 获取响应内容
-            choices = payload['choices']
-
-            # 检查status字段
-            if 'status' not in choices:
-                self.error_message = "choices中缺少status字段"
-                print(f"错误: {self.error_message}")
-                print(f"choices结构: {choices}")
-                self.is_completed = True
-                ws.close()
-                return
-
-            status = choices['status']  # 0：开始；1：进行中；2：结束
-
-            # 检查text字段
-            if 'text' not in choices or not choices['text']:
-                print("警告: choices中缺少text字段或text为空")
-                # 不是致命错误，继续处理
-            else:
-                # 拼接AI生成的内容（星火模型会分多次发送内容）
-                if len(choices['text']) > 0 and 'content' in choices['text'][0]:
-                    content = choices['text'][0]['content']
-                    self.result_content += content
-                    print(f"收到内容片段: {content[:100]}...")  # 只打印前100个字符
-
-            # 如果状态为2，表示响应结束
-            if status == 2:
-                print("AI响应已完成")
-                print(f"完整响应内容长度: {len(self.result_content)} 字符")
-                self.is_completed = True
-                ws.close()  # 关闭WebSocket连接
-
-        except json.JSONDecodeError as e:
-            self.error_message = f"JSON解析错误: {str(e)}"
-            print(f"JSON解析错误: {e}")
-            print(f"原始消息: {message}")
-            self.is_completed = True
-            ws.close()
-        except KeyError as e:
-            self.error_message = f"响应数据结构错误，缺少字段: {str(e)}"
-            print(f"KeyError: {e}")
-            print(f"响应数据: {response_data if 'response_data' in locals() else message}")
-            self.is_completed = True
-            ws.close()
-        except Exception as e:
-            self.error_message = f"处理响应消息时出错: {str(e)}"
-            print(f"未知错误: {e}")
-            print(f"错误类型: {type(e)}")
-            print(f"原始消息: {message}")
-            self.is_completed = True
-            ws.close()
-
-    def on_error(self, ws, error):
-        """WebSocket发生错误时的回调函数"""
-        self.error_message = f"WebSocket错误: {error}"
-        print(self.error_message)
-        self.is_completed = True
-
-    def on_close(self, ws, close_status_code, close_msg):
-        """WebSocket连接关闭时的回调函数"""
-        print(f"WebSocket连接已关闭. 状态码: {close_status_code}, 消息: {close_msg}")
-        self.is_completed = True  # 确保即使异常关闭也能标记为完成
-
-    def send_request(self, user_input_text):
-        """
-        发送请求到星火大模型并等待响应
-
-        这是客户端的主要方法，负责：
-        1. 重置状态变量
-        2. 生成认证URL
-        3. 构造提示词
-        4. 建立WebSocket连接
-        5. 等待响应完成
-        6. 返回结果或抛出异常
-
-        参数:
-            user_input_text: 用户输入的原始文本
-
-        返回:
-            AI生成的JSON格式响应内容
-        """
-        # 重置每次请求的状态
-        self.result_content = ""
-        self.is_completed = False
-        self.error_message = None
-
-        # 检查API凭证
-        if not self.appid or not self.api_key or not self.api_secret:
-            raise Exception("API凭证未配置，请检查环境变量 SPARK_APPID, SPARK_APIKEY, SPARK_APISECRET")
-
-        print(f"📝 用户输入长度: {len(user_input_text)} 字符")
-
-        # 生成带认证信息的WebSocket URL
-        try:
-            auth_url = generate_spark_auth_url(self.host, self.api_path, self.api_key, self.api_secret)
-            print(f"🔗 认证URL生成成功")
-        except Exception as e:
-            raise Exception(f"生成认证URL失败: {str(e)}")
-
-        # 构造包含JSON格式要求的完整提示词
-        self.user_input_prompt = self._create_spark_prompt(user_input_text)
-        print(f"📋 提示词构造完成，长度: {len(self.user_input_prompt)} 字符")
-
-        print(f"🌐 正在连接到星火大模型: {self.host}")
-
-        # 创建WebSocket应用实例
-        ws = websocket.WebSocketApp(
-            auth_url,
-            on_open=self.on_open,       # 连接建立时的回调
-            on_message=self.on_message, # 收到消息时的回调
-            on_error=self.on_error,     # 发生错误时的回调
-            on_close=self.on_close      # 连接关闭时的回调
-        )
-
-        try:
-            # 运行WebSocket连接，直到完成或出错
-            # 注意：cert_reqs=ssl.CERT_NONE 仅用于开发和调试
-            # 生产环境应该移除这个参数或设置为ssl.CERT_REQUIRED以确保安全
-            print("🚀 开始WebSocket连接...")
-            ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
-            print("🔚 WebSocket连接已结束")
-        except Exception as e:
-            self.error_message = f"WebSocket连接异常: {str(e)}"
-            print(f"❌ {self.error_message}")
-
-        # 检查是否有错误发生
-        if self.error_message:
-            raise Exception(self.error_message)
-
-        # 检查是否收到了响应内容
-        if not self.result_content.strip():
-            raise Exception("未收到AI模型的有效响应内容")
-
-        print(f"✅ 成功收到AI响应，长度: {len(self.result_content)} 字符")
-        return self.result_content
-
-    def _create_spark_prompt(self, user_input_text):
-        """
-        构造发送给星火大模型的提示词
-
-        这个方法创建一个详细的提示词，要求AI：
-        1. 分析用户输入的内容
-        2. 提取年度总结的关键信息
-        3. 按照指定的JSON格式输出结果
-
-        参数:
-            user_input_text: 用户输入的原始文本
+# 已生成文档的磁盘缓存配置
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", "render_cache")                          # 缓存目录
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))  # 总大小上限，0表示关闭
+RENDER_CACHE_MAX_AGE = int(os.getenv("RENDER_CACHE_MAX_AGE", "3600"))                      # 浏览器缓存时间（秒）
 
-        返回:
-            格式化的提示词字符串
-        """
-        prompt = f"""
-请根据以下用户输入的文本内容，生成一份年度总结报告的关键信息。
-如果某个字段没有对应内容，请使用空字符串或空列表。
-
-用户输入内容：
-『{user_input_text}』
-
-请严格按照以下JSON格式输出，确保字段名称不变：
-{{
-  "年度总结概述": "根据上述内容，总结年度工作亮点、整体表现和主要成就，用一句话概括。",
-  "主要成就与贡献": [
-    "条目1：具体完成了什么，取得了什么成果",
-    "条目2：...",
-    "..."
-  ],
-  "遇到的挑战及解决方案": [
-    "条目1：遇到了什么困难，如何解决的",
-    "条目2：...",
-    "..."
-  ],
-  "个人成长与学习": [
-    "条目1：学习了什么新知识/技能，如何应用",
-    "条目2：...",
-    "..."
-  ],
-  "未来展望与计划": [
-    "条目1：明年的主要工作目标",
-    "条目2：...",
-    "..."
-  ],
-  "姓名": "（请根据上下文推断或留空）",
-  "报告日期": "（请根据上下文推断或填写当前日期，格式如：YYYY年MM月DD日）"
-}}
-"""
-        return prompt
+# Word模板配置
+SUMMARY_TEMPLATE_DIR = os.getenv("SUMMARY_TEMPLATE_DIR", "report_templates")           # 多模板目录
+DEFAULT_TEMPLATE_PATH = os.getenv("DEFAULT_TEMPLATE_PATH", "年度总结模板.docx")          # 默认模板
+TEMPLATE_RELOAD_INTERVAL = float(os.getenv("TEMPLATE_RELOAD_INTERVAL", "2"))            # 检查模板变化的间隔（秒）
+MAX_TEMPLATES_PER_REQUEST = int(os.getenv("MAX_TEMPLATES_PER_REQUEST", "10"))            # 一个请求最多指定的模板数
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 4)))               # 并行渲染多个模板的线程数
 
+# 外部传入的请求ID格式
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
 
-# ==================== Flask Web应用 ====================
-# 创建Flask应用实例，指定模板文件夹位置
-app = Flask(__name__, template_folder='templates')
+# Word文档的MIME类型
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+ZIP_MIMETYPE = 'application/zip'
 
-# 初始化星火大模型客户端
-# 根据配置选择HTTP或WebSocket协议
+# ==================== 星火大模型客户端 ====================
 def create_spark_client():
-    """根据环境变量配置创建合适的星火大模型客户端"""
+    """
+    根据环境变量配置创建合适的星火大模型客户端
+
+    只导入所选协议需要的模块（HTTP协议不会导入websocket-client）
+    """
     protocol = os.getenv("API_PROTOCOL", "HTTP").upper()
 
     if protocol == "HTTP":
@@ -516,33 +150,183 @@ def create_spark_client():
                     "请在控制台 https://console.xfyun.cn/services/bmx1 获取APIpassword"
                 )
 
-            print(f"🔗 使用HTTP协议连接星火大模型X1")
+            log_event(logger, logging.INFO, "spark_client_created", protocol="http", model=model)
             return SparkHTTPClient(api_password, base_url, model)
 
         except ImportError:
-            print("❌ 无法导入HTTP客户端，回退到WebSocket协议")
+            log_event(logger, logging.WARNING, "spark_http_client_unavailable", fallback="websocket")
             protocol = "WEBSOCKET"
 
     if protocol == "WEBSOCKET":
         # 使用WebSocket协议（备用）
-        print(f"🔗 使用WebSocket协议连接星火大模型")
-        return SparkWebSocketClient(
-            APPID, APIKey, APISecret,
-            SPARK_DOMAIN, SPARK_HOST, SPARK_API_PATH
-        )
+        from spark_ws_client import SPARK_DOMAIN, SPARK_HOST, create_ws_client
+
+        log_event(logger, logging.INFO, "spark_client_created", protocol="websocket",
+                  host=SPARK_HOST, domain=SPARK_DOMAIN)
+        return create_ws_client()
 
     else:
         raise Exception(f"不支持的协议类型: {protocol}")
 
-# 创建客户端实例
-try:
-    spark_client = create_spark_client()
-except Exception as e:
-    print(f"❌ 创建星火大模型客户端失败: {e}")
-    spark_client = None
 
+class SummaryServices:
+    """
+    应用级共享对象：模板注册表、文档缓存、星火大模型客户端、准入控制、单飞合并、幂等键登记、任务表、
+    片段提取缓存和Word文档进程池
+
+    前三者都在第一次使用时才创建，启动时不编译模板、不导入客户端库。
+    客户端创建失败时记录错误，之后的请求直接返回配置错误，不再重复尝试。
+    """
 
-@app.route('/')
+    def __init__(self, spark_client=None):
+        """
+        参数:
+            spark_client: 指定使用的客户端（测试时可传入模拟客户端），为空时按环境变量创建
+        """
+        self._lock = threading.Lock()
+        self._template_registry = None
+        self._render_cache = None
+        self._render_executor = None
+        self._spark_client = spark_client
+        self._spark_client_failed = False
+        self.warmup = None  # 启动预热任务，由 create_app 设置
+        self.admission = AdmissionController()  # 限制同时调用大模型的请求数
+        self.singleflight = SingleFlight()      # 相同输入的并发请求只调用一次大模型
+        self.idempotency = IdempotencyStore()   # Idempotency-Key 对应的处理结果
+        self.jobs = JobStore()                  # 持久化的生成任务，worker退出后由其他进程接续
+        self.chunks = ChunkStore()              # 增量提取时各输入片段的提取结果
+        self.docx_pool = DocxPool()             # 在子进程中解析和渲染Word文档，不占用请求线程的GIL
+
+    @property
+    def template_registry(self):
+        """模板注册表，第一次使用时编译所有模板"""
+        if self._template_registry is None:
+            with self._lock:
+                if self._template_registry is None:
+                    self._template_registry = TemplateRegistry(
+                        SUMMARY_TEMPLATE_DIR, DEFAULT_TEMPLATE_PATH, TEMPLATE_RELOAD_INTERVAL
+                    )
+        return self._template_registry
+
+    @property
+    def render_cache(self):
+        """已生成文档的磁盘缓存"""
+        if self._render_cache is None:
+            with self._lock:
+                if self._render_cache is None:
+                    self._render_cache = RenderCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES)
+        return self._render_cache
+
+    @property
+    def render_executor(self):
+        """并行渲染多个模板的线程池"""
+        if self._render_executor is None:
+            with self._lock:
+                if self._render_executor is None:
+                    self._render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+        return self._render_executor
+
+    @property
+    def spark_client(self):
+        """星火大模型客户端，创建失败时为None"""
+        if self._spark_client is None and not self._spark_client_failed:
+            with self._lock:
+                if self._spark_client is None and not self._spark_client_failed:
+                    try:
+                        self._spark_client = create_spark_client()
+                    except Exception as e:
+                        log_event(logger, logging.ERROR, "spark_client_failed", error=str(e))
+                        self._spark_client_failed = True
+        return self._spark_client
+
+
+def _services():
+    """当前应用的共享对象"""
+    return current_app.extensions["summary"]
+
+
+# ==================== Flask Web应用 ====================
+def create_app(spark_client=None):
+    """
+    创建Flask应用实例
+
+    参数:
+        spark_client: 指定使用的星火大模型客户端（测试时可传入模拟客户端）
+
+    返回:
+        配置好路由的Flask应用
+    """
+    # 初始化结构化日志（请求路径上的日志经队列由后台线程写出）
+    setup_logging()
+    check_api_credentials()
+
+    # 创建Flask应用实例，指定模板文件夹位置
+    flask_app = Flask(__name__, template_folder='templates')
+    # 前端上传的文本经gzip压缩（Content-Encoding: gzip），解析表单前先解压
+    flask_app.wsgi_app = DecompressingMiddleware(flask_app.wsgi_app)
+    # 提取结果按模型输出的字段顺序返回（/extract），便于用户对照文档编辑
+    flask_app.json.sort_keys = False
+    services = SummaryServices(spark_client)
+    flask_app.extensions["summary"] = services
+    if DOCX_STREAMING and services.docx_pool.enabled:
+        # 进程池在子进程中整体生成文档，只把.docx字节传回，新生成的文档都不会流式发送（见 _render_document）
+        log_event(logger, logging.WARNING, "docx_streaming_disabled", reason="docx_pool",
+                  hint="DOCX_POOL_WORKERS=0 时未预编译的模板才流式发送")
+
+    flask_app.add_url_rule('/', view_func=index)
+    flask_app.add_url_rule('/ready', view_func=readiness, methods=['GET'])
+    flask_app.add_url_rule('/templates', view_func=list_templates, methods=['GET'])
+    flask_app.add_url_rule('/metrics', view_func=metrics_endpoint, methods=['GET'])
+    flask_app.add_url_rule('/generate_summary', view_func=generate_summary, methods=['POST'])
+    flask_app.add_url_rule('/extract', view_func=extract_content, methods=['POST'])
+    flask_app.add_url_rule('/render', view_func=render_document, methods=['POST'])
+    flask_app.add_url_rule('/download/<document_id>', view_func=download_document, methods=['GET'])
+    flask_app.add_url_rule('/jobs/<job_id>', view_func=job_status, methods=['GET'])
+    flask_app.add_url_rule('/jobs/<job_id>/document', view_func=job_document, methods=['GET'])
+
+    flask_app.before_request(begin_request_trace)
+    flask_app.before_request(reject_undecodable_upload)
+    flask_app.after_request(count_summary_requests)
+    flask_app.after_request(add_server_timing)
+    flask_app.teardown_request(finish_request_trace)
+
+    # 预热模板、python-docx和上游连接，完成前 /ready 返回503
+    services.warmup = Warmup(services)
+    services.warmup.start()
+
+    # 接续其他worker退出时未完成的任务
+    services.jobs.start_recovery(lambda job: _recover_job(flask_app, job))
+    return flask_app
+
+
+# 兼容旧的导入方式：
+# - `gunicorn app:app`、`from app import app` 得到按默认配置创建的应用
+# - `from app import SparkWebSocketClient` 等转到 spark_ws_client 模块
+_WS_CLIENT_EXPORTS = (
+    "SparkWebSocketClient", "generate_spark_auth_url",
+    "SPARK_HOST", "SPARK_DOMAIN", "SPARK_API_PATH", "SPARK_WS_SCHEME", "SPARK_URL",
+)
+_WS_CREDENTIAL_EXPORTS = {"APPID": "SPARK_APPID", "APIKey": "SPARK_APIKEY", "APISecret": "SPARK_APISECRET"}
+_default_app = None
+_default_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    global _default_app
+    if name == "app":
+        with _default_app_lock:
+            if _default_app is None:
+                _default_app = create_app()
+        return _default_app
+    if name in _WS_CLIENT_EXPORTS:
+        import spark_ws_client
+        return getattr(spark_ws_client, name)
+    if name in _WS_CREDENTIAL_EXPORTS:
+        return os.getenv(_WS_CREDENTIAL_EXPORTS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ==================== 路由 ====================
 def index():
     """
     首页路由
@@ -553,7 +337,105 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/generate_summary', methods=['POST'])
+def readiness():
+    """
+    就绪检查接口
+
+    启动预热完成后返回200，否则返回503和各步骤的进度，供负载均衡器判断是否转发流量
+    """
+    status = _services().warmup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+def list_templates():
+    """
+    模板列表接口
+
+    返回所有可用模板的ID和包含的占位符，前端据此生成模板下拉框
+    """
+    return jsonify({
+        "default": DEFAULT_TEMPLATE_ID,
+        "templates": [t.to_dict() for t in _services().template_registry.list()]
+    })
+
+
+def metrics_endpoint():
+    """
+    Prometheus指标接口
+
+    多worker部署时汇总所有worker进程的指标（需设置 PROMETHEUS_MULTIPROC_DIR）
+    """
+    body, content_type = render_metrics()
+    return body, 200, {'Content-Type': content_type}
+
+
+def begin_request_trace():
+    """为每个请求创建追踪对象，记录各阶段耗时"""
+    # 只接受格式安全的外部请求ID（例如负载均衡器生成的），否则重新生成
+    request_id = request.headers.get('X-Request-Id', '')
+    if not REQUEST_ID_PATTERN.match(request_id):
+        request_id = None
+    start_trace(request.endpoint or request.path, request_id)
+
+
+def reject_undecodable_upload():
+    """压缩的请求体不能解压（损坏、超过大小或压缩比上限、不支持的编码）时直接返回错误"""
+    error = request.environ.get(UPLOAD_ERROR_KEY)
+    if error is not None:
+        return SummaryError(error.message, error.status).to_response()
+    return None
+
+
+def count_summary_requests(response):
+    """按HTTP状态码统计年度总结生成请求"""
+    if request.endpoint == 'generate_summary':
+        REQUESTS_TOTAL.labels(status=str(response.status_code)).inc()
+    return response
+
+
+def add_server_timing(response):
+    """
+    在响应头中附加各阶段耗时（包括错误响应）
+
+    浏览器开发者工具的“网络 -> 时间”面板会直接展示 Server-Timing 中的各阶段
+    """
+    trace = current_trace()
+    if trace is not None:
+        trace.attributes['status'] = response.status_code
+        response.headers['Server-Timing'] = trace.server_timing_header()
+        response.headers['X-Request-Id'] = trace.request_id
+    return response
+
+
+def finish_request_trace(error=None):
+    """请求结束时关闭追踪，按配置写入追踪文件"""
+    end_trace()
+
+
+class SummaryError(Exception):
+    """
+    生成流程中需要直接返回给用户的错误
+
+    属性:
+        message: 返回给用户的错误信息
+        status: HTTP状态码
+        headers: 附加的响应头
+        extra: 附加在JSON响应中的其他字段
+    """
+
+    def __init__(self, message, status=500, headers=None, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.headers = headers or {}
+        self.extra = extra
+
+    def to_response(self):
+        """转换为Flask的JSON错误响应"""
+        return jsonify({"error": self.message, **self.extra}), self.status, self.headers
+
+
+@INFLIGHT_REQUESTS.track_inprogress()
 def generate_summary():
     """
     生成年度总结的API接口
@@ -565,210 +447,904 @@ def generate_summary():
     4. 加载Word模板并填充数据
     5. 生成并返回Word文档
 
+    ASGI部署（asgi.py）复用同样的步骤，只是把调用大模型改为异步、把文档处理放到线程池中
+
+    整个请求受期限（deadline.py）约束：超时返回504，客户端断开时取消调用大模型
+    携带 Idempotency-Key 请求头的重发请求直接使用第一次的提取结果（idempotency.py）
+    表单中有多个 template_id 字段时只调用一次大模型，用同一份提取结果渲染所有模板，打包为zip返回
+
     返回:
-        成功：Word文档文件
+        成功：Word文档文件（多个模板时为zip）
         失败：JSON格式的错误信息
     """
-    # 检查客户端是否初始化成功
-    if spark_client is None:
-        return jsonify({
-            "error": "星火大模型客户端初始化失败，请检查API配置。"
-                    "如使用HTTP协议，请确保配置了SPARK_HTTP_API_PASSWORD；"
-                    "如使用WebSocket协议，请确保配置了APPID、APIKEY、APISECRET。"
-        }), 500
+    environ = request.environ
+    start_deadline(client_socket=environ.get('gunicorn.socket') or environ.get('werkzeug.socket'))
+    idempotency_key = idempotency_token = None
+    job = None
+    try:
+        _check_spark_client()
+        idempotency_key = _idempotency_key()
+        _check_admission()
+        template_ids = _resolve_template_ids()
+        template_key = ",".join(template_ids)
+        user_input = _read_user_input(template_key)
+        extracted_content, idempotency_token = _begin_idempotent(idempotency_key, template_key, user_input)
+        if extracted_content is not None:
+            if len(template_ids) > 1:
+                documents = _render_bundle(template_ids, extracted_content)
+                return _mark_replayed(_bundle_response(extracted_content, documents))
+            cache_key, document_path, document = _render_document(template_ids[0], extracted_content)
+            response = _document_response(extracted_content, cache_key, document_path, document)
+            return _mark_replayed(response)
+
+        job = _start_job(template_ids[0], user_input, idempotency_key, idempotency_token)
+        if len(template_ids) > 1:
+            response = _run_bundle_job(job, template_ids, incremental=_incremental_requested())
+        else:
+            response = _document_response(*_run_job(job, incremental=_incremental_requested()))
+        if job.job_id is not None:
+            response.headers['X-Job-Id'] = job.job_id
+        return response
+    except DeadlineExceeded as e:
+        _fail_job(job, str(e))
+        return _deadline_error(e).to_response()
+    except SummaryError as e:
+        _fail_job(job, e.message)
+        return e.to_response()
+    except Exception as e:
+        return _unexpected_job_error(job, e).to_response()
+    finally:
+        _release_idempotent(idempotency_key, idempotency_token)
+        end_deadline()
+
 
-    user_input = ""
+def extract_content():
+    """
+    只提取内容的接口：调用星火大模型并返回提取结果（JSON），不生成文档
 
-    # ==================== 第1步：获取和处理用户输入 ====================
+    表单与 /generate_summary 相同。用户修改返回的条目后调用 /render 生成文档，不必再调用大模型；
+    使用与 /generate_summary 相同的 Idempotency-Key（模板和输入也相同）时直接返回那次的提取结果
+
+    返回:
+        成功：{"template_id": 第一个模板ID, "template_ids": 所有模板ID, "extracted_content": 提取结果}
+        失败：JSON格式的错误信息
+    """
+    environ = request.environ
+    start_deadline(client_socket=environ.get('gunicorn.socket') or environ.get('werkzeug.socket'))
+    idempotency_key = idempotency_token = None
     try:
-        # 检查是否有文本输入
-        if 'text_input' in request.form and request.form['text_input'].strip():
-            user_input = request.form['text_input'].strip()
-            print("收到文本输入，长度:", len(user_input))
-
-        # 检查是否有文件上传
-        elif 'file' in request.files:
-            file = request.files['file']
-
-            # 检查文件是否被选择
-            if file.filename == '':
-                return jsonify({"error": "未选择文件"}), 400
-
-            print(f"收到上传文件: {file.filename}")
-
-            # 处理.txt文件
-            if file.filename.endswith('.txt'):
-                try:
-                    # 读取文本文件内容，假设编码为UTF-8
-                    user_input = file.read().decode('utf-8')
-                except UnicodeDecodeError:
-                    return jsonify({"error": "文件编码错误，请确保为UTF-8格式"}), 400
-
-            # 处理.docx文件
-            elif file.filename.endswith('.docx'):
-                try:
-                    # 使用python-docx库读取Word文档
-                    doc = Document(file)
-
-                    # 提取所有段落的文本
-                    for para in doc.paragraphs:
-                        user_input += para.text + "\n"
-
-                    # 提取表格中的文本（如果有的话）
-                    for table in doc.tables:
-                        for row in table.rows:
-                            for cell in row.cells:
-                                user_input += cell.text + "\n"
-
-                except Exception as e:
-                    return jsonify({"error": f"读取Word文件失败: {str(e)}"}), 400
-            else:
-                return jsonify({"error": "不支持的文件类型，请上传 .txt 或 .docx 文件"}), 400
-        else:
-            return jsonify({"error": "请至少输入一些内容或上传一个文件"}), 400
+        _check_spark_client()
+        idempotency_key = _idempotency_key()
+        _check_admission()
+        template_ids = _resolve_template_ids()
+        template_key = ",".join(template_ids)
+        user_input = _read_user_input(template_key)
+        extracted_content, idempotency_token = _begin_idempotent(idempotency_key, template_key, user_input)
+        if extracted_content is not None:
+            return _mark_replayed(_extraction_response(template_ids, extracted_content))
+
+        extracted_content = _extract(user_input, _incremental_requested())
+        _complete_idempotent(idempotency_key, idempotency_token, extracted_content)
+        return _extraction_response(template_ids, extracted_content)
+    except DeadlineExceeded as e:
+        return _deadline_error(e).to_response()
+    except SummaryError as e:
+        return e.to_response()
+    finally:
+        _release_idempotent(idempotency_key, idempotency_token)
+        end_deadline()
+
+
+def render_document():
+    """
+    按用户修改后的提取结果生成文档，不调用大模型
 
-        # 检查输入内容是否为空
-        if not user_input.strip():
-            return jsonify({"error": "输入内容为空，请提供有效信息"}), 400
+    请求体为JSON：{"extracted_content": {...}, "template_id": "可选"}，extracted_content 通常来自 /extract；
+    用 "template_ids": [...] 指定多个模板时打包为zip返回。
+    只做模板填充和保存，相同模板和内容的文档直接使用缓存
 
-        print(f"处理后的用户输入长度: {len(user_input)} 字符")
+    返回:
+        成功：Word文档文件（多个模板时为zip）
+        失败：JSON格式的错误信息
+    """
+    environ = request.environ
+    start_deadline(client_socket=environ.get('gunicorn.socket') or environ.get('werkzeug.socket'))
+    try:
+        template_ids, extracted_content = _read_edited_content()
+        if len(template_ids) > 1:
+            return _bundle_response(extracted_content, _render_bundle(template_ids, extracted_content))
+        cache_key, document_path, document = _render_document(template_ids[0], extracted_content)
+        return _document_response(extracted_content, cache_key, document_path, document)
+    except DeadlineExceeded as e:
+        return _deadline_error(e).to_response()
+    except SummaryError as e:
+        return e.to_response()
+    finally:
+        end_deadline()
 
-    except Exception as e:
-        print(f"处理用户输入时出错: {e}")
-        return jsonify({"error": f"处理输入时出错: {str(e)}"}), 500
 
-    # ==================== 第2步：调用星火大模型分析内容 ====================
+def _extraction_response(template_ids, extracted_content):
+    """/extract 的响应"""
+    return jsonify({"template_id": template_ids[0], "template_ids": template_ids, "extracted_content": extracted_content})
+
+
+def _read_edited_content():
+    """
+    读取 /render 请求中的模板ID和提取结果
+
+    每个字段的值必须是字符串（或null）或字符串列表，与大模型返回的结构一致
+
+    返回:
+        (模板ID列表, 提取结果字典)
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('extracted_content'), dict):
+        raise SummaryError("请求体应为JSON对象，并包含 extracted_content 字典", 400)
+    extracted_content = body['extracted_content']
+    for field, value in extracted_content.items():
+        if value is None or isinstance(value, str):
+            continue
+        if isinstance(value, list) and all(isinstance(item, str) for item in value):
+            continue
+        raise SummaryError(f"字段 {field} 应为字符串或字符串列表", 400, field=field)
+    requested = body.get('template_ids')
+    if requested is None:
+        requested = [body.get('template_id') or '']
+    if not isinstance(requested, list) or not all(isinstance(item, str) for item in requested):
+        raise SummaryError("template_ids 应为模板ID列表", 400)
+    template_ids = list(dict.fromkeys(item.strip() for item in requested if item.strip())) or [DEFAULT_TEMPLATE_ID]
+    if len(template_ids) > MAX_TEMPLATES_PER_REQUEST:
+        raise SummaryError(f"一次最多选择 {MAX_TEMPLATES_PER_REQUEST} 个模板", 400)
+    return [_resolve_template_id(template_id) for template_id in template_ids], extracted_content
+
+
+def _deadline_error(e):
+    """
+    超过期限或客户端断开时返回的错误，附带已完成（或被中断）的各阶段耗时
+
+    参数:
+        e: DeadlineExceeded
+
+    返回:
+        SummaryError（超时为504，客户端断开为499，后者只用于日志和统计）
+    """
+    record_deadline_exceeded(e.stage, e.reason)
+    trace = current_trace()
+    timings = {name: round(seconds * 1000, 1) for name, seconds in trace.stage_totals().items()} if trace else {}
+    log_event(logger, logging.WARNING, "summary_cancelled", stage=e.stage, reason=e.reason,
+              elapsed_ms=round(e.elapsed * 1000, 1), timings=timings)
+
+    status = 499 if e.reason == REASON_DISCONNECTED else 504
+    return SummaryError(
+        str(e) if status == 499 else f"生成超时（{e.stage}阶段），请稍后重试或缩短输入内容", status,
+        stage=e.stage, reason=e.reason, elapsed_ms=round(e.elapsed * 1000, 1), timings_ms=timings
+    )
+
+
+def _check_spark_client():
+    """检查客户端是否初始化成功"""
+    if _services().spark_client is None:
+        raise SummaryError(
+            "星火大模型客户端初始化失败，请检查API配置。"
+            "如使用HTTP协议，请确保配置了SPARK_HTTP_API_PASSWORD；"
+            "如使用WebSocket协议，请确保配置了APPID、APIKEY、APISECRET。"
+        )
+
+
+def _check_admission():
+    """排队已满时在读取输入之前直接返回429"""
     try:
-        print("正在调用星火大模型分析内容...")
+        _services().admission.precheck()
+    except AdmissionRejected as e:
+        raise _admission_error(e)
 
-        # 发送请求到星火大模型并获取响应
-        spark_json_str = spark_client.send_request(user_input)
 
-        print("收到星火大模型响应，长度:", len(spark_json_str))
+def _admission_error(e):
+    """
+    准入控制拒绝时返回的错误
 
-        # 有时星火模型会返回markdown格式的代码块，需要清理
-        # 例如：```json\n{...}\n``` 需要提取中间的JSON部分
-        if spark_json_str.strip().startswith("```json") and spark_json_str.strip().endswith("```"):
-            spark_json_str = spark_json_str.strip()[7:-3].strip()
-            print("清理了markdown代码块格式")
+    参数:
+        e: AdmissionRejected
 
-        # 解析AI返回的JSON数据
-        extracted_content = json.loads(spark_json_str)
-        print("成功解析AI返回的JSON数据")
+    返回:
+        SummaryError（429，Retry-After为预计有空闲名额的秒数）
+    """
+    return SummaryError(
+        f"当前生成请求较多，请在 {e.retry_after} 秒后重试", 429,
+        headers={"Retry-After": str(e.retry_after)}, reason=e.reason, retry_after=e.retry_after
+    )
 
-    except json.JSONDecodeError as e:
-        print(f"JSON解析错误: {e}")
-        print(f"原始响应内容: {spark_json_str}")
-        return jsonify({"error": "AI模型返回内容格式错误，请稍后重试或优化输入"}), 500
 
-    except Exception as e:
-        print(f"调用星火大模型失败: {e}")
-        return jsonify({"error": f"AI模型服务调用失败: {str(e)}"}), 500
+def _idempotency_key():
+    """
+    读取 Idempotency-Key 请求头（允许带引号），未提供或登记关闭时返回None
+
+    抛出:
+        SummaryError（400，格式无效）
+    """
+    key = request.headers.get('Idempotency-Key', '').strip().strip('"')
+    if not key or not _services().idempotency.enabled:
+        return None
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH or not key.isprintable():
+        raise SummaryError(f"Idempotency-Key 格式无效（最长{IDEMPOTENCY_KEY_MAX_LENGTH}个可打印字符）", 400)
+    return key
+
 
-    # ==================== 第3步：加载Word模板并填充数据 ====================
+def _begin_idempotent(key, template_id, user_input):
+    """
+    登记幂等键
+
+    返回:
+        (同一键已保存的提取结果, None)；本请求新登记时返回 (None, 令牌)，未提供键或登记不可用时返回 (None, None)
+
+    抛出:
+        SummaryError（409仍在处理，422内容不同）
+    """
+    if key is None:
+        return None, None
     try:
-        # 检查模板文件是否存在
-        template_path = '年度总结模板.docx'
-        if not os.path.exists(template_path):
-            return jsonify({
-                "error": "年度总结模板文件不存在，请确保 '年度总结模板.docx' 在应用根目录"
-            }), 500
-
-        print("正在加载Word模板...")
-
-        # 加载Word模板文档
-        doc = Document(template_path)
-
-        def replace_placeholder(paragraph, placeholder, value):
-            """
-            替换段落中的占位符
-
-            这个内部函数负责：
-            1. 检查段落中是否包含指定的占位符
-            2. 根据值的类型进行格式化（列表转换为带项目符号的文本）
-            3. 替换占位符为实际内容
-
-            参数:
-                paragraph: Word文档的段落对象
-                placeholder: 要替换的占位符（如：[[年度总结概述]]）
-                value: 替换的值（可能是字符串或列表）
-            """
-            # 处理不同类型的值
-            if isinstance(value, list):
-                # 将列表转换为带项目符号的多行文本
-                formatted_value = "\n".join([f"• {item}" for item in value if item and item.strip()])
-                if not formatted_value:  # 如果列表为空
-                    formatted_value = "暂无相关内容"
+        return _services().idempotency.begin(key, request_fingerprint(template_id, user_input))
+    except IdempotencyConflict as e:
+        raise _idempotency_error(e)
+    except sqlite3.Error as e:
+        # 登记文件不可用时按普通请求处理
+        log_event(logger, logging.WARNING, "idempotency_store_failed", op="begin", error=str(e))
+        return None, None
+
+
+def _complete_idempotent(key, token, extracted_content):
+    """保存提取结果，之后同一键的请求不再调用大模型；只更新本请求登记的键（token 为None时跳过）"""
+    if key is None or token is None:
+        return
+    try:
+        _services().idempotency.complete(key, token, extracted_content)
+    except sqlite3.Error as e:
+        log_event(logger, logging.WARNING, "idempotency_store_failed", op="complete", error=str(e))
+
+
+def _release_idempotent(key, token):
+    """
+    请求结束：本请求登记的键未保存结果（处理失败）时删除登记，允许客户端重试
+
+    登记时返回409/422、直接复用已保存结果的请求没有令牌，不删除任何登记
+    """
+    if key is None or token is None:
+        return
+    try:
+        _services().idempotency.release(key, token)
+    except sqlite3.Error as e:
+        log_event(logger, logging.WARNING, "idempotency_store_failed", op="release", error=str(e))
+
+
+def _start_job(template_id, user_input, idempotency_key, idempotency_token=None):
+    """
+    登记生成任务；同一幂等键有中断的任务时接续该任务
+
+    参数:
+        idempotency_token: 本请求登记幂等键的令牌，保存提取结果时用于更新登记
+
+    返回:
+        Job
+
+    抛出:
+        SummaryError（409，同一幂等键的任务正由其他进程处理）
+    """
+    try:
+        job = _services().jobs.start(template_id, user_input, idempotency_key)
+    except JobBusy:
+        raise _idempotency_error(IdempotencyConflict(CONFLICT_IN_PROGRESS))
+    except sqlite3.Error as e:
+        # 任务表不可用时只在内存中处理，不影响生成
+        log_event(logger, logging.WARNING, "job_store_failed", op="start", error=str(e))
+        job = Job(None, template_id, user_input, idempotency_key)
+    job.idempotency_token = idempotency_token
+    return job
+
+
+def _run_job(job, stream=DOCX_STREAMING, incremental=False):
+    """
+    按阶段执行生成任务，已完成的阶段直接使用任务中保存的结果（接续的任务不再重复调用大模型）
+
+    参数:
+        job: 生成任务
+        stream: 新渲染的文档是否流式发送，见 _render_document()
+        incremental: 是否只对改动的输入片段调用大模型，见 _extract_incremental()
+
+    返回:
+        (提取结果, 缓存键, 缓存文件路径或None, 新渲染的文档或None)
+    """
+    _extract_job(job, incremental)
+
+    jobs = _services().jobs
+    if job.document is not None:
+        return job.extracted, job.document_id, None, job.document
+
+    cache_key, document_path, document = _render_document(job.template_id, job.extracted, stream)
+    if job.job_id is not None:
+        if isinstance(document, DocxStream):
+            # 流式发送的文档不保存到任务表，下载任务文档时按提取结果重新渲染（通常命中缓存）
+            jobs.save_document(job, cache_key, None)
+        elif document is None:
+            with open(document_path, 'rb') as f:
+                jobs.save_document(job, cache_key, f.read())
+        else:
+            jobs.save_document(job, cache_key, document)
+    return job.extracted, cache_key, document_path, document
+
+
+def _extract_job(job, incremental=False):
+    """任务的提取阶段：还没有提取结果时调用大模型并保存结果"""
+    if job.extracted is None:
+        _save_extracted(job, _extract(job.user_input, incremental))
+    return job.extracted
+
+
+def _run_bundle_job(job, template_ids, incremental=False):
+    """
+    多模板的生成任务：提取一次，渲染所有模板并打包
+
+    任务表只记录第一个模板（与流式发送的文档一样不保存文档字节），
+    worker退出后接续的任务和 GET /jobs/<任务ID>/document 得到第一个模板的文档；
+    携带同一幂等键的重试使用已保存的提取结果重新打包所有模板
+
+    返回:
+        zip文件的响应
+    """
+    extracted_content = _extract_job(job, incremental)
+    documents = _render_bundle(template_ids, extracted_content)
+    if job.job_id is not None:
+        _services().jobs.save_document(job, documents[0][1], None)
+    return _bundle_response(extracted_content, documents)
+
+
+def _save_extracted(job, extracted_content):
+    """保存提取结果：任务进入extracted阶段，同一幂等键的重试可直接使用"""
+    _services().jobs.save_extracted(job, extracted_content)
+    _complete_idempotent(job.idempotency_key, job.idempotency_token, extracted_content)
+
+
+def _fail_job(job, error):
+    """生成失败的任务不再接续（已保存文档的任务保持完成状态）"""
+    if job is not None and job.job_id is not None and job.status == STATUS_RUNNING:
+        _services().jobs.fail(job, error)
+
+
+def _unexpected_job_error(job, e):
+    """
+    生成过程中未预料的错误（任务表或片段缓存不可用、模型返回的结构异常等）
+
+    任务同样标记为失败并释放租约，否则心跳线程会一直为它续约，任务停留在running，其他进程也无法接续
+
+    参数:
+        job: 生成任务（还没有登记时为None）
+        e: 异常
+
+    返回:
+        SummaryError（500）
+    """
+    log_event(logger, logging.ERROR, "generate_failed", job=getattr(job, "job_id", None),
+              error=str(e), error_type=type(e).__name__)
+    _fail_job(job, str(e))
+    return SummaryError(f"生成年度总结失败: {str(e)}")
+
+
+def _recover_job(flask_app, job):
+    """恢复线程调用：在应用上下文中从任务最后完成的阶段继续"""
+    with flask_app.app_context():
+        try:
+            _run_job(job, stream=False)
+        except (SummaryError, DeadlineExceeded) as e:
+            _fail_job(job, str(e))
+            return
+        # 幂等键的登记属于原来的请求（恢复线程没有令牌）；同一幂等键的重试会登记新的键，
+        # 并由 _start_job 取得这个已完成的任务，不再调用大模型
+        log_event(logger, logging.INFO, "job_recovered", job=job.job_id, attempts=job.attempts)
+
+
+def _idempotency_error(e):
+    """
+    同一幂等键不能处理时返回的错误
+
+    参数:
+        e: IdempotencyConflict
+
+    返回:
+        SummaryError（仍在处理为409，Retry-After按平均调用耗时估算；内容不同为422）
+    """
+    if e.reason == CONFLICT_IN_PROGRESS:
+        retry_after = max(1, math.ceil(_services().admission.service_time - e.elapsed))
+        return SummaryError(
+            f"相同的请求正在处理中，请在 {retry_after} 秒后重试", 409,
+            headers={"Retry-After": str(retry_after)}, reason=e.reason, retry_after=retry_after
+        )
+    return SummaryError(str(e), 422, reason=e.reason)
+
+
+def _mark_replayed(response):
+    """标记响应来自已保存的结果"""
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _resolve_template_ids():
+    """
+    检查表单中请求的所有模板（template_id 字段可以出现多次，重复的只算一次）
+
+    返回:
+        模板ID列表（按请求中的顺序，未指定时只有默认模板）
+    """
+    requested = [value.strip() for value in request.form.getlist('template_id') if value.strip()]
+    template_ids = list(dict.fromkeys(requested)) or [DEFAULT_TEMPLATE_ID]
+    if len(template_ids) > MAX_TEMPLATES_PER_REQUEST:
+        raise SummaryError(f"一次最多选择 {MAX_TEMPLATES_PER_REQUEST} 个模板", 400)
+    return [_resolve_template_id(template_id) for template_id in template_ids]
+
+
+def _resolve_template_id(requested=None):
+    """
+    检查请求的模板是否存在（未指定时使用默认模板）
+
+    参数:
+        requested: 请求的模板ID，为None时读取表单字段 template_id
+
+    返回:
+        模板ID
+    """
+    if requested is None:
+        requested = request.form.get('template_id', '')
+    template_id = requested.strip() or DEFAULT_TEMPLATE_ID
+    try:
+        _services().template_registry.get(template_id)
+    except TemplateNotFoundError:
+        if template_id == DEFAULT_TEMPLATE_ID:
+            raise SummaryError("年度总结模板文件不存在，请确保 '年度总结模板.docx' 在应用根目录")
+        raise SummaryError(
+            f"模板不存在: {template_id}", 400,
+            available_templates=[t.template_id for t in _services().template_registry.list()]
+        )
+    return template_id
+
+
+def _read_user_input(template_id):
+    """
+    第1步：获取和处理用户输入（文本框或上传的.txt/.docx文件）
+
+    返回:
+        用户输入的文本
+    """
+    with deadline_stage(STAGE_INGEST), stage_timer(STAGE_PARSE_INPUT):
+        try:
+            # 检查是否有文本输入
+            if 'text_input' in request.form and request.form['text_input'].strip():
+                user_input = request.form['text_input'].strip()
+                input_source = "text"
+
+            # 检查是否有文件上传
+            elif 'file' in request.files:
+                file = request.files['file']
+
+                # 检查文件是否被选择
+                if file.filename == '':
+                    raise SummaryError("未选择文件", 400)
+
+                input_source = os.path.splitext(file.filename)[1].lower() or "file"
+
+                # 处理.txt文件
+                if file.filename.endswith('.txt'):
+                    try:
+                        # 读取文本文件内容，假设编码为UTF-8
+                        user_input = file.read().decode('utf-8')
+                    except UnicodeDecodeError:
+                        raise SummaryError("文件编码错误，请确保为UTF-8格式", 400)
+
+                # 处理.docx文件
+                elif file.filename.endswith('.docx'):
+                    try:
+                        # 使用python-docx库读取Word文档，提取段落和表格中的文本（在进程池中执行）
+                        user_input = _services().docx_pool.extract_text(file.read())
+
+                    except DocxPoolUnavailable as e:
+                        raise _docx_pool_error(e)
+                    except Exception as e:
+                        raise SummaryError(f"读取Word文件失败: {str(e)}", 400)
+                else:
+                    raise SummaryError("不支持的文件类型，请上传 .txt 或 .docx 文件", 400)
             else:
-                # 确保值是字符串，如果为空则提供默认值
-                formatted_value = str(value or '暂无相关内容')
-
-            # 在段落中查找并替换占位符
-            if placeholder in paragraph.text:
-                paragraph.text = paragraph.text.replace(placeholder, formatted_value)
-                print(f"已替换占位符: {placeholder}")
-
-            # 注意：直接替换paragraph.text可能会丢失原有的格式
-            # 更复杂的实现需要遍历paragraph.runs来保持格式
-            # 但为了简化，这里采用直接替换的方式
-
-        print("正在填充模板数据...")
-
-        # 遍历文档中的所有段落，查找并替换占位符
-        for paragraph in doc.paragraphs:
-            replace_placeholder(paragraph, '[[年度总结概述]]', extracted_content.get('年度总结概述'))
-            replace_placeholder(paragraph, '[[主要成就与贡献]]', extracted_content.get('主要成就与贡献'))
-            replace_placeholder(paragraph, '[[遇到的挑战及解决方案]]', extracted_content.get('遇到的挑战及解决方案'))
-            replace_placeholder(paragraph, '[[个人成长与学习]]', extracted_content.get('个人成长与学习'))
-            replace_placeholder(paragraph, '[[未来展望与计划]]', extracted_content.get('未来展望与计划'))
-            replace_placeholder(paragraph, '[[您的姓名]]', extracted_content.get('姓名', '未填写'))
-            replace_placeholder(paragraph, '[[报告日期]]',
-                              extracted_content.get('报告日期', datetime.date.today().strftime('%Y年%m月%d日')))
-
-        # 处理表格中的占位符（如果模板中有表格）
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        replace_placeholder(paragraph, '[[您的姓名]]', extracted_content.get('姓名', '未填写'))
-                        replace_placeholder(paragraph, '[[报告日期]]',
-                                          extracted_content.get('报告日期', datetime.date.today().strftime('%Y年%m月%d日')))
-
-        print("模板数据填充完成")
+                raise SummaryError("请至少输入一些内容或上传一个文件", 400)
+
+            # 检查输入内容是否为空
+            if not user_input.strip():
+                raise SummaryError("输入内容为空，请提供有效信息", 400)
+
+            log_event(logger, logging.INFO, "input_received", source=input_source,
+                      chars=len(user_input), template=template_id)
+            return user_input
+
+        except SummaryError:
+            raise
+        except Exception as e:
+            log_event(logger, logging.ERROR, "input_failed", error=str(e))
+            raise SummaryError(f"处理输入时出错: {str(e)}")
+
+
+def _extract(user_input, incremental=False):
+    """
+    第2步：调用星火大模型并解析提取结果
 
+    参数:
+        user_input: 用户输入
+        incremental: 是否只对改动的输入片段调用大模型，见 _extract_incremental()
+
+    返回:
+        提取结果字典
+    """
+    if incremental:
+        return _extract_incremental(user_input)
+    return _parse_upstream_reply(_call_upstream(user_input))
+
+
+def _incremental_requested():
+    """
+    本次请求是否使用增量提取：表单字段 incremental 为 1/0 时按其指定，否则按 INCREMENTAL_EXTRACTION
+
+    片段缓存关闭（INCREMENTAL_DB为空）时总是完整提取
+    """
+    if not _services().chunks.enabled:
+        return False
+    value = request.form.get('incremental', '').strip()
+    if value in ('0', '1'):
+        return value == '1'
+    return INCREMENTAL_EXTRACTION
+
+
+def _call_upstream(user_input, prompt=None):
+    """
+    第2步：调用星火大模型分析内容
+
+    参数:
+        user_input: 用户输入
+        prompt: 完整的提示词（增量提取时），为None时由客户端按用户输入构造
+
+    返回:
+        模型回复原文
+    """
+    services = _services()
+    key = flight_key(user_input if prompt is None else prompt, client_signature(services.spark_client))
+    try:
+        # 相同输入正在调用时等待其结果，否则获得准入名额后调用（等待、排队和调用都计入upstream阶段的期限）
+        with deadline_stage(STAGE_UPSTREAM) as deadline:
+            spark_json_str = services.singleflight.do(
+                key, lambda: _send_upstream(services, user_input, deadline, prompt), deadline
+            )
+    except DeadlineExceeded:
+        raise
+    except AdmissionRejected as e:
+        raise _admission_error(e)
     except Exception as e:
-        print(f"处理Word模板时出错: {e}")
-        return jsonify({"error": f"处理Word模板失败: {str(e)}"}), 500
+        log_event(logger, logging.ERROR, "upstream_failed", error=str(e))
+        raise SummaryError(f"AI模型服务调用失败: {str(e)}")
+
+    log_event(logger, logging.INFO, "upstream_done", chars=len(spark_json_str))
+    return spark_json_str
+
+
+def _request_client(services):
+    """
+    本次调用使用的星火大模型客户端
 
-    # ==================== 第4步：生成Word文档并返回给用户 ====================
+    WebSocket客户端把单次调用的状态（回复内容、错误等）保存在实例上，而请求线程、异步流程的线程池
+    和任务恢复线程共用同一个客户端，因此每次调用使用一个浅拷贝，互不干扰；其他客户端直接共用
+    """
+    from spark_ws_client import SparkWebSocketClient
+
+    client = services.spark_client
+    if isinstance(client, SparkWebSocketClient):
+        return copy.copy(client)
+    return client
+
+
+def _send_upstream(services, user_input, deadline, prompt=None):
+    """获得准入名额后发送请求到星火大模型并获取响应"""
+    client = _request_client(services)
+    with services.admission.slot(deadline), stage_timer(STAGE_UPSTREAM):
+        if prompt is None:
+            return client.send_request(user_input)
+        return client.send_request(user_input, prompt=prompt)
+
+
+def _extract_incremental(user_input):
+    """
+    第2步（增量模式）：只把缓存中没有结果的输入片段发给星火大模型，与缓存的结果按原文顺序合并
+
+    输入与之前提交的完全相同时不调用大模型，见 incremental.py
+
+    返回:
+        合并后的提取结果（与完整提取的结构相同）
+    """
+    services = _services()
+    plan = services.chunks.plan(user_input, client_signature(services.spark_client))
+    if plan.needs_call:
+        plan.apply(_parse_upstream_reply(_call_upstream(user_input, plan.prompt())))
+    return plan.merge()
+
+
+def _parse_upstream_reply(spark_json_str):
+    """
+    清理可能的markdown代码块格式并解析AI返回的JSON数据
+
+    返回:
+        解析后的字典
+    """
     try:
-        print("正在生成最终的Word文档...")
+        with stage_timer(STAGE_JSON_PARSE):
+            return parse_model_reply(spark_json_str)
+    except json.JSONDecodeError as e:
+        log_event(logger, logging.ERROR, "upstream_json_error", error=str(e), response=redact(spark_json_str))
+        raise SummaryError("AI模型返回内容格式错误，请稍后重试或优化输入")
 
-        # 将文档保存到内存中的字节流
-        # 这样可以直接返回给用户，而不需要在服务器上创建临时文件
-        byte_io = io.BytesIO()
-        doc.save(byte_io)
-        byte_io.seek(0)  # 将文件指针移到开头，准备读取
 
+def _render_document(template_id, extracted_content, stream=DOCX_STREAMING):
+    """
+    第3步：加载Word模板并填充数据
+
+    参数:
+        template_id: 模板ID
+        extracted_content: AI返回并解析后的字典
+        stream: 为True时只填充模板，返回DocxStream，在发送响应时才序列化（docx_stream.py）；
+                模板已预编译（拼接XML片段，不解析文档）或启用Word文档进程池时忽略，文档整体生成。
+                进程池默认启用，因此只有 DOCX_POOL_WORKERS=0 且模板没有预编译产物时才会流式发送
+
+    返回:
+        (缓存键, 缓存文件路径或None, 新渲染的文档字节或DocxStream，命中缓存时为None)
+    """
+    # 渲染是CPU阶段，无法中途打断：进入前已超时或客户端已断开时不再渲染
+    with deadline_stage(STAGE_RENDER):
+        try:
+            # 从模板注册表中获取预编译模板
+            template = _services().template_registry.get(template_id)
+
+            # 相同模板 + 相同内容的文档直接复用磁盘缓存，不再重新渲染
+            cache_key = make_cache_key(template.sha256, resolve_placeholders(extracted_content))
+            document_path = _services().render_cache.get(cache_key)
+            record_cache_lookup(document_path is not None)
+
+            if document_path:
+                log_event(logger, logging.INFO, "render_cache_hit", key=cache_key[:12])
+                return cache_key, document_path, None
+            if template.segments is not None:
+                if stream:
+                    log_event(logger, logging.DEBUG, "docx_streaming_skipped", template=template_id, reason="precompiled")
+                return cache_key, None, render_precompiled(template, extracted_content)
+            docx_pool = _services().docx_pool
+            if docx_pool.enabled:
+                if stream:
+                    log_event(logger, logging.DEBUG, "docx_streaming_skipped", template=template_id, reason="docx_pool")
+                return cache_key, None, docx_pool.render(template.open_stream().getvalue(), extracted_content)
+            if stream:
+                return cache_key, None, DocxStream(load_filled_document(template.open_stream(), extracted_content))
+            return cache_key, None, render_summary_document(template.open_stream(), extracted_content)
+
+        except DocxPoolUnavailable as e:
+            raise _docx_pool_error(e)
+        except Exception as e:
+            log_event(logger, logging.ERROR, "render_failed", template=template_id, error=str(e))
+            raise SummaryError(f"处理Word模板失败: {str(e)}")
+
+
+def _docx_pool_error(e):
+    """Word文档进程池损坏时返回的错误（503，进程池已丢弃，重试时重新创建）"""
+    log_event(logger, logging.ERROR, "docx_pool_unavailable", error=str(e))
+    return SummaryError("文档处理服务暂时不可用，请稍后重试", 503, headers={"Retry-After": "1"})
+
+
+def _document_response(extracted_content, cache_key, document_path, document):
+    """
+    第4步：生成Word文档并返回给用户
+
+    参数:
+        extracted_content: AI返回并解析后的字典
+        cache_key: 文档的缓存键
+        document_path: 命中缓存时的文件路径
+        document: 新渲染的文档字节或DocxStream
+
+    返回:
+        Flask响应对象
+    """
+    try:
         # 构造下载文件名
         # 格式：姓名-年度总结-日期.docx
         summary_name = extracted_content.get('姓名', '用户')
         summary_date = datetime.date.today().strftime('%Y%m%d')
         download_filename = f"{summary_name}-年度总结-{summary_date}.docx"
 
-        print(f"文档生成完成，文件名: {download_filename}")
+        render_cache = _services().render_cache
+        if isinstance(document, DocxStream):
+            return _stream_document(document, cache_key, download_filename)
+        if not document_path:
+            if render_cache.enabled:
+                # 写入缓存后从磁盘发送，WSGI服务器支持时可走sendfile零拷贝
+                document_path = render_cache.put(cache_key, document)
+            else:
+                # 缓存关闭时直接从内存返回
+                return send_file(
+                    io.BytesIO(document),
+                    mimetype=DOCX_MIMETYPE,
+                    as_attachment=True,
+                    download_name=download_filename
+                )
 
-        # 返回文件给用户下载
-        return send_file(
-            byte_io,
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            as_attachment=True,  # 作为附件下载
-            download_name=download_filename  # 指定下载时的文件名
-        )
+        return _send_cached_document(document_path, cache_key, download_filename)
 
     except Exception as e:
-        print(f"生成Word文档时出错: {e}")
-        return jsonify({"error": f"文档生成失败: {str(e)}"}), 500
+        log_event(logger, logging.ERROR, "save_failed", error=str(e))
+        raise SummaryError(f"文档生成失败: {str(e)}")
+
+
+def _render_bundle(template_ids, extracted_content):
+    """
+    用同一份提取结果并行渲染多个模板（线程池，每个模板的文档同样写入缓存）
+
+    参数:
+        template_ids: 模板ID列表
+        extracted_content: AI返回并解析后的字典
+
+    返回:
+        [(模板ID, 缓存键, 文档字节)]，顺序与 template_ids 相同
+    """
+    services = _services()
+    render_cache = services.render_cache
+
+    def render(template_id):
+        cache_key, document_path, document = _render_document(template_id, extracted_content, stream=False)
+        if document is None:
+            with open(document_path, 'rb') as f:
+                document = f.read()
+        elif render_cache.enabled:
+            render_cache.put(cache_key, document)
+        return template_id, cache_key, document
+
+    # 在请求线程中进入render阶段，各渲染线程沿用同一阶段，不再各自切换期限的当前阶段
+    with deadline_stage(STAGE_RENDER):
+        futures = [
+            services.render_executor.submit(contextvars.copy_context().run, render, template_id)
+            for template_id in template_ids
+        ]
+        return [future.result() for future in futures]
+
+
+def _bundle_response(extracted_content, documents):
+    """
+    把多个模板的文档打包为zip返回
+
+    参数:
+        extracted_content: AI返回并解析后的字典
+        documents: _render_bundle() 的返回值
+
+    返回:
+        Flask响应对象
+    """
+    try:
+        summary_name = extracted_content.get('姓名', '用户')
+        summary_date = datetime.date.today().strftime('%Y%m%d')
+        buffer = io.BytesIO()
+        # .docx本身已经压缩，打包时不再压缩
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for template_id, _, document in documents:
+                archive.writestr(f"{summary_name}-年度总结-{template_id}-{summary_date}.docx", document)
+        buffer.seek(0)
+        response = send_file(
+            buffer,
+            mimetype=ZIP_MIMETYPE,
+            as_attachment=True,
+            download_name=f"{summary_name}-年度总结-{summary_date}.zip"
+        )
+    except Exception as e:
+        log_event(logger, logging.ERROR, "save_failed", error=str(e))
+        raise SummaryError(f"文档打包失败: {str(e)}")
+
+    # 各模板的文档仍可通过 /download/<缓存键> 单独下载
+    response.headers['X-Document-Ids'] = ",".join(cache_key for _, cache_key, _ in documents)
+    log_event(logger, logging.INFO, "bundle_rendered", templates=len(documents),
+              bytes=sum(len(document) for _, _, document in documents))
+    return response
+
+
+def _stream_document(document, cache_key, download_filename):
+    """
+    边序列化边发送新渲染的文档（分块传输，没有Content-Length）
+
+    文档全部发出后才写入缓存，因此X-Document-Id对应的 /download/<缓存键> 在下载完成后可用
+    """
+    render_cache = _services().render_cache
+    response = current_app.response_class(
+        document.iter_chunks(render_cache if render_cache.enabled else None, cache_key),
+        mimetype=DOCX_MIMETYPE
+    )
+    _set_attachment(response, download_filename)
+    response.headers['X-Document-Id'] = cache_key
+    response.headers['Content-Location'] = f"/download/{cache_key}"
+    return response
+
+
+def _set_attachment(response, download_filename):
+    """设置下载文件名；非ASCII文件名同时提供ASCII回退和RFC 5987编码（与send_file一致）"""
+    try:
+        download_filename.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_filename).encode('ascii', 'ignore').decode('ascii')
+        quoted = quote(download_filename, safe="!#$&+-.^_`|~")
+        names = {'filename': simple, 'filename*': f"UTF-8''{quoted}"}
+    else:
+        names = {'filename': download_filename}
+    response.headers.set('Content-Disposition', 'attachment', **names)
+
+
+def _send_cached_document(document_path, cache_key, download_filename):
+    """
+    从缓存目录发送文档
+
+    缓存键同时作为强ETag；再次下载时可通过 /download/<缓存键> 获取，
+    浏览器携带If-None-Match时直接返回304
+    """
+    response = send_file(
+        document_path,
+        mimetype=DOCX_MIMETYPE,
+        as_attachment=True,
+        download_name=download_filename,
+        etag=cache_key,
+        conditional=True,
+        max_age=RENDER_CACHE_MAX_AGE
+    )
+    response.headers['X-Document-Id'] = cache_key
+    response.headers['Content-Location'] = f"/download/{cache_key}"
+    return response
+
+
+def download_document(document_id):
+    """
+    重新下载已生成文档的接口
+
+    文档按内容寻址保存在缓存目录中，document_id即生成时返回的X-Document-Id
+    支持If-None-Match，内容未变化时返回304
+    """
+    document_path = _services().render_cache.get(document_id)
+    if not document_path:
+        return jsonify({"error": "文档不存在或已过期，请重新生成"}), 404
+
+    download_filename = request.args.get('name') or f"年度总结-{document_id[:8]}.docx"
+    return _send_cached_document(document_path, document_id, download_filename)
+
+
+def job_status(job_id):
+    """
+    查询生成任务的状态
+
+    生成请求的响应头 X-Job-Id 即任务ID；处理任务的worker退出后任务由其他进程接续，
+    完成后 document_url 指向生成的文档
+    """
+    job = _services().jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+    return jsonify(job.to_dict())
+
+
+def job_document(job_id):
+    """下载已完成任务生成的文档"""
+    job = _services().jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+    if job.status == STATUS_FAILED:
+        # 失败的任务不会再有文档
+        return jsonify({**job.to_dict(), "error": f"任务失败: {job.error}"}), 410
+    if job.status != STATUS_DONE:
+        return jsonify({**job.to_dict(), "error": "任务尚未完成"}), 409
+    if job.document is None:
+        # 文档是流式发送的，没有保存到任务表：按提取结果重新渲染（通常命中缓存）
+        try:
+            return _document_response(job.extracted, *_render_document(job.template_id, job.extracted))
+        except SummaryError as e:
+            return e.to_response()
+    return _document_response(job.extracted, job.document_id, None, job.document)
 
 
 # ==================== 应用启动 ====================
@@ -778,9 +1354,11 @@ if __name__ == '__main__':
 
     注意：这种启动方式仅适用于开发和测试环境
     生产环境应该使用专业的WSGI服务器，如：
-    - Gunicorn: gunicorn -w 4 -b 0.0.0.0:5000 app:app
+    - Gunicorn: gunicorn -w 4 -b 0.0.0.0:5000 'app:create_app()'
     - uWSGI: uwsgi --http :5000 --wsgi-file app.py --callable app
     """
+    app = create_app()
+
     print("=" * 50)
     print("AI 智能年度总结生成器启动中...")
     print("请确保已正确配置科大讯飞星火大模型的API凭证")
@@ -0,0 +1,443 @@
+"""
+ASGI部署入口
+
+WSGI同步worker在等待大模型生成的整个过程中都被占用，并发数等于worker数。
+ASGI部署时 /generate_summary 和 /extract 以协程方式运行：
+1. 调用大模型使用异步HTTP客户端（httpx），等待期间不占用线程
+2. 读取上传文件、渲染和保存Word文档等CPU密集的步骤放到线程池中执行，不阻塞事件循环
+3. 其他接口（首页、模板列表、/metrics、下载、/render等）原样交给Flask应用处理
+
+单个进程即可同时保持数百个生成请求，内存基本不随并发数增长。
+客户端在生成过程中断开时（收到 http.disconnect），立即取消对大模型的调用。
+
+未安装httpx或使用WebSocket协议时，调用大模型改为在专用线程池中执行同步客户端，
+功能不受影响，但每个进行中的调用会占用一个线程。
+
+使用方法：
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+    # 或者通过gunicorn管理多个进程
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py asgi:application
+
+作者：AI助手
+日期：2025年
+"""
+
+import asyncio
+import contextvars
+import io
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as summary_app
+from admission import AdmissionRejected
+from deadline import DeadlineExceeded, REASON_DISCONNECTED, deadline_stage, end_deadline, start_deadline
+from log_config import get_logger, log_event
+from metrics import INFLIGHT_REQUESTS, STAGE_UPSTREAM, stage_timer
+from singleflight import client_signature, flight_key
+from upload_encoding import apply_request_encoding
+from warmup import WARMUP_MODE, WARMUP_UPSTREAM_CONNECTIONS
+from spark_http_client import AsyncSparkHTTPClient, SparkHTTPClient, httpx
+
+
+# ==================== 配置 ====================
+ASGI_DOCX_WORKERS = int(os.getenv("ASGI_DOCX_WORKERS", str(os.cpu_count() or 4)))       # 文档处理线程数
+ASGI_UPSTREAM_THREADS = int(os.getenv("ASGI_UPSTREAM_THREADS", "256"))                  # 同步调用大模型时的线程数
+ASGI_UPSTREAM_MAX_CONNECTIONS = int(os.getenv("ASGI_UPSTREAM_MAX_CONNECTIONS", "500"))  # 异步客户端连接池上限
+ASGI_MAX_BODY_BYTES = int(os.getenv("ASGI_MAX_BODY_BYTES", str(20 * 1024 * 1024)))      # 请求体大小上限
+ASGI_SEND_CHUNK_BYTES = 64 * 1024                                                         # 每次从响应体读取并发送的字节数
+
+logger = get_logger(__name__)
+
+flask_app = summary_app.create_app()
+wsgi_application = WsgiToAsgi(flask_app)
+
+_docx_executor = ThreadPoolExecutor(max_workers=ASGI_DOCX_WORKERS, thread_name_prefix="docx")
+_upstream_executor = None
+_async_client = None
+
+
+def _create_async_client():
+    """
+    HTTP协议且安装了httpx时创建异步客户端，否则返回None（回退到线程池中的同步客户端）
+    """
+    client = flask_app.extensions["summary"].spark_client
+    if httpx is None or type(client) is not SparkHTTPClient:
+        return None
+    return AsyncSparkHTTPClient(client.api_password, client.base_url, client.model,
+                                max_connections=ASGI_UPSTREAM_MAX_CONNECTIONS)
+
+
+async def run_in_executor(executor, func, *args):
+    """
+    在线程池中执行函数
+
+    复制当前上下文（Flask请求上下文和追踪对象），线程中记录的阶段耗时同样计入本请求
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, func, *args)
+
+
+def _send_request_sync(user_input, prompt=None):
+    """
+    在线程池中调用同步客户端
+
+    WebSocket客户端每次调用使用一个浅拷贝，见 app._request_client()
+    """
+    client = summary_app._request_client(summary_app._services())
+    if prompt is None:
+        return client.send_request(user_input)
+    return client.send_request(user_input, prompt=prompt)
+
+
+# ==================== 异步生成流程 ====================
+async def _call_upstream_async(user_input, prompt=None):
+    """调用星火大模型，与 app._call_upstream 的单飞合并、准入控制和错误处理一致"""
+    services = summary_app._services()
+    key = flight_key(user_input if prompt is None else prompt, client_signature(services.spark_client))
+    try:
+        with deadline_stage(STAGE_UPSTREAM) as deadline:
+            spark_json_str = await services.singleflight.do_async(
+                key, lambda: _send_upstream_async(services, user_input, deadline, prompt), deadline
+            )
+    except DeadlineExceeded:
+        raise
+    except AdmissionRejected as e:
+        raise summary_app._admission_error(e)
+    except Exception as e:
+        log_event(logger, logging.ERROR, "upstream_failed", error=str(e))
+        raise summary_app.SummaryError(f"AI模型服务调用失败: {str(e)}")
+
+    log_event(logger, logging.INFO, "upstream_done", chars=len(spark_json_str))
+    return spark_json_str
+
+
+async def _send_upstream_async(services, user_input, deadline, prompt=None):
+    """获得准入名额后调用星火大模型"""
+    async with services.admission.slot_async(deadline):
+        with stage_timer(STAGE_UPSTREAM):
+            return await _send_request_async(user_input, prompt)
+
+
+async def _send_request_async(user_input, prompt=None):
+    """使用异步客户端调用，没有异步客户端时在线程池中调用同步客户端"""
+    global _upstream_executor
+    if _async_client is not None:
+        return await _async_client.send_request_async(user_input, prompt)
+    if _upstream_executor is None:
+        _upstream_executor = ThreadPoolExecutor(max_workers=ASGI_UPSTREAM_THREADS, thread_name_prefix="upstream")
+    return await run_in_executor(_upstream_executor, _send_request_sync, user_input, prompt)
+
+
+async def _extract_incremental_async(user_input):
+    """增量提取，与 app._extract_incremental 相同；读写片段缓存在线程池中执行"""
+    services = summary_app._services()
+    plan = await run_in_executor(
+        _docx_executor, services.chunks.plan, user_input, client_signature(services.spark_client)
+    )
+    if plan.needs_call:
+        spark_json_str = await _call_upstream_async(user_input, plan.prompt())
+        await run_in_executor(_docx_executor, plan.apply, summary_app._parse_upstream_reply(spark_json_str))
+    return plan.merge()
+
+
+async def _extract_async(user_input, incremental=False):
+    """调用星火大模型并解析提取结果，与 app._extract 相同"""
+    if incremental:
+        return await _extract_incremental_async(user_input)
+    spark_json_str = await _call_upstream_async(user_input)
+    return summary_app._parse_upstream_reply(spark_json_str)
+
+
+async def generate_summary_async():
+    """
+    /generate_summary 的异步版本
+
+    步骤与 app.generate_summary 相同，在Flask请求上下文中执行
+    """
+    with INFLIGHT_REQUESTS.track_inprogress():
+        idempotency_key = idempotency_token = None
+        job = None
+        try:
+            summary_app._check_spark_client()
+            idempotency_key = summary_app._idempotency_key()
+            summary_app._check_admission()
+            # 解析表单和读取上传文件都可能较慢，放到线程池中；幂等键登记同样放到线程池，避免等待SQLite锁时阻塞事件循环
+            template_ids = await run_in_executor(_docx_executor, summary_app._resolve_template_ids)
+            template_key = ",".join(template_ids)
+            user_input = await run_in_executor(_docx_executor, summary_app._read_user_input, template_key)
+            extracted_content, idempotency_token = await run_in_executor(
+                _docx_executor, summary_app._begin_idempotent, idempotency_key, template_key, user_input
+            )
+            if extracted_content is not None:
+                if len(template_ids) > 1:
+                    documents = await run_in_executor(
+                        _docx_executor, summary_app._render_bundle, template_ids, extracted_content
+                    )
+                    response = await run_in_executor(
+                        _docx_executor, summary_app._bundle_response, extracted_content, documents
+                    )
+                    return summary_app._mark_replayed(response)
+                rendered = await run_in_executor(
+                    _docx_executor, summary_app._render_document, template_ids[0], extracted_content
+                )
+                response = await run_in_executor(
+                    _docx_executor, summary_app._document_response, extracted_content, *rendered
+                )
+                return summary_app._mark_replayed(response)
+
+            # 与 app._run_job 相同的阶段：调用大模型改为异步，其余在线程池中执行
+            job = await run_in_executor(
+                _docx_executor, summary_app._start_job, template_ids[0], user_input, idempotency_key, idempotency_token
+            )
+            if job.extracted is None:
+                extracted_content = await _extract_async(job.user_input, summary_app._incremental_requested())
+                await run_in_executor(_docx_executor, summary_app._save_extracted, job, extracted_content)
+            if len(template_ids) > 1:
+                response = await run_in_executor(_docx_executor, summary_app._run_bundle_job, job, template_ids)
+            else:
+                rendered = await run_in_executor(_docx_executor, summary_app._run_job, job)
+                response = await run_in_executor(_docx_executor, summary_app._document_response, *rendered)
+            if job.job_id is not None:
+                response.headers['X-Job-Id'] = job.job_id
+            return response
+        except DeadlineExceeded as e:
+            await run_in_executor(_docx_executor, summary_app._fail_job, job, str(e))
+            return summary_app._deadline_error(e).to_response()
+        except summary_app.SummaryError as e:
+            await run_in_executor(_docx_executor, summary_app._fail_job, job, e.message)
+            return e.to_response()
+        except Exception as e:
+            error = await run_in_executor(_docx_executor, summary_app._unexpected_job_error, job, e)
+            return error.to_response()
+        finally:
+            if idempotency_token is not None:
+                await run_in_executor(
+                    _docx_executor, summary_app._release_idempotent, idempotency_key, idempotency_token
+                )
+
+
+async def extract_content_async():
+    """
+    /extract 的异步版本
+
+    步骤与 app.extract_content 相同，在Flask请求上下文中执行
+    """
+    idempotency_key = idempotency_token = None
+    try:
+        summary_app._check_spark_client()
+        idempotency_key = summary_app._idempotency_key()
+        summary_app._check_admission()
+        template_ids = await run_in_executor(_docx_executor, summary_app._resolve_template_ids)
+        template_key = ",".join(template_ids)
+        user_input = await run_in_executor(_docx_executor, summary_app._read_user_input, template_key)
+        extracted_content, idempotency_token = await run_in_executor(
+            _docx_executor, summary_app._begin_idempotent, idempotency_key, template_key, user_input
+        )
+        if extracted_content is not None:
+            return summary_app._mark_replayed(summary_app._extraction_response(template_ids, extracted_content))
+
+        extracted_content = await _extract_async(user_input, summary_app._incremental_requested())
+        await run_in_executor(
+            _docx_executor, summary_app._complete_idempotent, idempotency_key, idempotency_token, extracted_content
+        )
+        return summary_app._extraction_response(template_ids, extracted_content)
+    except DeadlineExceeded as e:
+        return summary_app._deadline_error(e).to_response()
+    except summary_app.SummaryError as e:
+        return e.to_response()
+    finally:
+        if idempotency_token is not None:
+            await run_in_executor(_docx_executor, summary_app._release_idempotent, idempotency_key, idempotency_token)
+
+
+# 以协程方式处理的接口（POST）
+ASYNC_VIEWS = {
+    "/generate_summary": generate_summary_async,
+    "/extract": extract_content_async,
+}
+
+
+# ==================== ASGI适配 ====================
+def build_environ(scope, body):
+    """根据ASGI的scope和请求体构造WSGI environ，供Flask解析表单"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("ascii"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin1").upper().replace("-", "_")
+        value = raw_value.decode("latin1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    """
+    读取完整的请求体
+
+    返回:
+        请求体字节；超过 ASGI_MAX_BODY_BYTES 时返回None
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return b"".join(chunks)
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > ASGI_MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _read_chunks(iterator, limit=ASGI_SEND_CHUNK_BYTES):
+    """
+    从WSGI响应体读取至少limit字节（或读完）
+
+    返回:
+        (字节, 是否已读完)
+    """
+    chunks = []
+    size = 0
+    for chunk in iterator:
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= limit:
+            return b"".join(chunks), False
+    return b"".join(chunks), True
+
+
+async def send_response(send, response, environ):
+    """
+    把Flask响应对象（包括文件响应、流式文档和304）发送给ASGI服务器
+
+    响应体分块读取并发送，流式发送的文档（docx_stream.py）边序列化边发出，不在内存中拼接完整文档
+    """
+    app_iter, status, headers = response.get_wsgi_response(environ)
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers],
+        })
+        iterator = iter(app_iter)
+        finished = False
+        while not finished:
+            # 文件读取和文档序列化是阻塞操作，放到线程池中
+            body, finished = await run_in_executor(_docx_executor, _read_chunks, iterator)
+            await send({"type": "http.response.body", "body": body, "more_body": not finished})
+    finally:
+        if hasattr(app_iter, "close"):
+            await run_in_executor(_docx_executor, app_iter.close)
+
+
+async def watch_disconnect(receive, deadline):
+    """请求体读完后ASGI服务器只会再发送断开消息，收到时取消请求"""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            deadline.cancel(REASON_DISCONNECTED)
+            return
+
+
+async def handle_async_view(scope, receive, send, view):
+    """
+    处理 POST /generate_summary 和 POST /extract
+
+    与Flask处理请求的流程一致：before_request（开始追踪）→ 视图 → after_request
+    （统计、Server-Timing）→ teardown（结束追踪）。
+    处理期间监听客户端断开，断开时通过请求期限取消调用大模型
+    """
+    body = await read_body(receive)
+    if body is None:
+        environ = build_environ(scope, b"")
+        with flask_app.request_context(environ):
+            response = flask_app.make_response(
+                summary_app.SummaryError("上传内容过大", 413).to_response()
+            )
+        await send_response(send, response, environ)
+        return
+
+    environ = build_environ(scope, body)
+    # 压缩上传的请求体在线程池中解压（WSGI入口由 DecompressingMiddleware 处理），错误由before_request返回
+    await run_in_executor(_docx_executor, apply_request_encoding, environ)
+    with flask_app.request_context(environ):
+        deadline = start_deadline()
+        watcher = asyncio.create_task(watch_disconnect(receive, deadline))
+        try:
+            rv = flask_app.preprocess_request()
+            if rv is None:
+                rv = await view()
+            response = flask_app.finalize_request(rv)
+        except Exception as e:
+            response = flask_app.handle_exception(e)
+        finally:
+            watcher.cancel()
+            end_deadline()
+    await send_response(send, response, environ)
+
+
+async def handle_lifespan(receive, send):
+    """启动时创建并预热异步客户端，关闭时释放连接池和线程池"""
+    global _async_client
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            _async_client = _create_async_client()
+            if _async_client is not None and WARMUP_MODE != "off":
+                # 异步客户端有自己的连接池，同样预先建立连接；失败不影响启动
+                try:
+                    await _async_client.warmup_async(WARMUP_UPSTREAM_CONNECTIONS)
+                except Exception as e:
+                    log_event(logger, logging.WARNING, "upstream_warmup_failed", error=str(e))
+            log_event(logger, logging.INFO, "asgi_started",
+                      upstream="async" if _async_client else "threadpool", docx_workers=ASGI_DOCX_WORKERS)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _async_client is not None:
+                await _async_client.aclose()
+            _docx_executor.shutdown(wait=False)
+            # uvicorn 在关闭完成后按收到的信号结束进程，不执行atexit，子进程要在这里停止
+            flask_app.extensions["summary"].docx_pool.shutdown()
+            if _upstream_executor is not None:
+                _upstream_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI应用入口"""
+    if scope["type"] == "lifespan":
+        await handle_lifespan(receive, send)
+    elif scope["type"] == "http" and scope["path"] in ASYNC_VIEWS and scope["method"] == "POST":
+        await handle_async_view(scope, receive, send, ASYNC_VIEWS[scope["path"]])
+    else:
+        await wsgi_application(scope, receive, send)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+热点路径基准测试
+
+完全离线运行，不调用星火大模型。使用不同规模的合成语料，分别计时：
+1. 文本提取：.txt解码、.docx段落和大表格提取
+2. 提示词构造
+3. 模型回复的JSON提取（短/中/长回复）
+4. 模板填充
+5. 文档保存（doc.save）
+6. 预编译模板生成文档（拼接XML片段并打包，对应4+5）
+
+结果与 benchmarks/baseline.json 中保存的基线比较，任一用例变慢超过阈值时以非零状态退出，
+可直接放进CI。基线与机器相关，运行前会先测量一个固定的纯Python校准负载，
+比较时按“当前机器/基线机器”的校准耗时比例缩放基线。
+
+使用方法：
+    python benchmarks/bench_hotpaths.py                   # 与基线比较
+    python benchmarks/bench_hotpaths.py --save-baseline   # 记录新的基线
+    python benchmarks/bench_hotpaths.py --threshold 0.3   # 允许30%的波动
+
+作者：AI助手
+"""
+
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import zipfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+
+from docx import Document
+
+from content_parsing import extract_docx_text, parse_model_reply
+from document_renderer import fill_template, render_precompiled
+from spark_http_client import SparkHTTPClient
+from template_compiler import compile_template
+from template_registry import CompiledTemplate
+
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+TEMPLATE_PATH = os.path.join(APP_DIR, "年度总结模板.docx")
+
+# 变慢的绝对值低于该值（毫秒）时视为噪声，不判定为性能回退
+NOISE_FLOOR_MS = 0.2
+
+SAMPLE_LINE = "今年我主要负责了A项目的开发工作，成功完成了系统架构设计和核心功能实现，性能提升30%。"
+
+
+# ==================== 合成语料 ====================
+def make_text(target_bytes):
+    """生成指定大小（UTF-8字节数）左右的中文工作记录"""
+    line = (SAMPLE_LINE + "\n").encode('utf-8')
+    return (line * max(1, target_bytes // len(line))).decode('utf-8')
+
+
+def make_docx(paragraphs, table_rows, table_cols=6):
+    """生成包含若干段落和一个大表格的.docx字节"""
+    doc = Document()
+    for index in range(paragraphs):
+        doc.add_paragraph(f"{index}. {SAMPLE_LINE}")
+    if table_rows:
+        table = doc.add_table(rows=table_rows, cols=table_cols)
+        # 一次性取出整张表的单元格，避免逐行访问的平方级开销
+        for index, cell in enumerate(table._cells):
+            cell.text = f"第{index % table_cols}列：{SAMPLE_LINE[:20]}"
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def make_reply(items):
+    """生成模型回复：每个列表字段items条，外层带markdown代码块"""
+    content = {
+        "年度总结概述": SAMPLE_LINE,
+        "主要成就与贡献": [f"成就{i}：{SAMPLE_LINE}" for i in range(items)],
+        "遇到的挑战及解决方案": [f"挑战{i}：{SAMPLE_LINE}" for i in range(items)],
+        "个人成长与学习": [f"成长{i}：{SAMPLE_LINE}" for i in range(items)],
+        "未来展望与计划": [f"计划{i}：{SAMPLE_LINE}" for i in range(items)],
+        "姓名": "张三",
+        "报告日期": "2025年12月31日",
+    }
+    return "```json\n" + json.dumps(content, ensure_ascii=False, indent=2) + "\n```"
+
+
+# ==================== 计时工具 ====================
+def measure(func, min_rounds=5, min_seconds=0.2):
+    """
+    多次运行取中位数（毫秒）
+
+    至少运行min_rounds次且总时长不少于min_seconds，减少单次抖动的影响
+    """
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < min_rounds or time.perf_counter() - started < min_seconds:
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+        if len(samples) >= 200:
+            break
+    return statistics.median(samples)
+
+
+def calibrate():
+    """固定的纯Python负载，用于在不同机器之间换算基线"""
+    def workload():
+        total = 0
+        for i in range(200000):
+            total += i * i % 7
+        return total
+    return measure(workload, min_rounds=7)
+
+
+# ==================== 用例 ====================
+def build_cases():
+    """返回 用例名 -> 无参函数 的有序列表"""
+    client = SparkHTTPClient("offline-benchmark")
+    template_bytes = open(TEMPLATE_PATH, 'rb').read()
+
+    small_txt = make_text(2 * 1024).encode('utf-8')
+    huge_txt = make_text(4 * 1024 * 1024).encode('utf-8')
+    small_docx = make_docx(paragraphs=30, table_rows=0)
+    table_docx = make_docx(paragraphs=50, table_rows=200)
+    huge_table_docx = make_docx(paragraphs=100, table_rows=2000)
+
+    replies = {name: make_reply(items) for name, items in (("short", 3), ("medium", 30), ("long", 300))}
+    parsed = {name: parse_model_reply(reply) for name, reply in replies.items()}
+
+    def fill(content):
+        doc = Document(io.BytesIO(template_bytes))
+        fill_template(doc, content)
+        return doc
+
+    filled = {name: fill(content) for name, content in parsed.items()}
+
+    artifact = compile_template(template_bytes)
+    with zipfile.ZipFile(io.BytesIO(template_bytes)) as zf:
+        parts = [(info.filename, None, zf.read(info)) for info in zf.infolist()]
+    precompiled = CompiledTemplate(
+        "benchmark", TEMPLATE_PATH, None, artifact["source_sha256"], set(artifact["placeholders"]), parts,
+        segments=artifact["segments"], document_part=artifact["document_part"]
+    )
+
+    def save(doc):
+        doc.save(io.BytesIO())
+
+    cases = [
+        ("extract_txt_small", lambda: small_txt.decode('utf-8')),
+        ("extract_txt_huge", lambda: huge_txt.decode('utf-8')),
+        ("extract_docx_small", lambda: extract_docx_text(io.BytesIO(small_docx))),
+        ("extract_docx_table_200", lambda: extract_docx_text(io.BytesIO(table_docx))),
+        ("extract_docx_table_2000", lambda: extract_docx_text(io.BytesIO(huge_table_docx))),
+        ("prompt_small", lambda: client._create_spark_prompt(small_txt.decode('utf-8'))),
+        ("prompt_huge", lambda: client._create_spark_prompt(huge_txt.decode('utf-8'))),
+    ]
+    for name in replies:
+        cases.append((f"parse_reply_{name}", lambda reply=replies[name]: parse_model_reply(reply)))
+    for name in parsed:
+        cases.append((f"template_fill_{name}", lambda content=parsed[name]: fill(content)))
+    for name in filled:
+        cases.append((f"doc_save_{name}", lambda doc=filled[name]: save(doc)))
+    for name in parsed:
+        cases.append((f"render_precompiled_{name}", lambda content=parsed[name]: render_precompiled(precompiled, content)))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="热点路径基准测试（离线）")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--threshold", type=float, default=0.25, help="允许的变慢比例，默认0.25即25%%")
+    parser.add_argument("--only", default="", help="只运行名称包含该字符串的用例")
+    args = parser.parse_args()
+
+    print("🔧 正在生成合成语料...")
+    cases = [case for case in build_cases() if args.only in case[0]]
+
+    calibration = calibrate()
+    print(f"⏱️  校准负载: {calibration:.2f} ms")
+
+    results = {}
+    for name, func in cases:
+        func()  # 预热
+        results[name] = measure(func)
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({"calibration_ms": calibration, "results_ms": results}, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        for name, value in results.items():
+            print(f"{name:<28}{value:>10.2f} ms")
+        print(f"✅ 基线已保存到 {BASELINE_PATH}")
+        return 0
+
+    baseline = {}
+    scale = 1.0
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding='utf-8') as f:
+            data = json.load(f)
+        baseline = data.get("results_ms", {})
+        scale = calibration / data.get("calibration_ms", calibration)
+        print(f"📏 基线换算比例: {scale:.2f}")
+    else:
+        print("⚠️  未找到基线文件，只输出本次结果（使用 --save-baseline 记录基线）")
+
+    regressions = []
+    print(f"{'用例':<28}{'本次(ms)':>10}{'基线(ms)':>10}{'变化':>9}")
+    for name, value in results.items():
+        if name not in baseline:
+            print(f"{name:<28}{value:>10.2f}{'-':>10}{'-':>9}")
+            continue
+        expected = baseline[name] * scale
+        change = value / expected - 1 if expected else 0.0
+        flag = ""
+        if change > args.threshold and value - expected > NOISE_FLOOR_MS:
+            regressions.append(name)
+            flag = "  ❌"
+        print(f"{name:<28}{value:>10.2f}{expected:>10.2f}{change:>+9.0%}{flag}")
+
+    if regressions:
+        print(f"\n❌ 性能回退超过 {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print("\n✅ 没有发现性能回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
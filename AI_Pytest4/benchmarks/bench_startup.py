@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+启动耗时基准测试
+
+每轮启动一个全新的Python进程，分别计时：
+1. import app（导入应用模块）
+2. create_app()（创建Flask应用）
+3. 第一个请求 GET /templates（未预热时触发模板编译和python-docx导入）
+4. 后台预热完成（/ready 返回200）所需的时间，以及预热完成后第一个生成请求的耗时
+
+默认分别在关闭预热（WARMUP_MODE=off）和后台预热两种模式下测量，对比第一个请求的耗时。
+
+并列出导入app后已经加载的较慢的第三方库，确认它们都是延迟导入的。
+
+使用方法：
+    python benchmarks/bench_startup.py --rounds 7
+    python benchmarks/bench_startup.py --modes off
+
+作者：AI助手
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from bench_hotpaths import make_reply
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+# 应该延迟导入的较慢模块
+HEAVY_MODULES = ("docx", "lxml", "websocket", "requests", "httpx", "spark_http_client", "spark_ws_client")
+
+# 在子进程中执行的计时脚本
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+loaded = [name for name in {heavy!r} if name in sys.modules]
+
+
+class OfflineClient:
+    def send_request(self, text):
+        return {reply!r}
+
+
+flask_app = app.create_app(spark_client=OfflineClient())
+created = time.perf_counter()
+client = flask_app.test_client()
+while client.get('/ready').status_code != 200:
+    time.sleep(0.005)
+ready = time.perf_counter()
+response = client.get('/templates')
+first = time.perf_counter()
+generated = client.post('/generate_summary', data={{"text_input": "启动基准测试"}})
+generate = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "ready_ms": (ready - created) * 1000,
+    "first_request_ms": (first - ready) * 1000,
+    "first_generate_ms": (generate - first) * 1000,
+    "status": response.status_code,
+    "generate_status": generated.status_code,
+    "loaded_after_import": loaded,
+}}))
+"""
+
+STAGES = ("import_ms", "create_app_ms", "ready_ms", "first_request_ms", "first_generate_ms")
+
+
+def run_probe(mode):
+    """在新进程中运行一次计时脚本"""
+    env = dict(os.environ, LOG_LEVEL="WARNING", WARMUP_MODE=mode, RENDER_CACHE_MAX_BYTES="0")
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(heavy=HEAVY_MODULES, reply=make_reply(5))],
+        cwd=APP_DIR, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    # 最后一行是计时结果，之前可能有启动时的提示信息
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时基准测试")
+    parser.add_argument("--rounds", type=int, default=5, help="运行轮数，取中位数")
+    parser.add_argument("--modes", nargs="+", default=["off", "background"],
+                        choices=["off", "background", "blocking"], help="测量的预热模式")
+    args = parser.parse_args()
+
+    loaded = []
+    for mode in args.modes:
+        results = [run_probe(mode) for _ in range(args.rounds)]
+        print(f"\nWARMUP_MODE={mode}")
+        print(f"{'阶段':<20}{'中位数(ms)':>12}{'最小(ms)':>12}")
+        for key in STAGES:
+            values = [r[key] for r in results]
+            print(f"{key:<20}{statistics.median(values):>12.1f}{min(values):>12.1f}")
+        loaded = results[-1]["loaded_after_import"]
+
+    if loaded:
+        print(f"\n⚠️  导入app时已加载: {', '.join(loaded)}")
+        return 1
+    print("\n✅ 导入app时没有加载 " + ", ".join(HEAVY_MODULES))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+压缩上传基准测试
+
+完全离线运行。用两类中文文本构造与前端相同的multipart请求体：
+- 不同大小的合成工作记录（项目、数字、日期、人名各不相同，但句式固定，接近从周报、工单系统导出的内容）
+- 真实的中文文档（默认为本项目的README.md，句式多样，压缩比接近自由书写的总结草稿）
+
+分别统计：
+1. gzip压缩后的大小和压缩比（压缩级别6，与浏览器 CompressionStream 的默认级别一致）
+2. 压缩耗时（zlib，作为浏览器端耗时的参考）
+3. 服务端解压耗时（upload_encoding.decode_request_body，含写入SpooledTemporaryFile）
+4. 按给定的上行带宽估算上传时间：原始大小 vs 压缩后大小 + 压缩和解压耗时
+
+使用方法：
+    python benchmarks/bench_upload.py                       # 默认上行带宽 2/10/50 Mbps
+    python benchmarks/bench_upload.py --mbps 1 4 --sizes 20 200
+    python benchmarks/bench_upload.py --file 我的工作记录.txt  # 用自己的文本测量
+
+作者：AI助手
+"""
+
+import argparse
+import gzip
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+
+from upload_encoding import decode_request_body
+
+
+README_PATH = os.path.join(APP_DIR, "README.md")
+
+BOUNDARY = "----WebKitFormBoundaryBench7MA4YWxk"
+
+PROJECTS = ["客户管理平台", "数据中台", "移动端App", "支付网关", "报表系统", "智能客服", "供应链协同", "风控引擎"]
+ACTIONS = ["完成了", "主导了", "参与了", "推动了", "优化了", "重构了", "上线了", "验收了"]
+OBJECTS = ["接口性能优化", "数据库分库分表", "权限模型改造", "自动化测试覆盖", "灰度发布流程",
+           "日志监控告警", "缓存架构升级", "需求评审和排期", "新人培训和代码评审", "线上故障复盘"]
+RESULTS = ["响应时间从{a}毫秒降到{b}毫秒", "故障率下降{p}%", "节省人力约{n}人天", "覆盖率提升到{p}%",
+           "支撑日均{n}万次调用", "客户满意度提升{p}个百分点", "按期交付，零重大缺陷"]
+PEOPLE = ["张伟", "王芳", "李娜", "刘洋", "陈静", "杨磊", "赵敏", "黄强"]
+
+
+# ==================== 合成语料 ====================
+def make_worklog(target_bytes, seed=2025):
+    """生成指定大小（UTF-8字节数）左右的中文工作记录，每行内容不同"""
+    rng = random.Random(seed)
+    lines = []
+    size = 0
+    day = 0
+    while size < target_bytes:
+        day += 1
+        result = rng.choice(RESULTS).format(a=rng.randint(300, 2000), b=rng.randint(20, 290),
+                                            p=rng.randint(5, 60), n=rng.randint(2, 500))
+        line = (f"{1 + day // 22 % 12}月{1 + day % 28}日 与{rng.choice(PEOPLE)}一起在{rng.choice(PROJECTS)}项目中"
+                f"{rng.choice(ACTIONS)}{rng.choice(OBJECTS)}，{result}。")
+        if rng.random() < 0.3:
+            line += f"遇到的问题：{rng.choice(OBJECTS)}进度受阻，通过{rng.choice(ACTIONS)}{rng.choice(OBJECTS)}解决。"
+        lines.append(line)
+        size += len(line.encode('utf-8')) + 1
+    return "\n".join(lines)
+
+
+def make_multipart(text):
+    """与浏览器FormData相同格式的multipart请求体（text_input字段）"""
+    head = (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"text_input\"\r\n\r\n").encode('utf-8')
+    tail = f"\r\n--{BOUNDARY}--\r\n".encode('utf-8')
+    return head + text.encode('utf-8') + tail
+
+
+def timed(func, repeat):
+    """多次运行取中位数（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def server_decode(compressed):
+    """服务端解压并读出请求体"""
+    environ = {
+        "HTTP_CONTENT_ENCODING": "gzip",
+        "CONTENT_LENGTH": str(len(compressed)),
+        "wsgi.input": io.BytesIO(compressed),
+    }
+    decode_request_body(environ)
+    environ["wsgi.input"].read()
+
+
+def measure(label, body, args):
+    """打印一行：大小、压缩比、压缩/解压耗时、各带宽下的上传时间估算"""
+    compressed = gzip.compress(body, 6)
+    compress_ms = timed(lambda: gzip.compress(body, 6), args.repeat)
+    decode_ms = timed(lambda: server_decode(compressed), args.repeat)
+
+    print(f"{label:<14}{len(body) / 1024:>10.1f}{len(compressed) / 1024:>12.1f}{len(body) / len(compressed):>8.2f}"
+          f"{compress_ms:>10.2f}{decode_ms:>10.2f}", end="")
+    for mbps in args.mbps:
+        plain_ms = len(body) * 8 / (mbps * 1e6) * 1000
+        gzip_ms = len(compressed) * 8 / (mbps * 1e6) * 1000 + compress_ms + decode_ms
+        print(f"{f'{plain_ms:.0f} / {gzip_ms:.0f}':>26}", end="")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="压缩上传基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 50, 200, 1000, 5000],
+                        help="合成工作记录的大小（KB）")
+    parser.add_argument("--file", default=README_PATH, help="真实中文文本文件（UTF-8）")
+    parser.add_argument("--mbps", type=float, nargs="+", default=[2, 10, 50], help="上行带宽（Mbps）")
+    parser.add_argument("--repeat", type=int, default=9, help="每项计时的重复次数")
+    args = parser.parse_args()
+
+    print(f"{'文本':<14}{'原始(KB)':>10}{'压缩后(KB)':>12}{'压缩比':>8}{'压缩(ms)':>10}{'解压(ms)':>10}", end="")
+    for mbps in args.mbps:
+        print(f"{f'{mbps:g}Mbps 原始/压缩(ms)':>26}", end="")
+    print()
+
+    for size_kb in args.sizes:
+        measure("工作记录", make_multipart(make_worklog(size_kb * 1024)), args)
+    with open(args.file, encoding='utf-8') as f:
+        measure(os.path.basename(args.file)[:12], make_multipart(f.read()), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""
+/generate_summary 压力测试
+
+按目标并发数（闭环）或目标请求速率（开环）持续调用 /generate_summary，
+请求混合了不同长度的文本输入和 .txt/.docx 文件上传，输出：
+1. 吞吐量（请求/秒）
+2. 延迟的 p50/p95/p99/最大值，以及按请求类型（text/txt/docx）分别统计的p50/p95
+3. 错误率（按状态码统计）
+4. 服务进程（主进程及所有worker）的内存占用（RSS，读取 /proc）
+5. 比较模式下，模拟上游同时处理的请求数（平均值和最大值，定期读取 /stats）
+
+两种使用方式：
+
+1. 压测已经运行的服务（建议先用 mock_spark_server.py 作为上游）：
+    python benchmarks/loadtest.py --url http://127.0.0.1:5000 --concurrency 32 --duration 30 --pid <gunicorn主进程PID>
+
+2. 自动启动本地模拟上游和gunicorn，依次比较不同的worker模型：
+    python benchmarks/loadtest.py --compare sync,gthread,asgi --concurrency 64 --duration 30
+
+3. CPU密集的上传（大.docx文件）下，比较Word文档进程池（gthread）和在请求线程中解析渲染（gthread-inline）：
+    python benchmarks/loadtest.py --compare gthread-inline,gthread --file-ratio 0.5 --docx-paragraphs 3000
+
+开环模式（--rate）下延迟从“计划发送时间”开始计算，服务变慢导致的排队时间也会计入延迟，
+不会因为发送方被阻塞而低估尾延迟。
+
+作者：AI助手
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+SAMPLE_LINE = "今年我主要负责了A项目的开发工作，成功完成了系统架构设计和核心功能实现，性能提升30%。"
+
+# 比较模式下可选的worker模型：名称 -> (gunicorn应用入口, gunicorn环境变量)
+WORKER_MODELS = {
+    "sync": ("app:create_app()", {"GUNICORN_WORKER_CLASS": "sync", "GUNICORN_THREADS": "1"}),
+    "gthread": ("app:create_app()", {"GUNICORN_WORKER_CLASS": "gthread", "GUNICORN_THREADS": "32"}),
+    "gthread-inline": ("app:create_app()", {"GUNICORN_WORKER_CLASS": "gthread", "GUNICORN_THREADS": "32",
+                                            "DOCX_POOL_WORKERS": "0"}),
+    "asgi": ("asgi:application", {"GUNICORN_WORKER_CLASS": "uvicorn.workers.UvicornWorker"}),
+}
+
+
+# ==================== 请求内容 ====================
+def make_docx_bytes(lines):
+    """生成包含若干段落的.docx字节"""
+    from docx import Document
+
+    doc = Document()
+    for index in range(lines):
+        doc.add_paragraph(f"{index}. {SAMPLE_LINE}")
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def build_payloads(file_ratio, docx_paragraphs=40):
+    """
+    准备请求内容池
+
+    参数:
+        file_ratio: 文件上传请求所占比例（0~1）
+        docx_paragraphs: 上传的.docx文件的段落数（越大解析越耗CPU）
+
+    返回:
+        [(类型, 权重, 内容)] 列表，类型为 text/txt/docx
+    """
+    short_text = "\n".join(SAMPLE_LINE for _ in range(5))
+    long_text = "\n".join(SAMPLE_LINE for _ in range(120))
+    txt_file = "\n".join(SAMPLE_LINE for _ in range(40)).encode('utf-8')
+    docx_file = make_docx_bytes(docx_paragraphs)
+
+    text_weight = max(0.0, 1.0 - file_ratio)
+    return [
+        ("text", text_weight * 0.7, short_text),
+        ("text", text_weight * 0.3, long_text),
+        ("txt", file_ratio * 0.5, txt_file),
+        ("docx", file_ratio * 0.5, docx_file),
+    ]
+
+
+def pick_payload(payloads, rng):
+    """按权重随机选择一种请求内容"""
+    kinds = [p for p in payloads if p[1] > 0]
+    return rng.choices(kinds, weights=[p[1] for p in kinds])[0]
+
+
+def send_one(session, url, payload, template_id, sequence):
+    """
+    发送一个生成请求并读完响应
+
+    每个请求在输入末尾追加序号，保证输入各不相同
+
+    返回:
+        (状态码或异常名, 响应字节数)
+    """
+    kind, _, content = payload
+    data = {"template_id": template_id} if template_id else {}
+    files = None
+    if kind == "text":
+        data["text_input"] = f"{content}\n请求序号：{sequence}"
+    elif kind == "txt":
+        files = {"file": ("work.txt", content + f"\n请求序号：{sequence}".encode('utf-8'), "text/plain")}
+    else:
+        files = {"file": ("work.docx", content,
+                          "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
+    try:
+        response = session.post(f"{url}/generate_summary", data=data, files=files, timeout=300)
+        return response.status_code, len(response.content)
+    except requests.RequestException as e:
+        return type(e).__name__, 0
+
+
+# ==================== 负载模式 ====================
+class LoadResult:
+    """线程安全地收集每个请求的结果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.latencies_by_kind = {}
+        self.statuses = Counter()
+        self.bytes_received = 0
+
+    def add(self, kind, status, latency, size):
+        with self._lock:
+            self.statuses[status] += 1
+            self.bytes_received += size
+            if status == 200:
+                self.latencies.append(latency)
+                self.latencies_by_kind.setdefault(kind, []).append(latency)
+
+
+def run_closed_loop(url, payloads, concurrency, duration, template_id, seed):
+    """
+    闭环负载：concurrency个虚拟用户，每个用户收到响应后立即发送下一个请求
+
+    返回:
+        (LoadResult, 实际耗时秒数)
+    """
+    result = LoadResult()
+    deadline = time.perf_counter() + duration
+    counter = iter(range(10 ** 9))
+    counter_lock = threading.Lock()
+
+    def user(index):
+        rng = random.Random(seed + index)
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                with counter_lock:
+                    sequence = next(counter)
+                payload = pick_payload(payloads, rng)
+                start = time.perf_counter()
+                status, size = send_one(session, url, payload, template_id, sequence)
+                result.add(payload[0], status, time.perf_counter() - start, size)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return result, time.perf_counter() - started
+
+
+def run_open_loop(url, payloads, rate, duration, template_id, seed, max_workers):
+    """
+    开环负载：按固定速率发送请求，不等待之前的请求完成
+
+    延迟从计划发送时间开始计算（避免协调遗漏导致低估尾延迟）
+
+    返回:
+        (LoadResult, 实际耗时秒数)
+    """
+    result = LoadResult()
+    rng = random.Random(seed)
+    local = threading.local()
+
+    def task(scheduled, payload, sequence):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        status, size = send_one(session, url, payload, template_id, sequence)
+        result.add(payload[0], status, time.perf_counter() - scheduled, size)
+
+    interval = 1.0 / rate
+    total = int(rate * duration)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for sequence in range(total):
+            scheduled = started + sequence * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(task, scheduled, pick_payload(payloads, rng), sequence)
+    return result, time.perf_counter() - started
+
+
+# ==================== 内存采样 ====================
+def _read_rss_kb(pid):
+    """读取进程的常驻内存（KB），进程已退出时返回0"""
+    try:
+        with open(f"/proc/{pid}/status", encoding='ascii') as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def _child_pids(pid):
+    """查找直接子进程（gunicorn的worker）"""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding='ascii', errors='replace') as f:
+                # 第4个字段是父进程ID；进程名可能含空格，从最后一个右括号之后开始解析
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+
+class MemorySampler:
+    """后台定期采样服务进程及其worker的内存占用"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_total_kb = 0
+        self.peak_per_process_kb = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            total = 0
+            for pid in [self.pid] + _child_pids(self.pid):
+                rss = _read_rss_kb(pid)
+                total += rss
+                self.peak_per_process_kb[pid] = max(self.peak_per_process_kb.get(pid, 0), rss)
+            self.peak_total_kb = max(self.peak_total_kb, total)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if self.pid and os.path.exists("/proc"):
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+class UpstreamSampler:
+    """
+    后台定期读取模拟上游的 /stats，统计同时处理的请求数
+
+    服务进程中的线程被CPU密集的工作阻塞（持有GIL）时，发往上游的请求减少，平均并发随之下降
+    """
+
+    def __init__(self, upstream_url, interval=0.2):
+        self.upstream_url = upstream_url
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        with requests.Session() as session:
+            while not self._stop.is_set():
+                try:
+                    self.samples.append(session.get(f"{self.upstream_url}/stats", timeout=1).json()["inflight"])
+                except (requests.RequestException, ValueError, KeyError):
+                    pass
+                self._stop.wait(self.interval)
+
+    def summary(self):
+        if not self.samples:
+            return None
+        return {"mean": round(sum(self.samples) / len(self.samples), 2), "max": max(self.samples)}
+
+    def __enter__(self):
+        if self.upstream_url:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+# ==================== 统计输出 ====================
+def percentile(sorted_values, pct):
+    """最近秩法计算百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(result, elapsed, sampler=None, upstream=None):
+    """汇总一次压测的结果"""
+    total = sum(result.statuses.values())
+    latencies = sorted(result.latencies)
+    summary = {
+        "requests": total,
+        "elapsed_s": round(elapsed, 2),
+        "rps": round(result.statuses.get(200, 0) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(1 - result.statuses.get(200, 0) / total, 4) if total else 0.0,
+        "statuses": {str(k): v for k, v in result.statuses.items()},
+        "latency_ms": {
+            name: round(percentile(latencies, pct) * 1000, 1)
+            for name, pct in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+        },
+        "latency_by_kind_ms": {
+            kind: {name: round(percentile(sorted(values), pct) * 1000, 1) for name, pct in (("p50", 50), ("p95", 95))}
+            for kind, values in sorted(result.latencies_by_kind.items())
+        },
+    }
+    if upstream is not None and upstream.summary():
+        summary["upstream_inflight"] = upstream.summary()
+    if sampler is not None and sampler.peak_total_kb:
+        summary["memory_mb"] = {
+            "peak_total": round(sampler.peak_total_kb / 1024, 1),
+            "peak_per_process": {
+                str(pid): round(kb / 1024, 1) for pid, kb in sorted(sampler.peak_per_process_kb.items())
+            },
+        }
+    return summary
+
+
+def print_summary(name, summary):
+    latency = summary["latency_ms"]
+    print(f"\n📊 {name}")
+    print(f"   请求数: {summary['requests']}  耗时: {summary['elapsed_s']}s  吞吐量: {summary['rps']} 请求/秒")
+    print(f"   延迟(ms): p50={latency['p50']}  p95={latency['p95']}  p99={latency['p99']}  max={latency['max']}")
+    for kind, values in summary["latency_by_kind_ms"].items():
+        print(f"     {kind:<5} p50={values['p50']}  p95={values['p95']}")
+    print(f"   错误率: {summary['error_rate']:.2%}  状态码: {summary['statuses']}")
+    memory = summary.get("memory_mb")
+    if memory:
+        print(f"   内存峰值: 合计 {memory['peak_total']} MB，各进程 {memory['peak_per_process']}")
+    upstream = summary.get("upstream_inflight")
+    if upstream:
+        print(f"   上游并发: 平均 {upstream['mean']}  最大 {upstream['max']}")
+
+
+# ==================== 比较模式 ====================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    """等待服务可以响应请求"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.2)
+    return False
+
+
+def start_mock_upstream(args):
+    """在子进程中启动模拟星火服务，避免与压测客户端争抢GIL"""
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, os.path.join(APP_DIR, "mock_spark_server.py"),
+        "--port", str(port), "--token-rate", str(args.mock_token_rate), "--ttft", str(args.mock_ttft),
+    ], cwd=APP_DIR)
+    if not wait_until_up(f"http://127.0.0.1:{port}/stats"):
+        process.kill()
+        raise RuntimeError("模拟星火服务启动失败")
+    return process, f"http://127.0.0.1:{port}"
+
+
+def start_server(model, args, upstream_url, metrics_dir):
+    """按指定的worker模型启动gunicorn，返回 (进程, 服务地址)"""
+    port = free_port()
+    app_target, model_env = WORKER_MODELS[model]
+    env = dict(os.environ)
+    env.update(model_env)
+    env.update({
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+        "GUNICORN_WORKERS": str(args.workers),
+        "API_PROTOCOL": "HTTP",
+        "SPARK_HTTP_API_PASSWORD": "mock",
+        "SPARK_HTTP_BASE_URL": f"{upstream_url}/v2",
+        "LOG_LEVEL": "WARNING",
+        "PROMETHEUS_MULTIPROC_DIR": metrics_dir,
+    })
+    if not args.keep_render_cache:
+        # 模拟上游对所有输入返回相同内容，关闭文档缓存才能测到完整的渲染流程
+        env["RENDER_CACHE_MAX_BYTES"] = "0"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", app_target],
+        cwd=APP_DIR, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    if not wait_until_up(url, timeout=60):
+        process.kill()
+        raise RuntimeError(f"{model} 服务启动失败")
+    return process, url
+
+
+def stop_process(process):
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def run_load(url, payloads, args):
+    if args.rate:
+        return run_open_loop(url, payloads, args.rate, args.duration, args.template_id, args.seed, args.max_workers)
+    return run_closed_loop(url, payloads, args.concurrency, args.duration, args.template_id, args.seed)
+
+
+def compare_models(models, payloads, args):
+    """依次以不同worker模型启动服务并压测"""
+    mock_process, upstream_url = start_mock_upstream(args)
+    summaries = {}
+    try:
+        for model in models:
+            with tempfile.TemporaryDirectory(prefix="loadtest_metrics_") as metrics_dir:
+                process, url = start_server(model, args, upstream_url, metrics_dir)
+                try:
+                    # 预热：每个worker完成模板加载等首次初始化
+                    run_closed_loop(url, payloads, min(args.concurrency, 4), 2, args.template_id, args.seed)
+                    with MemorySampler(process.pid) as sampler, UpstreamSampler(upstream_url) as upstream:
+                        result, elapsed = run_load(url, payloads, args)
+                    summaries[model] = summarize(result, elapsed, sampler, upstream)
+                finally:
+                    stop_process(process)
+            print_summary(model, summaries[model])
+    finally:
+        stop_process(mock_process)
+
+    print(f"\n{'模型':<16}{'请求/秒':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'错误率':>8}{'内存(MB)':>10}"
+          f"{'上游并发':>10}")
+    for model, summary in summaries.items():
+        latency = summary["latency_ms"]
+        memory = summary.get("memory_mb", {}).get("peak_total", "-")
+        upstream = summary.get("upstream_inflight", {}).get("mean", "-")
+        print(f"{model:<16}{summary['rps']:>10}{latency['p50']:>10}{latency['p95']:>10}"
+              f"{latency['p99']:>10}{summary['error_rate']:>8.1%}{memory:>10}{upstream:>10}")
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/generate_summary 压力测试")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="被测服务地址（非比较模式）")
+    parser.add_argument("--pid", type=int, default=0, help="被测服务主进程PID，用于采样内存（非比较模式）")
+    parser.add_argument("--concurrency", type=int, default=16, help="闭环模式的并发用户数")
+    parser.add_argument("--rate", type=float, default=0.0, help="开环模式的目标速率（请求/秒），设置后忽略--concurrency")
+    parser.add_argument("--max-workers", type=int, default=512, help="开环模式的最大发送线程数")
+    parser.add_argument("--duration", type=float, default=20.0, help="压测时长（秒）")
+    parser.add_argument("--file-ratio", type=float, default=0.3, help="文件上传请求所占比例")
+    parser.add_argument("--docx-paragraphs", type=int, default=40, help="上传的.docx文件的段落数，越大解析越耗CPU")
+    parser.add_argument("--template-id", default="", help="使用的模板ID")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--compare", default="", help=f"比较的worker模型，逗号分隔，可选: {','.join(WORKER_MODELS)}")
+    parser.add_argument("--workers", type=int, default=2, help="比较模式下gunicorn的worker进程数")
+    parser.add_argument("--mock-token-rate", type=float, default=200.0, help="比较模式下模拟上游的生成速度")
+    parser.add_argument("--mock-ttft", type=float, default=0.5, help="比较模式下模拟上游的首个token等待时间")
+    parser.add_argument("--keep-render-cache", action="store_true", help="比较模式下保留文档缓存")
+    parser.add_argument("--output", default="", help="把结果以JSON写入该文件")
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.file_ratio, args.docx_paragraphs)
+
+    if args.compare:
+        models = [m.strip() for m in args.compare.split(",") if m.strip()]
+        unknown = [m for m in models if m not in WORKER_MODELS]
+        if unknown:
+            parser.error(f"未知的worker模型: {', '.join(unknown)}")
+        summaries = compare_models(models, payloads, args)
+    else:
+        with MemorySampler(args.pid) as sampler:
+            result, elapsed = run_load(args.url.rstrip("/"), payloads, args)
+        summaries = {args.url: summarize(result, elapsed, sampler)}
+        print_summary(args.url, summaries[args.url])
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 结果已保存到 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
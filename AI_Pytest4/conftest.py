@@ -0,0 +1,81 @@
+"""
+pytest公共配置
+
+应用模块在导入时读取环境变量，这里在收集测试之前设置：
+状态文件放在临时目录，不启动文档子进程池和任务恢复线程，不写文档缓存。
+需要应用实例的测试使用 summary_app 夹具，星火大模型由 FakeSparkClient 模拟，不调用真实接口。
+
+作者：AI助手
+日期：2025年
+"""
+
+import json
+import os
+import tempfile
+import threading
+
+import pytest
+
+os.environ.update({
+    "STATE_DIR": tempfile.mkdtemp(prefix="ai_summary_test_"),
+    "DOCX_POOL_WORKERS": "0",
+    "JOB_RECOVERY_INTERVAL": "0",
+    "RENDER_CACHE_MAX_BYTES": "0",
+    "WARMUP_MODE": "off",
+})
+
+# 模拟客户端返回的提取结果
+FAKE_EXTRACTED = {
+    "姓名": "张三",
+    "年度总结概述": "本年度完成了主要工作。",
+    "主要成就与贡献": ["完成项目A", "提升效率10%"],
+    "个人成长与学习": ["学习新技术"],
+    "遇到的挑战及解决方案": [],
+    "未来展望与计划": ["继续改进"],
+}
+
+
+class FakeSparkClient:
+    """
+    模拟的星火大模型客户端
+
+    属性:
+        calls: 收到的用户输入
+        gate: 设置前调用一直等待（用于构造“第一次请求仍在处理”的情况），默认已设置
+    """
+
+    def __init__(self, reply=None):
+        self.reply = FAKE_EXTRACTED if reply is None else reply
+        self.calls = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def send_request(self, user_input, prompt=None):
+        self.calls.append(user_input)
+        self.started.set()
+        self.gate.wait(10)
+        return json.dumps(self.reply, ensure_ascii=False)
+
+
+@pytest.fixture
+def spark_client():
+    return FakeSparkClient()
+
+
+@pytest.fixture
+def summary_app(spark_client, tmp_path):
+    """使用模拟客户端的应用实例，幂等登记、任务表和单飞登记都放在本测试的临时目录"""
+    import app as summary_app_module
+    from idempotency import IdempotencyStore
+    from incremental import ChunkStore
+    from job_store import JobStore
+    from singleflight import SingleFlight
+
+    flask_app = summary_app_module.create_app(spark_client)
+    services = flask_app.extensions["summary"]
+    services.idempotency = IdempotencyStore(str(tmp_path / "idempotency.db"))
+    services.jobs = JobStore(str(tmp_path / "jobs.db"))
+    services.singleflight = SingleFlight(str(tmp_path / "singleflight.db"))
+    services.chunks = ChunkStore("")
+    return flask_app
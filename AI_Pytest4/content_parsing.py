@@ -0,0 +1,75 @@
+"""
+输入内容与模型回复的解析
+
+把 generate_summary 中与Web框架无关的解析步骤提取为独立函数，便于复用和基准测试：
+1. 从上传的.docx文件中提取文本（段落 + 表格）
+2. 从模型回复中提取并解析JSON
+
+作者：AI助手
+日期：2025年
+"""
+
+import json
+
+
+def extract_docx_text(source):
+    """
+    提取Word文档中的所有文本
+
+    先按顺序提取所有段落，再提取表格中每个单元格的文本，每段/每格一行
+
+    参数:
+        source: .docx文件路径或文件对象
+
+    返回:
+        提取出的文本
+    """
+    from docx import Document  # 延迟导入：python-docx/lxml加载较慢，只在处理Word文档时才需要
+
+    doc = Document(source)
+
+    lines = [para.text for para in doc.paragraphs]
+    for table in doc.tables:
+        # row.cells 每次调用都会重新计算整张表的单元格网格，逐行访问是O(行数×单元格数)，
+        # 几百行的表格就要数秒。这里一次性取出整张表的网格（与逐行访问的顺序和内容完全一致，
+        # 合并单元格同样会重复出现）
+        for cell in table._cells:
+            lines.append(cell.text)
+
+    if not lines:
+        return ""
+    return "\n".join(lines) + "\n"
+
+
+def strip_code_fence(reply):
+    """
+    去掉模型回复外层的markdown代码块
+
+    有时星火模型会返回 ```json\\n{...}\\n``` 格式，需要提取中间的JSON部分
+
+    参数:
+        reply: 模型回复原文
+
+    返回:
+        去掉代码块标记后的文本（没有代码块时原样返回）
+    """
+    stripped = reply.strip()
+    if stripped.startswith("```json") and stripped.endswith("```"):
+        return stripped[7:-3].strip()
+    return reply
+
+
+def parse_model_reply(reply):
+    """
+    解析模型回复中的JSON
+
+    参数:
+        reply: 模型回复原文
+
+    返回:
+        解析后的字典
+
+    异常:
+        json.JSONDecodeError: 回复不是合法JSON
+    """
+    return json.loads(strip_code_fence(reply))
@@ -194,7 +194,14 @@ def main():
             print(f"   • {placeholder}")
         
         print(f"\n🎯 模板文件已保存到当前目录")
-        print("现在您可以启动AI智能年度总结生成器了！")
+
+        # 检查模板并生成预编译模板（与 python template_compiler.py 相同）
+        print("\n🔍 正在检查模板并生成预编译模板...")
+        from template_compiler import compile_file
+        if compile_file(filename):
+            print("现在您可以启动AI智能年度总结生成器了！")
+        else:
+            print("模板未通过检查，请根据上面的提示修改后运行 python template_compiler.py")
         
     except Exception as e:
         print(f"❌ 创建模板文件失败：{e}")
@@ -0,0 +1,349 @@
+"""
+请求期限与取消
+
+每个生成请求有一个总期限，并按阶段分配预算：
+- ingest: 读取和解析用户输入
+- upstream: 调用星火大模型
+- render: 填充模板和保存文档
+
+进入阶段时的可用时间取“阶段预算”和“总期限剩余时间”中较小者。后台监视线程负责：
+1. 阶段时间用完时取消请求
+2. 定期检查客户端连接（gunicorn和Flask开发服务器；ASGI部署由asgi.py监听断开消息），
+   客户端断开（例如用户关闭页面）时取消请求
+
+取消时依次调用已注册的回调：WebSocket客户端据此立即关闭连接，异步HTTP客户端取消正在等待的流，
+不再为已经超时或无人接收的请求继续占用worker和模型配额。
+读取文件、渲染文档等CPU阶段无法中途打断，只在进入阶段前检查。
+
+期限对象保存在contextvars中（与追踪对象相同），客户端通过 deadline_stage() 取得当前请求的期限；
+不在请求中直接使用客户端时，只按该阶段的预算计时。
+
+作者：AI助手
+日期：2025年
+"""
+
+import contextvars
+import errno
+import heapq
+import itertools
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+
+from log_config import get_logger, log_event
+from metrics import STAGE_UPSTREAM
+
+
+# ==================== 配置 ====================
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "150"))    # 单个请求的总期限
+DEADLINE_INGEST_SECONDS = float(os.getenv("DEADLINE_INGEST_SECONDS", "15"))       # 读取和解析输入的预算
+DEADLINE_UPSTREAM_SECONDS = float(os.getenv("DEADLINE_UPSTREAM_SECONDS", "120"))  # 调用大模型的预算
+DEADLINE_RENDER_SECONDS = float(os.getenv("DEADLINE_RENDER_SECONDS", "15"))       # 渲染文档的预算
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))    # 检查客户端连接的间隔（秒）
+
+# 阶段名；upstream与阶段耗时指标中的同名阶段一致
+STAGE_INGEST = "ingest"
+STAGE_RENDER = "render"
+
+STAGE_BUDGETS = {
+    STAGE_INGEST: DEADLINE_INGEST_SECONDS,
+    STAGE_UPSTREAM: DEADLINE_UPSTREAM_SECONDS,
+    STAGE_RENDER: DEADLINE_RENDER_SECONDS,
+}
+
+# 取消原因
+REASON_TIMEOUT = "deadline"
+REASON_DISCONNECTED = "client_disconnected"
+
+logger = get_logger(__name__)
+
+_current_deadline = contextvars.ContextVar("summary_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """
+    请求因超过期限或客户端断开而被取消
+
+    属性:
+        stage: 被取消时所处的阶段
+        reason: REASON_TIMEOUT 或 REASON_DISCONNECTED
+        elapsed: 请求开始至今的耗时（秒）
+    """
+
+    def __init__(self, stage, reason, elapsed):
+        if reason == REASON_DISCONNECTED:
+            message = f"客户端已断开，取消请求（阶段: {stage}）"
+        else:
+            message = f"请求超时（阶段: {stage}，已耗时 {elapsed:.1f} 秒）"
+        super().__init__(message)
+        self.stage = stage
+        self.reason = reason
+        self.elapsed = elapsed
+
+
+class Deadline:
+    """
+    一个请求的期限
+
+    属性:
+        current_stage: 当前所处的阶段（不在任何阶段时为None）
+        reason: 取消原因，未取消时为None
+        cancelled_stage: 被取消时所处的阶段
+    """
+
+    def __init__(self, total=None, budgets=None):
+        """
+        参数:
+            total: 总期限（秒），默认 REQUEST_DEADLINE_SECONDS
+            budgets: 阶段名 -> 预算（秒），默认 STAGE_BUDGETS
+        """
+        self.started = time.perf_counter()
+        self.expires_at = self.started + (REQUEST_DEADLINE_SECONDS if total is None else total)
+        self.budgets = STAGE_BUDGETS if budgets is None else budgets
+        self.current_stage = None
+        self.stage_expires_at = self.expires_at
+        self.reason = None
+        self.cancelled_stage = None
+        self._generation = 0  # 每次进入/离开阶段加1，监视线程据此忽略过期的定时
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        """请求开始至今的耗时（秒）"""
+        return time.perf_counter() - self.started
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def time_left(self):
+        """当前阶段剩余的时间（秒），不小于0"""
+        return max(self.stage_expires_at - time.perf_counter(), 0.0)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        进入一个阶段，按预算设置该阶段的截止时间
+
+        进入前已经超时或被取消时抛出 DeadlineExceeded
+        """
+        self.check(name)
+        with self._lock:
+            previous = (self.current_stage, self.stage_expires_at)
+            self._generation += 1
+            generation = self._generation
+            self.current_stage = name
+            budget = self.budgets.get(name)
+            if budget is not None:
+                self.stage_expires_at = min(time.perf_counter() + budget, self.expires_at)
+        _watchdog.arm(self, self.stage_expires_at, generation)
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._generation += 1
+                self.current_stage, self.stage_expires_at = previous
+
+    def check(self, stage=None):
+        """
+        已超时或已被取消时抛出 DeadlineExceeded
+
+        参数:
+            stage: 即将进入的阶段（用于错误信息），默认为当前阶段
+        """
+        if self.reason is None and time.perf_counter() >= self.stage_expires_at:
+            self.cancel(REASON_TIMEOUT)
+        if self.reason is not None:
+            raise DeadlineExceeded(self.cancelled_stage or stage or "unknown", self.reason, self.elapsed)
+
+    def cancel(self, reason):
+        """
+        取消请求并调用所有已注册的回调（只生效一次）
+
+        参数:
+            reason: REASON_TIMEOUT 或 REASON_DISCONNECTED
+        """
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            self.cancelled_stage = self.current_stage
+            callbacks, self._callbacks = self._callbacks, []
+
+        log_event(logger, logging.WARNING, "request_cancelled", reason=reason,
+                  stage=self.cancelled_stage, elapsed_ms=round(self.elapsed * 1000, 1))
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                log_event(logger, logging.WARNING, "cancel_callback_failed", error=str(e))
+
+    def on_cancel(self, callback):
+        """
+        注册取消时调用的回调（在取消的线程中执行，应尽快返回）；已取消时立即调用
+
+        返回:
+            注销该回调的函数
+        """
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def _expire(self, generation):
+        """监视线程调用：仍处于同一次进入的阶段时按超时取消"""
+        if generation == self._generation:
+            self.cancel(REASON_TIMEOUT)
+
+
+class _Watchdog:
+    """
+    后台监视线程（每个进程一个）
+
+    按截止时间排列的定时堆，加上需要定期检查的客户端连接
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._timers = []   # [(截止时间, 序号, 期限对象, 阶段代数)]
+        self._sockets = {}  # 期限对象 -> 客户端socket
+        self._sequence = itertools.count()
+        self._next_poll = 0.0
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="deadline-watchdog", daemon=True)
+            self._thread.start()
+
+    def arm(self, deadline, expires_at, generation):
+        """到达expires_at时若期限仍处于第generation次进入的阶段则取消"""
+        with self._cond:
+            self._ensure_started()
+            heapq.heappush(self._timers, (expires_at, next(self._sequence), deadline, generation))
+            self._cond.notify()
+
+    def watch(self, deadline, client_socket):
+        """定期检查客户端连接，断开时取消请求"""
+        with self._cond:
+            self._ensure_started()
+            self._sockets[deadline] = client_socket
+            self._cond.notify()
+
+    def unwatch(self, deadline):
+        with self._cond:
+            self._sockets.pop(deadline, None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.perf_counter()
+                    due = []
+                    while self._timers and self._timers[0][0] <= now:
+                        due.append(heapq.heappop(self._timers))
+                    poll = bool(self._sockets) and now >= self._next_poll
+                    if due or poll:
+                        break
+                    waits = []
+                    if self._timers:
+                        waits.append(self._timers[0][0] - now)
+                    if self._sockets:
+                        waits.append(self._next_poll - now)
+                    self._cond.wait(min(waits) if waits else None)
+                sockets = list(self._sockets.items()) if poll else []
+                if poll:
+                    self._next_poll = now + DISCONNECT_POLL_INTERVAL
+
+            for _, _, deadline, generation in due:
+                deadline._expire(generation)
+            for deadline, client_socket in sockets:
+                if peer_closed(client_socket):
+                    self.unwatch(deadline)
+                    deadline.cancel(REASON_DISCONNECTED)
+
+
+_watchdog = _Watchdog()
+
+
+def peer_closed(client_socket):
+    """
+    不读取数据地检查客户端是否已关闭连接
+
+    MSG_PEEK只查看接收缓冲区：返回空字节表示对方已关闭；有数据（例如保持连接时的下一个请求）
+    或暂时没有数据都说明连接仍然有效。不支持这些标志的连接（例如TLS连接）视为仍然有效
+    """
+    try:
+        return client_socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except (BlockingIOError, InterruptedError, ValueError):
+        return False
+    except OSError as e:
+        return e.errno in (errno.ECONNRESET, errno.ENOTCONN, errno.EPIPE, errno.EBADF)
+
+
+# ==================== 当前请求的期限 ====================
+def start_deadline(client_socket=None, total=None):
+    """
+    为当前请求创建期限
+
+    参数:
+        client_socket: 客户端连接（environ中的 gunicorn.socket 或 werkzeug.socket），提供时检测客户端断开；
+            TLS连接（gunicorn配置了证书）无法不读取数据地检查，不检测断开
+        total: 总期限（秒），默认 REQUEST_DEADLINE_SECONDS
+
+    返回:
+        Deadline对象
+    """
+    deadline = Deadline(total)
+    _current_deadline.set(deadline)
+    if client_socket is not None and not isinstance(client_socket, ssl.SSLSocket):
+        _watchdog.watch(deadline, client_socket)
+    return deadline
+
+
+def current_deadline():
+    """返回当前请求的期限，不在请求中时返回None"""
+    return _current_deadline.get()
+
+
+def end_deadline():
+    """结束当前请求的期限，停止检测客户端连接"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return
+    _current_deadline.set(None)
+    _watchdog.unwatch(deadline)
+
+
+@contextmanager
+def deadline_stage(stage):
+    """
+    在当前请求的期限内进入一个阶段
+
+    已处于该阶段时（例如应用和客户端都声明了upstream阶段）直接沿用；
+    不在请求中时创建一个只包含该阶段预算的期限
+
+    使用方法：
+        with deadline_stage(STAGE_UPSTREAM) as deadline:
+            response = session.post(url, timeout=deadline.time_left())
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        deadline = Deadline(total=STAGE_BUDGETS.get(stage, REQUEST_DEADLINE_SECONDS))
+    if deadline.current_stage == stage:
+        yield deadline
+        return
+    with deadline.stage(stage):
+        yield deadline
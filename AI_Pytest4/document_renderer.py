@@ -0,0 +1,452 @@
+"""
+年度总结Word文档渲染模块
+
+这个文件负责把AI提取出的结构化内容填充到Word模板中，包括：
+1. 计算每个占位符最终要写入的文本
+2. 遍历模板段落和表格完成替换
+3. 把列表字段展开为每个条目一段（复制占位符所在段落的XML，保留样式和编号）
+4. 把填充好的文档序列化为.docx字节（流式输出见 docx_stream.py）
+5. 用预编译模板（template_compiler.py）直接拼接XML片段生成文档，不经过python-docx
+
+作者：AI助手
+日期：2025年
+"""
+
+import datetime
+import io
+import re
+import zipfile
+from copy import deepcopy
+from xml.sax.saxutils import escape
+
+from metrics import STAGE_DOC_SAVE, STAGE_TEMPLATE_FILL, stage_timer
+
+
+# 占位符与AI返回JSON字段的对应关系
+# 顺序与模板中出现的顺序保持一致，方便阅读
+PLACEHOLDER_FIELDS = (
+    ('[[年度总结概述]]', '年度总结概述'),
+    ('[[主要成就与贡献]]', '主要成就与贡献'),
+    ('[[遇到的挑战及解决方案]]', '遇到的挑战及解决方案'),
+    ('[[个人成长与学习]]', '个人成长与学习'),
+    ('[[未来展望与计划]]', '未来展望与计划'),
+    ('[[您的姓名]]', '姓名'),
+    ('[[报告日期]]', '报告日期'),
+)
+
+# 表格中只替换基本信息类的占位符
+TABLE_PLACEHOLDERS = ('[[您的姓名]]', '[[报告日期]]')
+
+# XML 1.0 不允许出现的控制字符，写入文档前去掉（python-docx会直接报错）
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# 可以安全拆分的run内容：字符格式、文本、制表符、换行（不会丢失图片、域代码等内容）
+PLAIN_RUN_TAGS = ("rPr", "t", "tab", "br", "cr")
+
+# 列表条目前手动加的项目符号（模板段落本身带项目符号或编号时不加）
+MANUAL_BULLET = '• '
+
+
+def format_value(value):
+    """
+    把AI返回的字段值格式化为写入文档的文本
+
+    参数:
+        value: 字段值（可能是字符串或列表）
+
+    返回:
+        格式化后的字符串，列表会转换为带项目符号的多行文本
+    """
+    if isinstance(value, list):
+        # 将列表转换为带项目符号的多行文本
+        formatted_value = "\n".join([f"{MANUAL_BULLET}{item}" for item in value if item and item.strip()])
+        if not formatted_value:  # 如果列表为空
+            formatted_value = "暂无相关内容"
+        return formatted_value
+
+    # 确保值是字符串，如果为空则提供默认值
+    return str(value or '暂无相关内容')
+
+
+def resolve_placeholders(extracted_content):
+    """
+    计算每个占位符最终的替换文本
+
+    姓名和报告日期缺失时使用默认值，因此同一份AI结果在不同日期
+    可能得到不同的文档，缓存键应基于这里的返回值计算
+
+    参数:
+        extracted_content: AI返回并解析后的字典
+
+    返回:
+        占位符 -> 替换文本 的字典
+    """
+    defaults = {
+        '姓名': '未填写',
+        '报告日期': datetime.date.today().strftime('%Y年%m月%d日'),
+    }
+    values = {}
+    for placeholder, field in PLACEHOLDER_FIELDS:
+        if field in defaults:
+            value = extracted_content.get(field, defaults[field])
+        else:
+            value = extracted_content.get(field)
+        values[placeholder] = format_value(value)
+    return values
+
+
+def resolve_list_items(extracted_content):
+    """
+    找出需要逐条展开的列表字段
+
+    参数:
+        extracted_content: AI返回并解析后的字典
+
+    返回:
+        占位符 -> 条目列表 的字典（只包含至少有一个非空条目的列表字段；
+        没有条目时仍按 format_value 写入“暂无相关内容”）
+    """
+    items = {}
+    for placeholder, field in PLACEHOLDER_FIELDS:
+        value = extracted_content.get(field)
+        if isinstance(value, list):
+            entries = [item for item in value if item and item.strip()]
+            if entries:
+                items[placeholder] = entries
+    return items
+
+
+def _has_numbering(paragraph):
+    """段落本身或其样式（含继承的样式）是否带有项目符号/编号"""
+    p_pr = paragraph._p.pPr
+    if p_pr is not None and p_pr.numPr is not None:
+        return True
+    style = paragraph.style
+    while style is not None:
+        style_p_pr = style.element.pPr
+        if style_p_pr is not None and style_p_pr.numPr is not None:
+            return True
+        style = style.base_style
+    return False
+
+
+def list_item_prototype(paragraph):
+    """
+    以列表占位符所在段落为原型，构造每个条目共用的段落和run
+
+    保留段落属性（样式、缩进、编号）和第一个run的字符格式；
+    预编译模板（template_compiler.py）也用它生成条目段落的XML片段
+
+    参数:
+        paragraph: 只包含列表占位符的段落
+
+    返回:
+        (只保留段落属性的空段落元素, 带原字符格式的空run元素, 条目前的项目符号)；
+        原型段落带项目符号/编号时项目符号为空字符串，否则为 MANUAL_BULLET
+    """
+    from docx.oxml import OxmlElement  # 延迟导入，见 content_parsing.extract_docx_text
+    from docx.oxml.ns import qn
+
+    prototype = paragraph._p
+    first_run = prototype.find(qn('w:r'))
+    run_properties = first_run.find(qn('w:rPr')) if first_run is not None else None
+    bullet = '' if _has_numbering(paragraph) else MANUAL_BULLET
+
+    empty_paragraph = deepcopy(prototype)
+    for child in list(empty_paragraph):
+        if child.tag != qn('w:pPr'):
+            empty_paragraph.remove(child)
+    empty_run = OxmlElement('w:r')
+    if run_properties is not None:
+        empty_run.append(deepcopy(run_properties))
+    return empty_paragraph, empty_run, bullet
+
+
+def _clean_text(text):
+    """统一换行符并去掉XML不允许的控制字符（python-docx填充和预编译模板共用）"""
+    return INVALID_XML_CHARS.sub('', text.replace('\r\n', '\n').replace('\r', '\n'))
+
+
+def set_run_text(run, text):
+    """
+    替换run的文本，保留字符格式
+
+    换行和制表符分别写为 <w:br/> 和 <w:tab/>，生成的XML与预编译模板（_text_xml）相同
+
+    参数:
+        run: run元素
+        text: 要写入的文本
+    """
+    from docx.oxml import OxmlElement  # 延迟导入，见 content_parsing.extract_docx_text
+    from docx.oxml.ns import qn
+
+    for child in list(run):
+        if child.tag != qn('w:rPr'):
+            run.remove(child)
+    for line_index, line in enumerate(_clean_text(text).split('\n')):
+        if line_index:
+            run.append(OxmlElement('w:br'))
+        for tab_index, chunk in enumerate(line.split('\t')):
+            if tab_index:
+                run.append(OxmlElement('w:tab'))
+            t = OxmlElement('w:t')
+            t.set(qn('xml:space'), 'preserve')
+            t.text = chunk
+            run.append(t)
+
+
+def _plain_run(run):
+    """run中只有文本、制表符和换行"""
+    return all(child.tag.rsplit('}', 1)[-1] in PLAIN_RUN_TAGS for child in run)
+
+
+def isolate_placeholder(paragraph, placeholder):
+    """
+    把段落中第一个占位符放入单独的run
+
+    占位符沿用第一个run的字符格式；占位符前后的文字留在原来的run中，格式不变。
+    python-docx填充（replace_placeholder）和预编译模板（template_compiler.py）共用，
+    两种方式生成的文档因此相同
+
+    参数:
+        paragraph: Word文档的段落对象
+        placeholder: 占位符
+
+    返回:
+        只包含占位符文本的run元素；占位符不在段落的run中（例如位于超链接内）
+        或跨越了图片、域代码等内容时返回None
+    """
+    runs = list(paragraph._p.r_lst)
+    texts = [run.text for run in runs]
+    full_text = ''.join(texts)
+    start = full_text.find(placeholder)
+    if start < 0:
+        return None
+    end = start + len(placeholder)
+
+    # 找出占位符跨越的run
+    offset = 0
+    first = last = None
+    for index, text in enumerate(texts):
+        if first is None and start < offset + len(text):
+            first, first_offset = index, offset
+        if end <= offset + len(text):
+            last = index
+            break
+        offset += len(text)
+    if first is None or last is None:
+        return None
+    spanned = runs[first:last + 1]
+    if not all(_plain_run(run) for run in spanned):
+        return None
+
+    run = spanned[0]
+    local_start = start - first_offset
+    after_text = ''.join(texts[first:last + 1])[local_start + len(placeholder):]
+    if last > first:
+        # 占位符跨越多个run：中间的run删除，最后一个run只保留占位符之后的文字
+        for extra in spanned[1:-1]:
+            paragraph._p.remove(extra)
+        if after_text:
+            spanned[-1].text = after_text
+        else:
+            paragraph._p.remove(spanned[-1])
+    elif after_text:
+        after = deepcopy(run)
+        after.text = after_text
+        run.addnext(after)
+    if local_start > 0:
+        before = deepcopy(run)
+        before.text = texts[first][:local_start]
+        run.addprevious(before)
+    run.text = placeholder
+    return run
+
+
+def render_list_paragraph(paragraph, items, bullet=None):
+    """
+    把只含一个占位符的段落展开为每个条目一段
+
+    每个条目复制一份原型段落（见 list_item_prototype），最后一次性替换原段落，
+    不经过python-docx逐段的API调用
+
+    参数:
+        paragraph: 只包含一个占位符的段落
+        items: 条目列表
+        bullet: 条目前的项目符号，默认由原型段落决定（见 list_item_prototype）
+    """
+    prototype = paragraph._p
+    empty_paragraph, empty_run, prototype_bullet = list_item_prototype(paragraph)
+    if bullet is None:
+        bullet = prototype_bullet
+
+    clones = []
+    for item in items:
+        run = deepcopy(empty_run)
+        set_run_text(run, f"{bullet}{item}")
+        clone = deepcopy(empty_paragraph)
+        clone.append(run)
+        clones.append(clone)
+
+    parent = prototype.getparent()
+    index = parent.index(prototype)
+    parent[index:index + 1] = clones
+
+
+def replace_placeholder(paragraph, placeholder, formatted_value):
+    """
+    替换段落中的占位符
+
+    替换文本写入单独的run，沿用占位符第一个run的字符格式，前后文字的格式不变
+    （见 isolate_placeholder）；占位符位于超链接等无法拆分的位置时退回整段替换，
+    该段的字符格式会丢失
+
+    参数:
+        paragraph: Word文档的段落对象
+        placeholder: 要替换的占位符（如：[[年度总结概述]]）
+        formatted_value: 已格式化的替换文本
+    """
+    count = paragraph.text.count(placeholder)
+    runs = []
+    for _ in range(count):
+        run = isolate_placeholder(paragraph, placeholder)
+        if run is None:
+            break
+        run.text = ''  # 先清空，替换文本中即使含有占位符也不会被再次匹配
+        runs.append(run)
+    for run in runs:
+        set_run_text(run, formatted_value)
+    if len(runs) < count:
+        paragraph.text = _clean_text(paragraph.text.replace(placeholder, formatted_value))
+
+
+def fill_template(doc, extracted_content):
+    """
+    用AI提取的内容填充已加载的模板文档
+
+    参数:
+        doc: python-docx的Document对象（会被原地修改）
+        extracted_content: AI返回并解析后的字典
+    """
+    values = resolve_placeholders(extracted_content)
+    list_items = resolve_list_items(extracted_content)
+
+    # 遍历文档中的所有段落，查找并替换占位符（doc.paragraphs 是开始遍历前的列表，展开列表不影响遍历）
+    for paragraph in doc.paragraphs:
+        text = paragraph.text
+        if '[[' not in text:
+            continue
+        # 整段只有一个列表占位符时逐条展开；和其他文字在同一段时仍按多行文本替换
+        placeholder = text.strip()
+        if placeholder in list_items:
+            render_list_paragraph(paragraph, list_items[placeholder])
+            continue
+        # 整段只有其他占位符时同样按原型段落写为一段（不加项目符号），与预编译模板一致
+        if placeholder in values:
+            render_list_paragraph(paragraph, [values[placeholder]], bullet='')
+            continue
+        for placeholder, formatted_value in values.items():
+            replace_placeholder(paragraph, placeholder, formatted_value)
+
+    # 处理表格中的占位符（如果模板中有表格）
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for paragraph in cell.paragraphs:
+                    for placeholder in TABLE_PLACEHOLDERS:
+                        replace_placeholder(paragraph, placeholder, values[placeholder])
+
+
+def load_filled_document(template_source, extracted_content):
+    """
+    加载模板并填充内容，返回尚未序列化的文档对象
+
+    流式输出（docx_stream.py）直接从文档对象逐个写出zip条目，不经过完整的.docx字节
+
+    参数:
+        template_source: Word模板文件路径或字节流
+        extracted_content: AI返回并解析后的字典
+
+    返回:
+        python-docx的Document对象
+    """
+    from docx import Document  # 延迟导入，见 content_parsing.extract_docx_text
+
+    with stage_timer(STAGE_TEMPLATE_FILL):
+        doc = Document(template_source)
+        fill_template(doc, extracted_content)
+    return doc
+
+
+def render_summary_document(template_source, extracted_content):
+    """
+    加载模板、填充内容并序列化为.docx字节
+
+    参数:
+        template_source: Word模板文件路径或字节流
+        extracted_content: AI返回并解析后的字典
+
+    返回:
+        生成的.docx文件内容（bytes）
+    """
+    doc = load_filled_document(template_source, extracted_content)
+
+    with stage_timer(STAGE_DOC_SAVE):
+        byte_io = io.BytesIO()
+        doc.save(byte_io)
+        return byte_io.getvalue()
+
+
+def _text_xml(text):
+    """
+    把文本转换为可以放在 <w:t xml:space="preserve"> 中的XML
+
+    换行和制表符与 set_run_text 的处理一致，分别写为 <w:br/> 和 <w:tab/>
+    """
+    text = escape(_clean_text(text))
+    return (text.replace('\n', '</w:t><w:br/><w:t xml:space="preserve">')
+                .replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">'))
+
+
+def render_precompiled(template, extracted_content):
+    """
+    用预编译模板生成.docx字节
+
+    正文XML已在构建时切分为静态片段和占位符（template_compiler.py），
+    这里只按顺序拼接片段和转义后的文本，再与模板的其他部件一起打包，不解析XML
+
+    参数:
+        template: 带预编译片段的模板（template_registry.CompiledTemplate，segments 不为空）
+        extracted_content: AI返回并解析后的字典
+
+    返回:
+        生成的.docx文件内容（bytes）
+    """
+    with stage_timer(STAGE_TEMPLATE_FILL):
+        values = resolve_placeholders(extracted_content)
+        list_items = resolve_list_items(extracted_content)
+
+        pieces = []
+        for segment in template.segments:
+            if isinstance(segment, str):
+                pieces.append(segment)
+            elif 'prefix' not in segment:
+                # 段落中的占位符：替换为文本
+                pieces.append(_text_xml(values[segment['placeholder']]))
+            else:
+                # 独占一段的占位符：列表每个条目一段，其他值写为一段
+                items = list_items.get(segment['placeholder'])
+                if items:
+                    texts = [f"{segment['bullet']}{item}" for item in items]
+                else:
+                    texts = [values[segment['placeholder']]]
+                for text in texts:
+                    pieces.extend((segment['prefix'], _text_xml(text), segment['suffix']))
+        document_xml = ''.join(pieces).encode('utf-8')
+
+    with stage_timer(STAGE_DOC_SAVE):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, _, data in template.parts:
+                zf.writestr(name, document_xml if name == template.document_part else data)
+        return buffer.getvalue()
@@ -0,0 +1,175 @@
+"""
+解析和渲染Word文档的进程池
+
+在多线程的服务器中（gthread、ASGI的线程池），Document(file) 的解析和 doc.save() 都是纯CPU的工作，
+在请求线程中执行时一直持有GIL，同一进程里等待星火API的线程读不到数据、发不出请求，
+上游并发随CPU密集的上传一起下降。这里把这两类工作交给专门的子进程：
+1. 每个web worker进程各有一个进程池，默认按“CPU核数 / gunicorn worker数”分配子进程（至少1个），
+   整台主机上的子进程总数约等于CPU核数；DOCX_POOL_WORKERS 指定每个进程池的子进程数，0表示仍在请求线程中执行
+2. 只在进程之间传递字节：上传的.docx字节 -> 文本，模板字节 + 提取结果 -> .docx字节（docx_worker.py）
+3. 每个子进程处理 DOCX_POOL_MAX_TASKS 个任务后退出并由新进程替代，限制lxml的内存增长（需要Python 3.11+）
+4. 子进程以spawn方式启动，不继承gunicorn worker中的线程和锁；主进程被强制结束时子进程随之退出
+5. 子进程异常退出（例如被OOM杀掉）时丢弃整个进程池（下一个任务重新创建），当前任务抛出 DocxPoolUnavailable
+   （接口返回503）：导致子进程退出的任务多半同样会拖垮请求进程，不改在请求线程中执行；
+   还没有完成过任何任务就损坏（子进程无法启动，属于部署配置问题）时停用进程池，之后的任务在请求线程中执行
+
+spawn方式的子进程会重新导入启动脚本：直接运行的脚本中调用 create_app() 时，
+需要放在 if __name__ == '__main__': 之下（gunicorn、uvicorn、flask run 不受影响）。
+
+作者：AI助手
+日期：2025年
+"""
+
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import docx_worker
+from log_config import get_logger, log_event
+from metrics import STAGE_DOC_SAVE, STAGE_TEMPLATE_FILL, observe_stage
+
+
+# ==================== 配置 ====================
+WEB_WORKERS = int(os.getenv("GUNICORN_WORKERS", "4"))  # 同一主机上的web worker数（与 gunicorn.conf.py 的 workers 相同）
+DOCX_POOL_WORKERS = int(os.getenv(
+    "DOCX_POOL_WORKERS", str(max(1, (os.cpu_count() or 1) // max(1, WEB_WORKERS)))
+))                                                                                 # 每个web worker的子进程数，0表示在请求线程中解析和渲染
+DOCX_POOL_MAX_TASKS = int(os.getenv("DOCX_POOL_MAX_TASKS", "200"))                 # 每个子进程处理多少个任务后重启，0表示不重启
+
+logger = get_logger(__name__)
+
+
+class DocxPoolUnavailable(Exception):
+    """进程池损坏，当前任务没有执行（进程池已丢弃，下一个任务重新创建）"""
+
+
+class DocxPool:
+    """
+    Word文档解析和渲染的进程池
+
+    子进程在第一次使用（或预热）时才启动；未启用时各方法直接在当前线程中执行
+    """
+
+    def __init__(self, workers=DOCX_POOL_WORKERS, max_tasks=DOCX_POOL_MAX_TASKS):
+        """
+        参数:
+            workers: 子进程数，0表示不使用进程池
+            max_tasks: 每个子进程处理的任务数上限，0表示不限
+        """
+        self.workers = workers
+        self.max_tasks = max_tasks
+        self._executor = None
+        self._lock = threading.Lock()
+        self._healthy = False  # 是否已有任务在子进程中完成
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _get_executor(self):
+        """当前的进程池，第一次调用时创建"""
+        with self._lock:
+            if self._executor is None:
+                options = {}
+                if self.max_tasks and sys.version_info >= (3, 11):
+                    options["max_tasks_per_child"] = self.max_tasks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=docx_worker.init_worker,
+                    initargs=(os.getpid(),),
+                    **options
+                )
+            return self._executor
+
+    def _discard(self, executor, error):
+        """丢弃已损坏的进程池，下一次调用时重新创建；子进程从未正常工作过时停用进程池"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+            if not self._healthy:
+                self.workers = 0
+        executor.shutdown(wait=False)
+        log_event(logger, logging.WARNING, "docx_pool_broken", error=str(error), disabled=not self.enabled)
+
+    def _run(self, func, *args):
+        """
+        在子进程中执行任务并等待结果；未启用时直接执行
+
+        抛出:
+            DocxPoolUnavailable: 进程池损坏（或刚被其他线程丢弃、正在停止），任务没有执行
+        """
+        if not self.enabled:
+            return func(*args)
+        executor = self._get_executor()
+        try:
+            future = executor.submit(func, *args)
+        except BrokenProcessPool as e:
+            self._discard(executor, e)
+            raise DocxPoolUnavailable(str(e)) from e
+        except RuntimeError as e:
+            # 进程池刚被其他线程丢弃（或服务正在停止），已经关闭
+            raise DocxPoolUnavailable(str(e)) from e
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            self._discard(executor, e)
+            raise DocxPoolUnavailable(str(e)) from e
+        self._healthy = True
+        return result
+
+    def warmup(self):
+        """启动所有子进程并完成python-docx的导入，避免第一批请求等待进程启动"""
+        if not self.enabled:
+            return
+        executor = self._get_executor()
+        try:
+            futures = [executor.submit(docx_worker.ping) for _ in range(self.workers)]
+        except RuntimeError:
+            return  # 进程池已损坏并被请求线程丢弃，见 _run
+        wait(futures)
+        for future in futures:
+            if future.exception() is not None:
+                # 子进程无法启动时各任务在请求线程中执行，服务仍然可用，只记录警告
+                self._discard(executor, future.exception())
+                return
+        self._healthy = True
+
+    def shutdown(self):
+        """停止所有子进程（等待正在执行的任务完成）"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def extract_text(self, data):
+        """
+        提取上传的Word文档中的文本
+
+        参数:
+            data: .docx文件内容（bytes）
+
+        返回:
+            提取出的文本
+        """
+        return self._run(docx_worker.extract_text, data)
+
+    def render(self, template_bytes, extracted_content):
+        """
+        用模板渲染文档
+
+        参数:
+            template_bytes: 模板.docx内容（bytes）
+            extracted_content: AI返回并解析后的字典
+
+        返回:
+            生成的.docx文件内容（bytes）
+        """
+        document, (fill_start, save_start, end) = self._run(docx_worker.render, template_bytes, extracted_content)
+        observe_stage(STAGE_TEMPLATE_FILL, save_start - fill_start, fill_start)
+        observe_stage(STAGE_DOC_SAVE, end - save_start, save_start)
+        return document
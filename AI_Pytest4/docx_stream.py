@@ -0,0 +1,232 @@
+"""
+边序列化边发送的Word文档响应
+
+原先的响应路径先把整个.docx写入内存（BytesIO），再交给send_file发送，
+每个请求的峰值内存 = 解析后的文档树 + 完整的zip字节（以及它的拷贝）。
+.docx本身是zip包，各条目可以依次写出，因此改为：
+1. 模板填充完成后，由后台线程按 python-docx 保存时的顺序逐个写出zip条目，
+   XML部件直接从文档树增量序列化到压缩流中，不先生成完整的XML字节
+2. 每压缩出 DOCX_STREAM_CHUNK_BYTES 字节就放入有界队列，由WSGI/ASGI服务器取出发送
+   （分块传输，没有Content-Length）；客户端接收慢时后台线程在队列满时等待
+3. 输出目标不可定位，zipfile为每个条目写数据描述符（Word、WPS、LibreOffice均支持）
+4. 写出的字节同时写入渲染缓存的临时文件，全部写完后原子地登记为缓存，/download/<文档ID> 照常可用
+
+客户端在第一个条目写完时就开始收到数据；除文档树本身外，每个请求只占用
+DOCX_STREAM_QUEUE_CHUNKS 个分块的内存，与报告大小无关。客户端中途断开时停止序列化并删除临时文件。
+
+作者：AI助手
+日期：2025年
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+import zipfile
+
+from log_config import get_logger, log_event
+from metrics import STAGE_DOC_SAVE, observe_stage
+
+
+# ==================== 配置 ====================
+DOCX_STREAMING = os.getenv("DOCX_STREAMING", "1") == "1"                                 # 新生成的文档是否流式发送，0表示整体生成后再发送
+DOCX_STREAM_CHUNK_BYTES = int(os.getenv("DOCX_STREAM_CHUNK_BYTES", str(64 * 1024)))      # 每次发送的分块大小（字节）
+DOCX_STREAM_QUEUE_CHUNKS = int(os.getenv("DOCX_STREAM_QUEUE_CHUNKS", "4"))               # 已压缩、等待发送的分块数上限
+
+logger = get_logger(__name__)
+
+_DONE = object()  # 队列中的结束标记
+
+
+class _StreamClosed(Exception):
+    """响应已关闭（客户端断开），后台线程停止写入"""
+
+
+class _QueueWriter:
+    """
+    zipfile的输出目标
+
+    只提供write()，没有tell()/seek()：zipfile因此按不可定位的流写入（每个条目后附数据描述符），
+    不会回头修改已经发出的本地文件头。写入的字节凑满一个分块后放入队列
+    """
+
+    def __init__(self, chunks, closed, chunk_size):
+        self._chunks = chunks
+        self._closed = closed
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        """把缓冲的字节放入队列；队列满时等待，响应关闭时抛出 _StreamClosed"""
+        if not self._buffer:
+            return
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        self.put(chunk)
+
+    def put(self, item):
+        while True:
+            if self._closed.is_set():
+                raise _StreamClosed()
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+class _ZipEntryWriter:
+    """把 python-docx PackageWriter 写出的条目写入zip（对应 PhysPkgWriter.write）"""
+
+    def __init__(self, zf, out):
+        self._zf = zf
+        self._out = out
+
+    def write(self, pack_uri, blob):
+        self._zf.writestr(pack_uri.membername, blob)
+        self._out.flush()  # 每个条目写完就发出，小条目也不必等到凑满一个分块
+
+
+def _write_package(doc, out):
+    """
+    把文档写成.docx（在后台线程中执行）
+
+    条目及顺序与 Document.save() 相同（[Content_Types].xml、包关系、各部件及其关系）；
+    XML部件用 ElementTree.write() 边序列化边压缩，字节内容与 XmlPart.blob 一致
+    """
+    from docx.opc.part import XmlPart  # 延迟导入，见 content_parsing.extract_docx_text
+    from docx.opc.pkgwriter import PackageWriter
+    from lxml import etree
+
+    package = doc.part.package
+    parts = package.parts
+    for part in parts:
+        part.before_marshal()
+
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        entries = _ZipEntryWriter(zf, out)
+        PackageWriter._write_content_types_stream(entries, parts)
+        PackageWriter._write_pkg_rels(entries, package.rels)
+        for part in parts:
+            if isinstance(part, XmlPart):
+                with zf.open(part.partname.membername, "w") as dest:
+                    etree.ElementTree(part.element).write(dest, encoding="UTF-8", standalone=True)
+                out.flush()
+            else:
+                entries.write(part.partname, part.blob)
+            if len(part.rels):
+                entries.write(part.partname.rels_uri, part.rels.xml)
+    # 中央目录
+    out.flush()
+
+
+def iter_docx_chunks(doc, chunk_size=DOCX_STREAM_CHUNK_BYTES, max_chunks=DOCX_STREAM_QUEUE_CHUNKS):
+    """
+    把文档序列化为.docx，逐块生成zip字节
+
+    参数:
+        doc: 已填充的python-docx Document对象
+        chunk_size: 分块大小（字节）
+        max_chunks: 等待取出的分块数上限
+
+    返回:
+        生成器，依次产出bytes；提前关闭时后台线程随之停止
+    """
+    chunks = queue.Queue(maxsize=max_chunks)
+    closed = threading.Event()
+    out = _QueueWriter(chunks, closed, chunk_size)
+
+    def produce():
+        try:
+            _write_package(doc, out)
+            out.put(_DONE)
+        except _StreamClosed:
+            pass
+        except BaseException as e:
+            try:
+                out.put(e)
+            except _StreamClosed:
+                pass
+
+    producer = threading.Thread(target=produce, name="docx-stream", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        closed.set()
+        producer.join()
+
+
+class DocxStream:
+    """
+    已填充、尚未序列化的文档
+
+    作为响应体迭代时逐块生成.docx字节；传入渲染缓存时同时写入缓存
+    """
+
+    def __init__(self, doc, chunk_size=DOCX_STREAM_CHUNK_BYTES):
+        """
+        参数:
+            doc: 已填充的python-docx Document对象
+            chunk_size: 分块大小（字节）
+        """
+        self.doc = doc
+        self.chunk_size = chunk_size
+
+    def iter_chunks(self, render_cache=None, cache_key=None):
+        """
+        生成响应体
+
+        参数:
+            render_cache: 启用的RenderCache，None表示不写缓存
+            cache_key: 文档的缓存键
+
+        返回:
+            生成器；服务器提前关闭它（客户端断开）时停止序列化并删除缓存的临时文件
+        """
+        started = time.perf_counter()
+        first_byte_ms = None
+        size = 0
+        spool, spool_path = render_cache.create_temp() if render_cache is not None else (None, None)
+        try:
+            for chunk in iter_docx_chunks(self.doc, self.chunk_size):
+                if not chunk:
+                    continue
+                if spool is not None:
+                    spool.write(chunk)
+                if first_byte_ms is None:
+                    first_byte_ms = round((time.perf_counter() - started) * 1000, 1)
+                size += len(chunk)
+                yield chunk
+        except BaseException as e:
+            if spool is not None:
+                spool.close()
+                render_cache.discard_temp(spool_path)
+            if not isinstance(e, GeneratorExit):
+                log_event(logger, logging.ERROR, "document_stream_failed", error=str(e), bytes=size)
+            else:
+                log_event(logger, logging.INFO, "document_stream_aborted", bytes=size)
+            raise
+        finally:
+            self.doc = None  # 发送完成或中断后尽早释放文档树
+
+        if spool is not None:
+            spool.close()
+            render_cache.put_file(cache_key, spool_path)
+        seconds = time.perf_counter() - started
+        observe_stage(STAGE_DOC_SAVE, seconds, started)
+        log_event(logger, logging.INFO, "document_streamed", bytes=size,
+                  first_byte_ms=first_byte_ms, elapsed_ms=round(seconds * 1000, 1))
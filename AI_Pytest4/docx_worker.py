@@ -0,0 +1,87 @@
+"""
+在进程池子进程中执行的Word文档任务（由 docx_pool.py 调度）
+
+子进程以spawn方式启动，导入本模块时只加载标准库；每个任务只接收和返回字节、字典等可序列化的数据：
+1. extract_text：上传的.docx字节 -> 提取出的文本
+2. render：模板字节 + AI提取结果 -> 生成的.docx字节和各阶段的时间点
+
+阶段耗时由主进程根据返回的时间点记录（perf_counter在同一台机器的各进程间可比较），
+子进程不写Prometheus多进程指标文件。
+
+作者：AI助手
+日期：2025年
+"""
+
+import io
+import os
+import threading
+import time
+
+
+PARENT_CHECK_INTERVAL = 1.0  # 检查主进程是否还在的间隔（秒）
+
+
+def _exit_with_parent(parent_pid):
+    """主进程被强制结束（没有机会关闭进程池）时，子进程随之退出，不留下孤儿进程"""
+    while True:
+        time.sleep(PARENT_CHECK_INTERVAL)
+        if os.getppid() != parent_pid:
+            os._exit(0)
+
+
+def init_worker(parent_pid):
+    """
+    子进程初始化：关闭多进程指标文件，预先导入python-docx/lxml
+
+    参数:
+        parent_pid: 主进程PID
+    """
+    # 子进程随时可能被回收重启，不能在指标目录里留下按PID命名的文件；
+    # 必须在导入 metrics（document_renderer 会导入）之前去掉该环境变量
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    threading.Thread(target=_exit_with_parent, args=(parent_pid,), name="parent-watch", daemon=True).start()
+    import docx  # noqa: F401
+
+
+def ping():
+    """空任务，用于预先启动子进程"""
+    return os.getpid()
+
+
+def extract_text(data):
+    """
+    提取上传的Word文档中的文本
+
+    参数:
+        data: .docx文件内容（bytes）
+
+    返回:
+        提取出的文本，见 content_parsing.extract_docx_text
+    """
+    from content_parsing import extract_docx_text
+
+    return extract_docx_text(io.BytesIO(data))
+
+
+def render(template_bytes, extracted_content):
+    """
+    加载模板、填充内容并保存为.docx
+
+    参数:
+        template_bytes: 模板.docx内容（bytes）
+        extracted_content: AI返回并解析后的字典
+
+    返回:
+        (生成的.docx字节, (开始填充, 开始保存, 保存完成) 三个perf_counter时间点)
+    """
+    from docx import Document
+
+    from document_renderer import fill_template
+
+    fill_start = time.perf_counter()
+    doc = Document(io.BytesIO(template_bytes))
+    fill_template(doc, extracted_content)
+    save_start = time.perf_counter()
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue(), (fill_start, save_start, time.perf_counter())
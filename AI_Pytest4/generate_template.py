@@ -89,6 +89,12 @@ try:
             for p in placeholders:
                 print(f"   • {p}")
 
+            # 检查模板并生成预编译模板（与 python template_compiler.py 相同）
+            print("\n🔍 正在检查模板并生成预编译模板...")
+            from template_compiler import compile_file
+            if not compile_file('年度总结模板.docx'):
+                print("模板未通过检查，请根据上面的提示修改后运行 python template_compiler.py")
+
 except ImportError:
     print("❌ 缺少 python-docx 库")
     print("请先安装：pip install python-docx")
@@ -0,0 +1,38 @@
+"""
+Gunicorn部署配置
+
+使用方法：
+    gunicorn -c gunicorn.conf.py 'app:create_app()'
+
+多worker部署时，Prometheus指标需要各worker共享一个目录：
+    export PROMETHEUS_MULTIPROC_DIR=/tmp/summary_metrics
+
+作者：AI助手
+日期：2025年
+"""
+
+import os
+import shutil
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+# 每个worker各有一个Word文档进程池（docx_pool.py），默认每个进程池 CPU核数/workers 个子进程（至少1个），
+# 整台主机的子进程总数约等于CPU核数；修改workers时请通过 GUNICORN_WORKERS 设置，进程池按同一个值分配
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+
+
+def on_starting(server):
+    """主进程启动时清空多进程指标目录，避免读到上一次运行的残留数据"""
+    metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """worker退出时清理其实时指标（如正在处理的请求数）"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,199 @@
+"""
+生成请求的幂等键
+
+浏览器或代理在请求超时后重发 POST /generate_summary 时，不应再付一次大模型调用的费用。
+请求携带 Idempotency-Key 请求头时：
+1. 第一次出现的键登记为“处理中”，大模型的提取结果保存到登记中，保留 IDEMPOTENCY_TTL_SECONDS
+2. 同一键再次到达时：
+   - 已有结果：直接用保存的提取结果渲染文档返回（通常命中文档缓存），不再调用大模型
+   - 仍在处理：返回409和 Retry-After
+   - 内容（模板和规范化后的输入）与第一次不同：返回422
+3. 第一次处理失败（上游错误、超时、客户端断开等）时删除登记，重试会重新处理
+
+每次登记生成一个令牌，只有持有令牌的请求（登记它的那个请求）才能保存结果或删除登记：
+同一进程中收到409/422或直接复用结果的重复请求结束时不会删掉第一次请求的登记。
+
+登记保存在SQLite文件中，同一主机的多个gunicorn worker共享；处理中的进程退出后其登记自动失效。
+
+作者：AI助手
+日期：2025年
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from deadline import REQUEST_DEADLINE_SECONDS
+from log_config import get_logger, log_event
+from metrics import IDEMPOTENCY_REQUESTS
+from singleflight import normalize_input, owner_exited, process_owner
+from state_files import connect_state_db, state_path
+
+
+# ==================== 配置 ====================
+IDEMPOTENCY_DB = os.getenv(
+    "IDEMPOTENCY_DB", state_path("summary_idempotency.db")
+)                                                                                    # 登记文件，为空时忽略Idempotency-Key
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))       # 保存结果的时间窗口（秒）
+IDEMPOTENCY_LEASE_SECONDS = REQUEST_DEADLINE_SECONDS + 30  # 处理中的登记最长有效时间
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# 冲突原因
+CONFLICT_IN_PROGRESS = "in_progress"
+CONFLICT_MISMATCH = "mismatch"
+
+logger = get_logger(__name__)
+
+
+class IdempotencyConflict(Exception):
+    """
+    同一幂等键的请求不能处理
+
+    属性:
+        reason: CONFLICT_IN_PROGRESS 或 CONFLICT_MISMATCH
+        elapsed: 第一次请求已处理的时间（秒）
+    """
+
+    def __init__(self, reason, elapsed=0.0):
+        if reason == CONFLICT_IN_PROGRESS:
+            message = "相同的请求正在处理中"
+        else:
+            message = "Idempotency-Key 已用于内容不同的请求"
+        super().__init__(message)
+        self.reason = reason
+        self.elapsed = elapsed
+
+
+def request_fingerprint(template_id, user_input):
+    """请求内容的摘要：模板ID + 规范化后的用户输入"""
+    digest = hashlib.sha256()
+    digest.update(template_id.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_input(user_input).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """
+    幂等键登记（SQLite）
+
+    表 idempotency 每个键一行：
+        fingerprint: 请求内容摘要
+        owner: 处理请求的进程 "主机名:进程号"
+        token: 登记该键的请求持有的令牌
+        status: running | done
+        result: 大模型提取结果（JSON）
+    """
+
+    def __init__(self, path=None):
+        """
+        参数:
+            path: 登记文件，默认 IDEMPOTENCY_DB，为空字符串时关闭
+        """
+        self.path = IDEMPOTENCY_DB if path is None else path
+        self.owner = process_owner()
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connect(self):
+        """每个线程一个连接；自动提交，事务由 BEGIN IMMEDIATE 显式开始"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = connect_state_db(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency ("
+                " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, owner TEXT NOT NULL, status TEXT NOT NULL,"
+                " created_at REAL NOT NULL, completed_at REAL, result TEXT, token TEXT)"
+            )
+            try:
+                # 早期版本创建的登记文件没有 token 列
+                conn.execute("ALTER TABLE idempotency ADD COLUMN token TEXT")
+            except sqlite3.OperationalError:
+                pass
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def begin(self, key, fingerprint):
+        """
+        登记一个幂等键
+
+        参数:
+            key: 请求头中的幂等键
+            fingerprint: 请求内容摘要，见 request_fingerprint()
+
+        返回:
+            (已保存的提取结果, None)；首次出现时登记为处理中，返回 (None, 令牌)，
+            之后用该令牌调用 complete() 或 release()
+
+        抛出:
+            IdempotencyConflict
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM idempotency WHERE created_at < ?", (now - IDEMPOTENCY_TTL_SECONDS,))
+            row = conn.execute(
+                "SELECT fingerprint, owner, status, created_at, result FROM idempotency WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                stored_fingerprint, owner, status, created_at, result = row
+                stale = status == "running" and (
+                    now - created_at > IDEMPOTENCY_LEASE_SECONDS or owner_exited(owner)
+                )
+                if not stale:
+                    conn.execute("COMMIT")
+                    if stored_fingerprint != fingerprint:
+                        IDEMPOTENCY_REQUESTS.labels(result=CONFLICT_MISMATCH).inc()
+                        raise IdempotencyConflict(CONFLICT_MISMATCH)
+                    if status == "running":
+                        IDEMPOTENCY_REQUESTS.labels(result=CONFLICT_IN_PROGRESS).inc()
+                        raise IdempotencyConflict(CONFLICT_IN_PROGRESS, now - created_at)
+                    IDEMPOTENCY_REQUESTS.labels(result="replayed").inc()
+                    log_event(logger, logging.INFO, "idempotent_replay", key=key[:16])
+                    return json.loads(result), None
+            token = uuid.uuid4().hex
+            conn.execute(
+                "INSERT OR REPLACE INTO idempotency (key, fingerprint, owner, token, status, created_at)"
+                " VALUES (?, ?, ?, ?, 'running', ?)",
+                (key, fingerprint, self.owner, token, now),
+            )
+            conn.execute("COMMIT")
+        except IdempotencyConflict:
+            raise
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        IDEMPOTENCY_REQUESTS.labels(result="new").inc()
+        return None, token
+
+    def complete(self, key, token, result):
+        """
+        保存首次处理得到的提取结果
+
+        参数:
+            key: 幂等键
+            token: begin() 返回的令牌；登记已过期并被其他请求重新登记时不更新
+            result: 提取结果
+        """
+        self._connect().execute(
+            "UPDATE idempotency SET status = 'done', completed_at = ?, result = ?"
+            " WHERE key = ? AND token = ? AND status = 'running'",
+            (time.time(), json.dumps(result, ensure_ascii=False), key, token),
+        )
+
+    def release(self, key, token):
+        """首次处理失败：删除本请求登记且仍在处理中的登记，允许重试"""
+        self._connect().execute(
+            "DELETE FROM idempotency WHERE key = ? AND token = ? AND status = 'running'", (key, token)
+        )
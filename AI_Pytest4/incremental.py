@@ -0,0 +1,393 @@
+"""
+增量提取：用户修改部分输入后重新生成时，只把改动的片段发给大模型
+
+用户通常是改了一段文字再点一次生成，原先整段输入都要重新发送给大模型，
+耗时和token费用与输入总长度成正比。增量模式下：
+1. 规范化后的输入按行切成片段：片段边界由内容决定（段落结束处或按行内容的哈希值），
+   修改一段文字只影响它所在的片段，前后片段的边界和内容不变
+2. 每个片段的提取结果（四个列表字段，以及片段中出现的姓名、日期）按 提示词版本+调用方式+片段内容 的摘要缓存
+3. 再次提交时只把缓存中没有的片段放进一次调用（每个片段分别提取），
+   年度总结概述根据新片段和其他片段已提取的条目一并生成
+4. 各片段的结果按原文顺序合并为与完整提取相同结构的字典，后续渲染流程不变
+
+所有片段都命中缓存、只是顺序或删除了片段时，只发送已提取的条目生成概述；
+内容完全相同时不调用大模型。缓存保存在SQLite文件中，同一主机的多个gunicorn worker共享；
+缓存不可用时按未命中处理，仍然可以生成。
+
+作者：AI助手
+日期：2025年
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from log_config import get_logger, log_event
+from metrics import INCREMENTAL_CHUNKS
+from singleflight import normalize_input
+from state_files import connect_state_db, state_path
+
+
+# ==================== 配置 ====================
+INCREMENTAL_EXTRACTION = os.getenv("INCREMENTAL_EXTRACTION", "0") == "1"            # 未指定时是否使用增量提取（表单字段 incremental 可逐个请求指定）
+INCREMENTAL_DB = os.getenv(
+    "INCREMENTAL_DB", state_path("summary_chunks.db")
+)                                                                                    # 片段提取结果的缓存文件，为空时关闭增量提取
+INCREMENTAL_TTL_SECONDS = float(os.getenv("INCREMENTAL_TTL_SECONDS", str(7 * 86400)))  # 片段结果未被使用后的保留时间（秒）
+INCREMENTAL_CHUNK_MIN_CHARS = int(os.getenv("INCREMENTAL_CHUNK_MIN_CHARS", "200"))     # 片段达到该长度后才在内容边界处切分
+INCREMENTAL_CHUNK_MAX_CHARS = int(os.getenv("INCREMENTAL_CHUNK_MAX_CHARS", "1200"))    # 片段长度上限
+INCREMENTAL_CONTEXT_CHARS = int(os.getenv("INCREMENTAL_CONTEXT_CHARS", "1500"))        # 生成概述时附带的其他片段条目的长度上限
+
+# 片段提示词或合并规则变化时修改，旧的缓存结果随之失效
+PROMPT_VERSION = "1"
+
+# 按片段提取、按原文顺序合并的字段
+LIST_FIELDS = ("主要成就与贡献", "遇到的挑战及解决方案", "个人成长与学习", "未来展望与计划")
+# 取第一个非空值的字段
+SCALAR_FIELDS = ("姓名", "报告日期")
+OVERVIEW_FIELD = "年度总结概述"
+
+# 内容边界：行内容哈希值的低位为0时可以切分（平均每4行一个边界）
+_BOUNDARY_MASK = 0x3
+
+logger = get_logger(__name__)
+
+
+def split_chunks(text):
+    """
+    把输入切成片段
+
+    按行累积，达到 INCREMENTAL_CHUNK_MIN_CHARS 后在段落结束（下一行为空行）或行内容哈希满足条件处切分，
+    达到 INCREMENTAL_CHUNK_MAX_CHARS 时强制切分；边界只取决于附近几行的内容，与前文长度无关
+
+    参数:
+        text: 用户输入
+
+    返回:
+        片段文本列表（不含空片段）
+    """
+    lines = normalize_input(text).split("\n")
+    chunks = []
+    current = []
+    size = 0
+    for index, line in enumerate(lines):
+        # 超长的单行按上限切开
+        while len(line) > INCREMENTAL_CHUNK_MAX_CHARS:
+            if current:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            chunks.append(line[:INCREMENTAL_CHUNK_MAX_CHARS])
+            line = line[INCREMENTAL_CHUNK_MAX_CHARS:]
+        if not line and not current:
+            continue
+        current.append(line)
+        size += len(line) + 1
+        if size < INCREMENTAL_CHUNK_MIN_CHARS:
+            continue
+        next_blank = index + 1 < len(lines) and not lines[index + 1].strip()
+        line_hash = int.from_bytes(hashlib.blake2b(line.encode("utf-8"), digest_size=4).digest(), "big")
+        if next_blank or line_hash & _BOUNDARY_MASK == 0 or size >= INCREMENTAL_CHUNK_MAX_CHARS:
+            chunks.append("\n".join(current).strip())
+            current, size = [], 0
+    if current:
+        chunks.append("\n".join(current).strip())
+    return [chunk for chunk in chunks if chunk]
+
+
+def chunk_key(chunk, signature):
+    """片段结果的缓存键：提示词版本 + 调用方式 + 片段内容"""
+    digest = hashlib.sha256()
+    for part in (PROMPT_VERSION, signature, chunk):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def overview_key(keys):
+    """概述的缓存键：所有片段缓存键按顺序的摘要"""
+    return hashlib.sha256("overview\0".encode("utf-8") + "\0".join(keys).encode("utf-8")).hexdigest()
+
+
+def _as_list(value):
+    """模型返回的列表字段：字符串视为单个条目，其他非列表值视为空"""
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    if not isinstance(value, list):
+        return []
+    return [str(item) for item in value if str(item).strip()]
+
+
+def _chunk_result(entry):
+    """从模型回复中的一个片段项整理出缓存的结果"""
+    result = {field: _as_list(entry.get(field)) for field in LIST_FIELDS}
+    for field in SCALAR_FIELDS:
+        value = entry.get(field)
+        result[field] = value.strip() if isinstance(value, str) else ""
+    return result
+
+
+def _empty_result():
+    result = {field: [] for field in LIST_FIELDS}
+    result.update({field: "" for field in SCALAR_FIELDS})
+    return result
+
+
+class ExtractionPlan:
+    """
+    一次增量提取：哪些片段已有结果，哪些需要调用大模型
+
+    属性:
+        chunks: 片段文本列表
+        results: 各片段的结果（未命中为None）
+        overview: 缓存的概述、姓名和报告日期（未命中为None）
+    """
+
+    def __init__(self, store, chunks, keys, results, overview):
+        self._store = store
+        self.chunks = chunks
+        self.keys = keys
+        self.results = results
+        self.overview = overview
+
+    @property
+    def pending(self):
+        """需要调用大模型的片段序号"""
+        return [i for i, result in enumerate(self.results) if result is None]
+
+    @property
+    def needs_call(self):
+        return self.overview is None or bool(self.pending)
+
+    def _known_scalars(self):
+        known = {}
+        for result in self.results:
+            for field in SCALAR_FIELDS:
+                if result is not None and result[field] and field not in known:
+                    known[field] = result[field]
+        return known
+
+    def _context(self):
+        """已有结果的片段中的条目，供生成概述（超过 INCREMENTAL_CONTEXT_CHARS 时截断）"""
+        lines = []
+        budget = INCREMENTAL_CONTEXT_CHARS
+        for field in LIST_FIELDS:
+            items = [item for result in self.results if result is not None for item in result[field]]
+            if not items or budget <= 0:
+                continue
+            line = f"{field}：" + "；".join(items)
+            lines.append(line[:budget])
+            budget -= len(line)
+        return "\n".join(lines)
+
+    def prompt(self):
+        """
+        构造本次调用的提示词：待提取的片段逐个编号，其他片段只附带已提取的条目
+
+        返回:
+            提示词字符串
+        """
+        pending = self.pending
+        parts = []
+        if pending:
+            parts.append("请从以下用户输入的文本片段中提取年度总结报告的关键信息，每个片段单独提取。\n"
+                         "如果某个字段没有对应内容，请使用空字符串或空列表。\n")
+            for number, index in enumerate(pending, 1):
+                parts.append(f"【片段{number}】\n『{self.chunks[index]}』\n")
+        else:
+            parts.append("请根据以下从用户输入中提取的条目，生成年度总结报告的概述。\n")
+
+        context = self._context()
+        if context:
+            title = "其他片段中已提取的条目（仅用于撰写概述，不要重复输出）" if pending else "已提取的条目"
+            parts.append(f"{title}：\n{context}\n")
+        known = self._known_scalars()
+        if known:
+            parts.append("已知信息：" + "；".join(f"{k}={v}" for k, v in known.items()) + "\n")
+
+        overview_source = "全部片段和已提取的条目" if pending else "上述条目"
+        fields = [
+            f'  "{OVERVIEW_FIELD}": "根据{overview_source}，总结年度工作亮点、整体表现和主要成就，用一句话概括。"',
+            '  "姓名": "（请根据上下文推断或留空）"',
+            '  "报告日期": "（请根据上下文推断或填写当前日期，格式如：YYYY年MM月DD日）"',
+        ]
+        if pending:
+            entry = ",\n".join(
+                ['      "编号": 1']
+                + [f'      "{field}": ["条目1", "..."]' for field in LIST_FIELDS]
+                + ['      "姓名": "（片段中出现的姓名，没有则留空）"',
+                   '      "报告日期": "（片段中出现的日期，没有则留空）"']
+            )
+            fields.append(f'  "片段": [\n    {{\n{entry}\n    }}\n  ]')
+            parts.append(f'请严格按照以下JSON格式输出，确保字段名称不变，"片段"中按编号每个片段一项（共{len(pending)}项）：')
+        else:
+            parts.append("请严格按照以下JSON格式输出，确保字段名称不变：")
+        parts.append("{\n" + ",\n".join(fields) + "\n}\n")
+        return "\n" + "\n".join(parts)
+
+    def apply(self, reply):
+        """
+        记录模型回复：各片段结果写入缓存；回复中缺少的片段按空结果合并，不写入缓存
+
+        参数:
+            reply: 解析后的模型回复（字典）
+        """
+        reply = reply if isinstance(reply, dict) else {}
+        entries = reply.get("片段") if isinstance(reply.get("片段"), list) else []
+        by_number = {}
+        for position, entry in enumerate(entries, 1):
+            if isinstance(entry, dict):
+                number = entry.get("编号", position)
+                by_number[number if isinstance(number, int) else position] = entry
+
+        pending = self.pending
+        fresh = {}
+        missing = 0
+        for number, index in enumerate(pending, 1):
+            entry = by_number.get(number)
+            if entry is None:
+                missing += 1
+                self.results[index] = _empty_result()
+                continue
+            self.results[index] = fresh[self.keys[index]] = _chunk_result(entry)
+
+        self.overview = {
+            OVERVIEW_FIELD: str(reply.get(OVERVIEW_FIELD) or ""),
+            **{field: str(reply.get(field) or "").strip() for field in SCALAR_FIELDS},
+        }
+        if missing:
+            log_event(logger, logging.WARNING, "incremental_chunks_missing", missing=missing, requested=len(pending))
+        # 有片段缺失时概述不完整，不缓存
+        self._store.save(fresh, None if missing else (overview_key(self.keys), self.overview))
+
+    def merge(self):
+        """
+        按原文顺序合并各片段的结果
+
+        返回:
+            与完整提取相同结构的字典（年度总结概述、四个列表字段、姓名、报告日期）
+        """
+        merged = {OVERVIEW_FIELD: (self.overview or {}).get(OVERVIEW_FIELD, "")}
+        for field in LIST_FIELDS:
+            items = []
+            for result in self.results:
+                for item in (result or {}).get(field, []):
+                    if item not in items:
+                        items.append(item)
+            merged[field] = items
+        known = self._known_scalars()
+        for field in SCALAR_FIELDS:
+            merged[field] = known.get(field) or (self.overview or {}).get(field, "")
+        return merged
+
+
+class ChunkStore:
+    """
+    片段提取结果的缓存（SQLite）
+
+    表 chunks 每个缓存键一行：
+        result: 片段结果或概述（JSON）
+        used_at: 最近一次写入或命中的时间，超过 INCREMENTAL_TTL_SECONDS 未使用的行被删除
+    """
+
+    def __init__(self, path=None):
+        """
+        参数:
+            path: 缓存文件，默认 INCREMENTAL_DB，为空字符串时关闭
+        """
+        self.path = INCREMENTAL_DB if path is None else path
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connect(self):
+        """每个线程一个连接；自动提交，事务由 BEGIN IMMEDIATE 显式开始"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = connect_state_db(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS chunks (key TEXT PRIMARY KEY, result TEXT NOT NULL, used_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_used_at ON chunks (used_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _load(self, keys):
+        """读取已缓存的结果并刷新其使用时间；缓存不可用时返回空字典"""
+        try:
+            conn = self._connect()
+            found = {}
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, result FROM chunks WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update((key, json.loads(result)) for key, result in rows)
+            if found:
+                conn.executemany("UPDATE chunks SET used_at = ? WHERE key = ?",
+                                 [(time.time(), key) for key in found])
+            return found
+        except (sqlite3.Error, ValueError) as e:
+            log_event(logger, logging.WARNING, "incremental_store_failed", op="load", error=str(e))
+            return {}
+
+    def save(self, results, overview=None):
+        """
+        保存新提取的片段结果和概述，同时删除过期的行；缓存不可用时只记录日志
+
+        参数:
+            results: {缓存键: 片段结果}
+            overview: (缓存键, 概述) 或 None
+        """
+        rows = dict(results)
+        if overview is not None:
+            rows[overview[0]] = overview[1]
+        if not rows:
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM chunks WHERE used_at < ?", (now - INCREMENTAL_TTL_SECONDS,))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (key, result, used_at) VALUES (?, ?, ?)",
+                    [(key, json.dumps(value, ensure_ascii=False), now) for key, value in rows.items()],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            log_event(logger, logging.WARNING, "incremental_store_failed", op="save", error=str(e))
+
+    def plan(self, user_input, signature):
+        """
+        把输入切成片段并查找已缓存的结果
+
+        参数:
+            user_input: 用户输入
+            signature: 调用方式签名，见 singleflight.client_signature()
+
+        返回:
+            ExtractionPlan
+        """
+        chunks = split_chunks(user_input)
+        keys = [chunk_key(chunk, signature) for chunk in chunks]
+        summary_key = overview_key(keys)
+        cached = self._load(keys + [summary_key])
+        results = [cached.get(key) for key in keys]
+        hits = sum(result is not None for result in results)
+        INCREMENTAL_CHUNKS.labels(result="hit").inc(hits)
+        INCREMENTAL_CHUNKS.labels(result="miss").inc(len(chunks) - hits)
+        plan = ExtractionPlan(self, chunks, keys, results, cached.get(summary_key))
+        log_event(logger, logging.INFO, "incremental_plan", chunks=len(chunks), hits=hits,
+                  pending_chars=sum(len(chunks[i]) for i in plan.pending),
+                  total_chars=sum(len(chunk) for chunk in chunks), overview_cached=plan.overview is not None)
+        return plan
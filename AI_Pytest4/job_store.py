@@ -0,0 +1,388 @@
+"""
+持久化的生成任务
+
+生成状态原先只存在于请求的调用栈中，worker重启（崩溃、OOM、部署）时正在处理的总结连同已经消耗的token一起丢失。
+每个生成请求在读取输入后登记为一个任务，按阶段保存进度：
+1. created:   已保存输入（模板ID、用户输入）
+2. extracted: 已保存大模型的提取结果（同时清除任务表中的用户输入）
+3. rendered:  已保存生成的文档（流式发送时只保存文档ID，下载时按提取结果重新渲染），任务完成
+
+处理任务的进程持有租约并由后台线程定期续约（心跳）。进程退出后租约过期（同一主机上进程不存在时立即失效），
+其他worker或主机的恢复线程原子地认领该任务，从最后完成的阶段继续：例如已有提取结果时只重新渲染，不再调用大模型。
+完成的文档可通过 GET /jobs/<任务ID> 查询状态、GET /jobs/<任务ID>/document 下载；
+携带 Idempotency-Key 的重试也会接续同一任务。
+
+任务表保存在SQLite文件中（默认在本用户专属的状态目录，见 state_files），多主机部署时放在共享卷上（需要支持文件锁）。
+设置 JOB_DB 为空字符串时任务只保存在内存中。
+
+作者：AI助手
+日期：2025年
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from log_config import get_logger, log_event
+from singleflight import owner_exited, process_owner
+from state_files import connect_state_db, state_path
+
+
+# ==================== 配置 ====================
+JOB_DB = os.getenv("JOB_DB", state_path("summary_jobs.db"))  # 任务表文件，多主机部署时放在共享卷上，为空时不持久化
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))                       # 租约时长（秒），心跳间隔为其1/3
+JOB_RECOVERY_INTERVAL = float(os.getenv("JOB_RECOVERY_INTERVAL", "15"))               # 检查过期任务的间隔（秒），0表示本进程不恢复任务
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))                            # 同一任务最多被认领的次数
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "86400"))            # 已结束任务的保留时间（秒）
+
+# 阶段
+STAGE_CREATED = "created"
+STAGE_EXTRACTED = "extracted"
+STAGE_RENDERED = "rendered"
+
+# 状态
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+logger = get_logger(__name__)
+
+
+class JobBusy(Exception):
+    """同一幂等键的任务正由其他进程处理"""
+
+    def __init__(self, job_id):
+        super().__init__(f"任务 {job_id} 正在其他进程中处理")
+        self.job_id = job_id
+
+
+class Job:
+    """
+    一个生成任务
+
+    属性:
+        job_id: 任务ID（未持久化时为None）
+        template_id / user_input: 输入（任务表中的user_input在extracted阶段之后为空）
+        idempotency_key: 提交时的幂等键（可为None）
+        idempotency_token: 本进程中处理该任务的请求登记幂等键时得到的令牌（不保存；恢复线程中为None）
+        stage: 最后完成的阶段
+        status: running | done | failed
+        extracted: 大模型提取结果（extracted阶段之后）
+        document_id / document: 文档缓存键和文档字节（rendered阶段之后；流式发送的文档字节为None）
+        attempts: 被认领的次数
+        error: 失败原因
+    """
+
+    _COLUMNS = ("id", "template_id", "user_input", "idempotency_key", "stage", "status", "extracted",
+                "document_id", "document", "attempts", "error", "created_at", "updated_at")
+
+    def __init__(self, job_id, template_id, user_input, idempotency_key=None, stage=STAGE_CREATED,
+                 status=STATUS_RUNNING, extracted=None, document_id=None, document=None, attempts=1,
+                 error=None, created_at=None, updated_at=None):
+        self.job_id = job_id
+        self.template_id = template_id
+        self.user_input = user_input
+        self.idempotency_key = idempotency_key
+        self.idempotency_token = None
+        self.stage = stage
+        self.status = status
+        self.extracted = extracted
+        self.document_id = document_id
+        self.document = document
+        self.attempts = attempts
+        self.error = error
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+
+    @classmethod
+    def from_row(cls, row):
+        values = dict(zip(cls._COLUMNS, row))
+        values["job_id"] = values.pop("id")
+        if values["extracted"] is not None:
+            values["extracted"] = json.loads(values["extracted"])
+        return cls(**values)
+
+    def to_dict(self):
+        """GET /jobs/<任务ID> 返回的状态（不含输入和文档内容）"""
+        return {
+            "id": self.job_id,
+            "status": self.status,
+            "stage": self.stage,
+            "template_id": self.template_id,
+            "attempts": self.attempts,
+            "error": self.error,
+            "document_url": f"/jobs/{self.job_id}/document" if self.status == STATUS_DONE else None,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobStore:
+    """
+    任务表（SQLite）及本进程持有任务的租约
+
+    属性:
+        owner: 本进程的标识 "主机名:进程号"
+    """
+
+    def __init__(self, path=None):
+        """
+        参数:
+            path: 任务表文件，默认 JOB_DB，为空字符串时不持久化
+        """
+        self.path = JOB_DB if path is None else path
+        self.owner = process_owner()
+        self._held = set()  # 本进程正在处理的任务ID，由心跳线程续约
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._heartbeat = None
+        self._recovery = None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connect(self):
+        """每个线程一个连接；自动提交，事务由 BEGIN IMMEDIATE 显式开始"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = connect_state_db(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, template_id TEXT NOT NULL, user_input TEXT NOT NULL, idempotency_key TEXT,"
+                " stage TEXT NOT NULL, status TEXT NOT NULL, extracted TEXT, document_id TEXT, document BLOB,"
+                " attempts INTEGER NOT NULL, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL,"
+                " owner TEXT, lease_expires_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_lease ON jobs (status, lease_expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_idempotency_key ON jobs (idempotency_key)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _lease_expired(self, owner, lease_expires_at, now):
+        return lease_expires_at is None or lease_expires_at < now or owner_exited(owner)
+
+    # ==================== 登记与认领 ====================
+    def start(self, template_id, user_input, idempotency_key=None):
+        """
+        登记新任务并由本进程认领；同一幂等键已有未完成且租约过期的任务时接续该任务
+
+        返回:
+            Job（接续的任务保留已完成阶段的结果）
+
+        抛出:
+            JobBusy: 同一幂等键的任务仍由其他进程持有
+        """
+        if not self.enabled:
+            return Job(None, template_id, user_input, idempotency_key)
+
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if idempotency_key is not None:
+                row = conn.execute(
+                    f"SELECT {', '.join(Job._COLUMNS)}, owner, lease_expires_at FROM jobs"
+                    " WHERE idempotency_key = ? AND status != ? ORDER BY created_at DESC LIMIT 1",
+                    (idempotency_key, STATUS_FAILED),
+                ).fetchone()
+                if row is not None:
+                    job = Job.from_row(row[:-2])
+                    if job.status == STATUS_RUNNING and not self._lease_expired(row[-2], row[-1], now):
+                        conn.execute("COMMIT")
+                        raise JobBusy(job.job_id)
+                    if job.status == STATUS_RUNNING:
+                        self._take(conn, job, now)
+                        conn.execute("COMMIT")
+                        self._hold(job.job_id)
+                        log_event(logger, logging.INFO, "job_resumed", job=job.job_id,
+                                  stage=job.stage, attempts=job.attempts)
+                        return job
+                    conn.execute("COMMIT")
+                    return job  # 已完成
+
+            job = Job(uuid.uuid4().hex, template_id, user_input, idempotency_key, created_at=now)
+            conn.execute(
+                "INSERT INTO jobs (id, template_id, user_input, idempotency_key, stage, status, attempts,"
+                " created_at, updated_at, owner, lease_expires_at) VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?)",
+                (job.job_id, template_id, user_input, idempotency_key, STAGE_CREATED, STATUS_RUNNING,
+                 now, now, self.owner, now + JOB_LEASE_SECONDS),
+            )
+            conn.execute("COMMIT")
+        except JobBusy:
+            raise
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._hold(job.job_id)
+        return job
+
+    def _take(self, conn, job, now):
+        """在事务中把任务转给本进程（认领次数加1）"""
+        job.attempts += 1
+        job.updated_at = now
+        conn.execute(
+            "UPDATE jobs SET owner = ?, lease_expires_at = ?, attempts = ?, updated_at = ? WHERE id = ?",
+            (self.owner, now + JOB_LEASE_SECONDS, job.attempts, now, job.job_id),
+        )
+
+    def claim_expired(self):
+        """
+        认领一个租约已过期的任务（恢复线程使用）；超过 JOB_MAX_ATTEMPTS 的任务标记为失败
+
+        返回:
+            Job，没有可认领的任务时返回None
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT {', '.join(Job._COLUMNS)}, owner, lease_expires_at FROM jobs"
+                " WHERE status = ? ORDER BY updated_at",
+                (STATUS_RUNNING,),
+            ).fetchall()
+            for row in rows:
+                if not self._lease_expired(row[-2], row[-1], now):
+                    continue
+                job = Job.from_row(row[:-2])
+                if job.attempts >= JOB_MAX_ATTEMPTS:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, updated_at = ?, owner = NULL WHERE id = ?",
+                        (STATUS_FAILED, "处理任务的进程多次退出，已放弃", now, job.job_id),
+                    )
+                    log_event(logger, logging.WARNING, "job_abandoned", job=job.job_id, attempts=job.attempts)
+                    continue
+                self._take(conn, job, now)
+                conn.execute("COMMIT")
+                self._hold(job.job_id)
+                return job
+            conn.execute(
+                "DELETE FROM jobs WHERE status != ? AND updated_at < ?", (STATUS_RUNNING, now - JOB_RETENTION_SECONDS)
+            )
+            conn.execute("COMMIT")
+            return None
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, job_id):
+        """按ID查询任务，不存在时返回None"""
+        if not self.enabled:
+            return None
+        row = self._connect().execute(
+            f"SELECT {', '.join(Job._COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return Job.from_row(row) if row else None
+
+    # ==================== 阶段检查点 ====================
+    def _update(self, job, sql, params):
+        """
+        只更新本进程仍持有的任务；租约已被其他进程接管时记录警告
+
+        检查点写入失败（例如数据库被长时间锁定）只记录警告，不影响当前请求
+        """
+        job.updated_at = time.time()
+        if not self.enabled:
+            return
+        try:
+            cursor = self._connect().execute(
+                f"UPDATE jobs SET {sql}, updated_at = ? WHERE id = ? AND owner = ?",
+                (*params, job.updated_at, job.job_id, self.owner),
+            )
+        except sqlite3.Error as e:
+            log_event(logger, logging.WARNING, "job_checkpoint_failed", job=job.job_id, stage=job.stage, error=str(e))
+            return
+        if cursor.rowcount == 0:
+            log_event(logger, logging.WARNING, "job_lease_lost", job=job.job_id, stage=job.stage)
+
+    def save_extracted(self, job, extracted):
+        """保存大模型提取结果；之后的阶段不再需要输入，任务表中的用户输入原文随之清除"""
+        job.stage, job.extracted = STAGE_EXTRACTED, extracted
+        self._update(job, "stage = ?, extracted = ?, user_input = ''",
+                     (job.stage, json.dumps(extracted, ensure_ascii=False)))
+
+    def save_document(self, job, document_id, document):
+        """保存生成的文档，任务完成并释放租约"""
+        job.stage, job.status, job.document_id, job.document = STAGE_RENDERED, STATUS_DONE, document_id, document
+        self._update(job, "stage = ?, status = ?, document_id = ?, document = ?, owner = NULL, lease_expires_at = NULL",
+                     (job.stage, job.status, document_id, document))
+        self._unhold(job.job_id)
+
+    def fail(self, job, error):
+        """任务失败（不再恢复）并释放租约"""
+        job.status, job.error = STATUS_FAILED, error
+        self._update(job, "status = ?, error = ?, owner = NULL, lease_expires_at = NULL", (job.status, error))
+        self._unhold(job.job_id)
+
+    # ==================== 心跳与恢复 ====================
+    def _hold(self, job_id):
+        with self._lock:
+            self._held.add(job_id)
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+                self._heartbeat.start()
+
+    def _unhold(self, job_id):
+        with self._lock:
+            self._held.discard(job_id)
+
+    def _heartbeat_loop(self):
+        """定期延长本进程持有任务的租约"""
+        while True:
+            time.sleep(JOB_LEASE_SECONDS / 3)
+            with self._lock:
+                held = list(self._held)
+            if not held:
+                continue
+            try:
+                self._connect().execute(
+                    f"UPDATE jobs SET lease_expires_at = ? WHERE owner = ? AND id IN ({', '.join('?' * len(held))})",
+                    (time.time() + JOB_LEASE_SECONDS, self.owner, *held),
+                )
+            except sqlite3.Error as e:
+                log_event(logger, logging.WARNING, "job_heartbeat_failed", error=str(e))
+
+    def start_recovery(self, process):
+        """
+        启动恢复线程：定期认领租约过期的任务并交给process继续处理（每个进程只启动一次）
+
+        参数:
+            process: 接收Job的函数，从任务最后完成的阶段继续执行
+        """
+        if not self.enabled or JOB_RECOVERY_INTERVAL <= 0:
+            return
+        with self._lock:
+            if self._recovery is not None:
+                return
+            self._recovery = threading.Thread(
+                target=self._recovery_loop, args=(process,), name="job-recovery", daemon=True
+            )
+            self._recovery.start()
+
+    def _recovery_loop(self, process):
+        while True:
+            time.sleep(JOB_RECOVERY_INTERVAL)
+            try:
+                while True:
+                    job = self.claim_expired()
+                    if job is None:
+                        break
+                    log_event(logger, logging.WARNING, "job_recovering", job=job.job_id,
+                              stage=job.stage, attempts=job.attempts)
+                    self._recover(job, process)
+            except sqlite3.Error as e:
+                log_event(logger, logging.WARNING, "job_recovery_failed", error=str(e))
+
+    def _recover(self, job, process):
+        try:
+            process(job)
+        except Exception as e:
+            log_event(logger, logging.ERROR, "job_recovery_error", job=job.job_id, error=str(e))
+            self.fail(job, str(e))
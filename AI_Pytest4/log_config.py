@@ -0,0 +1,183 @@
+"""
+结构化日志配置
+
+替代热点路径上的print调用，主要特点：
+1. 分级输出：通过 LOG_LEVEL 控制，DEBUG级别的逐帧日志默认完全不执行
+2. 延迟格式化：日志记录以 事件名 + 字段 的形式放入队列，
+   由后台线程统一格式化和写出，请求线程不做字符串拼接和I/O
+3. 非阻塞：请求线程只向无界队列放入记录，不会因stdout/stderr加锁而互相等待
+4. 脱敏：用户输入和AI输出默认只记录长度和摘要哈希，不落原文
+5. 采样：WebSocket逐帧调试日志按 LOG_FRAME_SAMPLE_RATE 采样
+
+使用方法：
+    from log_config import get_logger, log_event, redact
+
+    logger = get_logger(__name__)
+    log_event(logger, logging.INFO, "upstream_done", chars=len(text), preview=redact(text))
+
+作者：AI助手
+日期：2025年
+"""
+
+import atexit
+import datetime
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+
+# 日志配置（均可通过环境变量覆盖）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()                       # 日志级别
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()                     # 输出格式：text 或 json
+LOG_UNREDACTED = os.getenv("LOG_UNREDACTED", "0") == "1"                 # 仅本地调试时设为1，记录原文
+LOG_FRAME_SAMPLE_RATE = int(os.getenv("LOG_FRAME_SAMPLE_RATE", "50"))    # 每N帧记录一次逐帧日志，0表示不记录
+
+# 所有项目日志记录器的公共前缀
+LOGGER_PREFIX = "summary"
+
+_listener = None
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    不在调用线程格式化的队列处理器
+
+    标准QueueHandler会在放入队列前调用format()合并参数，
+    这里直接放入原始记录，格式化推迟到后台监听线程。
+    前提是日志参数都是不可变对象（字符串、数字、元组），项目内的调用都满足这一点。
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    结构化日志格式化器
+
+    text格式：2025-01-01T08:00:00.123 INFO summary.app upstream_done chars=120 stage=upstream
+    json格式：{"ts": "...", "level": "INFO", "logger": "summary.app", "event": "upstream_done", "chars": 120}
+    """
+
+    def __init__(self, fmt_type="text"):
+        super().__init__()
+        self.fmt_type = fmt_type
+
+    def format(self, record):
+        timestamp = datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds')
+        fields = getattr(record, 'fields', None) or {}
+        message = record.getMessage()
+
+        if self.fmt_type == "json":
+            data = {"ts": timestamp, "level": record.levelname, "logger": record.name, "event": message}
+            data.update(fields)
+            if record.exc_info:
+                data["exc"] = self.formatException(record.exc_info)
+            return json.dumps(data, ensure_ascii=False, default=str)
+
+        parts = [timestamp, record.levelname, record.name, message]
+        parts.extend(f"{key}={value}" for key, value in fields.items())
+        line = " ".join(str(part) for part in parts)
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def setup_logging(level=None, stream=None):
+    """
+    初始化项目日志：队列处理器 + 后台监听线程
+
+    重复调用是安全的，只有第一次生效
+
+    参数:
+        level: 日志级别，默认读取 LOG_LEVEL
+        stream: 输出流，默认标准错误
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output_handler = logging.StreamHandler(stream or sys.stderr)
+    output_handler.setFormatter(StructuredFormatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, output_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    project_logger = logging.getLogger(LOGGER_PREFIX)
+    project_logger.setLevel(level or LOG_LEVEL)
+    project_logger.addHandler(_DeferredQueueHandler(log_queue))
+    project_logger.propagate = False
+
+
+def shutdown_logging():
+    """停止后台监听线程，写出队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(module_name):
+    """
+    获取项目内模块的日志记录器
+
+    参数:
+        module_name: 模块名，通常传入 __name__
+
+    返回:
+        名为 summary.<模块名> 的Logger
+    """
+    return logging.getLogger(f"{LOGGER_PREFIX}.{module_name}")
+
+
+def log_event(logger, level, event, **fields):
+    """
+    记录一条结构化事件
+
+    级别未开启时直接返回，不构造任何字段
+
+    参数:
+        logger: 日志记录器
+        level: 日志级别
+        event: 事件名（简短的英文标识）
+        fields: 附加字段，值应为不可变对象
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+
+def redact(text):
+    """
+    对用户输入/AI输出做脱敏，只保留长度和摘要哈希
+
+    相同内容得到相同摘要，排查问题时仍可关联同一份输入
+
+    参数:
+        text: 原文
+
+    返回:
+        形如 <redacted chars=120 sha=1a2b3c4d> 的字符串；LOG_UNREDACTED=1 时返回原文
+    """
+    if text is None:
+        return None
+    if LOG_UNREDACTED:
+        return text
+    digest = hashlib.sha256(str(text).encode('utf-8')).hexdigest()[:8]
+    return f"<redacted chars={len(text)} sha={digest}>"
+
+
+def frame_sampled(frame_index):
+    """
+    判断第frame_index帧（从1开始）是否需要记录逐帧日志
+
+    第1帧总是记录，之后每 LOG_FRAME_SAMPLE_RATE 帧记录一次
+    """
+    if LOG_FRAME_SAMPLE_RATE <= 0:
+        return False
+    return frame_index == 1 or frame_index % LOG_FRAME_SAMPLE_RATE == 0
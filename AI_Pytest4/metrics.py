@@ -0,0 +1,211 @@
+"""
+Prometheus监控指标
+
+统一定义应用的所有监控指标，并提供 /metrics 接口的输出函数：
+1. 各处理阶段的耗时直方图（输入解析、调用大模型、JSON解析、模板填充、文档保存）
+2. 大模型token用量、上游错误（按错误码）、超时取消、文档缓存命中情况的计数器
+3. 正在处理的请求数、正在调用大模型的请求数和排队等待的请求数（排队耗时见 queue_wait 阶段）
+4. 单飞合并中各角色的请求数（等待共享结果的耗时见 upstream_shared 阶段）
+5. 幂等键请求的处理结果（首次处理、重放、处理中、内容冲突）
+
+多进程部署（gunicorn多worker）时，设置环境变量 PROMETHEUS_MULTIPROC_DIR 指向一个
+所有worker共享的空目录，各进程把指标写入该目录下的mmap文件，/metrics 汇总所有进程的数据。
+配套的 gunicorn.conf.py 会在启动时清空该目录，并在worker退出时清理其指标。
+
+作者：AI助手
+日期：2025年
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+)
+from prometheus_client import multiprocess
+
+from tracing import record_span
+
+
+# 处理阶段名称，与 generate_summary 中的步骤对应
+STAGE_PARSE_INPUT = "parse_input"
+STAGE_UPSTREAM = "upstream"
+STAGE_JSON_PARSE = "json_parse"
+STAGE_TEMPLATE_FILL = "template_fill"
+STAGE_DOC_SAVE = "doc_save"
+STAGE_QUEUE_WAIT = "queue_wait"  # 准入控制中排队等待调用大模型
+STAGE_RATE_LIMIT_WAIT = "rate_limit_wait"  # 等待账号调用配额（跨进程限流）
+
+# 调用大模型阶段的细分：建立连接、首个token等待、流式接收
+STAGE_UPSTREAM_HANDSHAKE = "upstream_handshake"
+STAGE_UPSTREAM_TTFT = "upstream_ttft"
+STAGE_UPSTREAM_STREAM = "upstream_stream"
+
+# 相同输入的并发请求等待其他请求调用大模型的耗时（单飞合并）
+STAGE_UPSTREAM_SHARED = "upstream_shared"
+
+# 耗时直方图的分桶（秒）：从毫秒级的模板处理到分钟级的大模型调用
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "summary_stage_seconds",
+    "年度总结生成各阶段耗时（秒）",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+
+REQUESTS_TOTAL = Counter(
+    "summary_requests_total",
+    "年度总结生成请求数（按HTTP状态码）",
+    ["status"],
+)
+
+INFLIGHT_REQUESTS = Gauge(
+    "summary_inflight_requests",
+    "正在处理的年度总结生成请求数",
+    multiprocess_mode="livesum",
+)
+
+UPSTREAM_INFLIGHT = Gauge(
+    "summary_upstream_inflight",
+    "正在调用星火大模型的请求数（已通过准入控制）",
+    multiprocess_mode="livesum",
+)
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "summary_admission_queue_depth",
+    "排队等待调用星火大模型的请求数",
+    multiprocess_mode="livesum",
+)
+
+ADMISSION_REJECTED = Counter(
+    "summary_admission_rejected_total",
+    "准入控制或调用配额限流拒绝（返回429）的请求数（按原因）",
+    ["reason"],
+)
+
+RATE_LIMIT_STORE_FALLBACKS = Counter(
+    "summary_rate_limit_store_fallbacks_total",
+    "限流状态文件不可用、该次调用退回本进程内限流的次数",
+)
+
+SINGLEFLIGHT_REQUESTS = Counter(
+    "summary_singleflight_requests_total",
+    "调用大模型的请求按单飞合并中的角色计数：leader自己调用，follower共享本进程的结果，"
+    "remote共享其他进程的结果",
+    ["role"],
+)
+
+IDEMPOTENCY_REQUESTS = Counter(
+    "summary_idempotency_requests_total",
+    "携带Idempotency-Key的生成请求数：new首次处理，replayed返回已保存的结果，"
+    "in_progress同一键仍在处理（409），mismatch同一键内容不同（422）",
+    ["result"],
+)
+
+INCREMENTAL_CHUNKS = Counter(
+    "summary_incremental_chunks_total",
+    "增量提取的输入片段数：hit使用缓存的提取结果，miss需要调用大模型",
+    ["result"],
+)
+
+SPARK_TOKENS = Counter(
+    "spark_tokens_total",
+    "星火大模型token用量",
+    ["protocol", "kind"],
+)
+
+SPARK_UPSTREAM_ERRORS = Counter(
+    "spark_upstream_errors_total",
+    "星火大模型调用失败次数（按错误码）",
+    ["protocol", "code"],
+)
+
+DEADLINE_EXCEEDED = Counter(
+    "summary_deadline_exceeded_total",
+    "因超过期限或客户端断开而取消的生成请求数（按阶段和原因）",
+    ["stage", "reason"],
+)
+
+RENDER_CACHE_LOOKUPS = Counter(
+    "render_cache_lookups_total",
+    "文档缓存查找次数",
+    ["result"],
+)
+
+
+def observe_stage(stage, seconds, start=None):
+    """
+    记录一个处理阶段的耗时
+
+    同时写入聚合指标和当前请求的追踪记录（Server-Timing）
+
+    参数:
+        stage: 阶段名
+        seconds: 耗时（秒）
+        start: 阶段开始时的perf_counter值，用于追踪记录中的时间偏移
+    """
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    record_span(stage, seconds, start)
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    统计代码块耗时的上下文管理器
+
+    使用方法：
+        with stage_timer(STAGE_DOC_SAVE):
+            doc.save(byte_io)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, start)
+
+
+def record_token_usage(protocol, usage):
+    """
+    记录一次调用的token用量
+
+    参数:
+        protocol: http 或 websocket
+        usage: 上游返回的usage字典（prompt_tokens/completion_tokens/total_tokens）
+    """
+    for kind in ("prompt", "completion", "total"):
+        count = usage.get(f"{kind}_tokens") or 0
+        if count:
+            SPARK_TOKENS.labels(protocol=protocol, kind=kind).inc(count)
+
+
+def record_upstream_error(protocol, code):
+    """记录一次上游错误"""
+    SPARK_UPSTREAM_ERRORS.labels(protocol=protocol, code=str(code)).inc()
+
+
+def record_deadline_exceeded(stage, reason):
+    """记录一次因超过期限或客户端断开而取消的请求"""
+    DEADLINE_EXCEEDED.labels(stage=stage or "unknown", reason=reason).inc()
+
+
+def record_cache_lookup(hit):
+    """记录一次文档缓存查找"""
+    RENDER_CACHE_LOOKUPS.labels(result="hit" if hit else "miss").inc()
+
+
+def render_metrics():
+    """
+    生成 /metrics 接口的响应内容
+
+    返回:
+        (响应体, Content-Type)
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # 多进程模式：汇总共享目录中所有worker的指标
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
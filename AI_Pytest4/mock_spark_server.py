@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+本地星火大模型模拟服务
+
+在本地模拟科大讯飞星火大模型的两种接口，用于离线压测和故障演练，不消耗真实配额：
+1. X1 HTTP接口：POST .../chat/completions，支持流式（SSE）和非流式
+2. v3.5 WebSocket接口：header.code / payload.choices.status 帧协议
+
+可配置的行为：
+- 生成速度（token/秒）和首个token等待时间
+- 按比例注入错误码
+- 并发超限时的限流错误（模拟秒级流控）
+- 按比例在流式输出中途断开连接
+
+只依赖Python标准库，WebSocket协议（握手和帧编解码）在本文件中实现。
+
+使用方法：
+    python mock_spark_server.py --port 8765 --token-rate 80 --ttft 0.8
+
+然后让应用指向本地服务：
+    # HTTP协议
+    API_PROTOCOL=HTTP SPARK_HTTP_API_PASSWORD=mock SPARK_HTTP_BASE_URL=http://127.0.0.1:8765/v2
+    # WebSocket协议
+    API_PROTOCOL=WEBSOCKET SPARK_WS_SCHEME=ws SPARK_HOST=127.0.0.1:8765 \\
+        SPARK_APPID=mock SPARK_APIKEY=mock SPARK_APISECRET=mock
+
+GET /stats 返回服务端统计（请求数、并发数、注入的错误数等）。
+
+作者：AI助手
+日期：2025年
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# WebSocket握手使用的固定GUID（RFC 6455）
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# WebSocket帧操作码
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+# 星火接口的限流错误码（秒级流控超限）
+THROTTLE_CODE = 11202
+
+# 星火接口的app_id错误码（app_id缺失或与应用的APPID不匹配）
+APPID_MISMATCH_CODE = 10313
+
+# 两次推送之间的最小间隔（秒），token速率很高时把多个token合并到一帧
+MIN_FRAME_INTERVAL = 0.02
+
+
+class MockConfig:
+    """
+    模拟服务的行为配置
+
+    app_id: WebSocket请求的 header.app_id 必须等于该值（对应应用的 SPARK_APPID），为None时接受任意非空值
+    """
+
+    def __init__(self, token_rate=50.0, ttft=0.5, chars_per_token=2, reply_items=5,
+                 error_rate=0.0, error_code=10013, error_http_status=200,
+                 max_concurrent=0, disconnect_rate=0.0, seed=None, app_id=None):
+        self.token_rate = token_rate
+        self.ttft = ttft
+        self.chars_per_token = chars_per_token
+        self.reply_items = reply_items
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.error_http_status = error_http_status
+        self.max_concurrent = max_concurrent
+        self.disconnect_rate = disconnect_rate
+        self.random = random.Random(seed)
+        self.app_id = app_id
+
+
+class MockStats:
+    """服务端统计，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            "requests": 0, "inflight": 0, "max_inflight": 0, "completed": 0,
+            "errors_injected": 0, "throttled": 0, "disconnected": 0,
+        }
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def enter(self, max_concurrent):
+        """
+        登记一个新请求
+
+        返回:
+            False表示超过并发上限，需要返回限流错误
+        """
+        with self._lock:
+            self.counters["requests"] += 1
+            if max_concurrent and self.counters["inflight"] >= max_concurrent:
+                self.counters["throttled"] += 1
+                return False
+            self.counters["inflight"] += 1
+            self.counters["max_inflight"] = max(self.counters["max_inflight"], self.counters["inflight"])
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.counters["inflight"] -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+# ==================== 模拟回复 ====================
+def build_reply(items, prompt_text=""):
+    """
+    构造与应用提示词要求一致的JSON回复（带markdown代码块，与真实模型的常见输出一致）
+
+    增量提取的提示词（含【片段n】）按片段逐项回复，每个片段每个列表一个条目
+    """
+    segments = re.findall(r"【片段(\d+)】", prompt_text)
+    if segments or "已提取的条目" in prompt_text:
+        content = {
+            "年度总结概述": "本年度围绕核心系统建设稳步推进，按期完成各项重点任务。",
+            "姓名": "测试用户",
+            "报告日期": time.strftime("%Y年%m月%d日"),
+        }
+        if segments:
+            content["片段"] = [{
+                "编号": int(number),
+                "主要成就与贡献": [f"片段{number}：完成重点工作，取得预期成果"],
+                "遇到的挑战及解决方案": [f"片段{number}：通过团队协作和技术攻关解决"],
+                "个人成长与学习": [f"片段{number}：学习并实践了新技能"],
+                "未来展望与计划": [f"片段{number}：持续提升交付质量"],
+                "姓名": "",
+                "报告日期": "",
+            } for number in segments]
+        return "```json\n" + json.dumps(content, ensure_ascii=False, indent=2) + "\n```"
+
+    content = {
+        "年度总结概述": "本年度围绕核心系统建设稳步推进，按期完成各项重点任务。",
+        "主要成就与贡献": [f"完成第{i + 1}项重点工作，取得预期成果" for i in range(items)],
+        "遇到的挑战及解决方案": [f"挑战{i + 1}：通过团队协作和技术攻关解决" for i in range(items)],
+        "个人成长与学习": [f"学习并实践了第{i + 1}项新技能" for i in range(items)],
+        "未来展望与计划": [f"明年计划{i + 1}：持续提升交付质量" for i in range(items)],
+        "姓名": "测试用户",
+        "报告日期": time.strftime("%Y年%m月%d日"),
+    }
+    return "```json\n" + json.dumps(content, ensure_ascii=False, indent=2) + "\n```"
+
+
+def split_tokens(text, chars_per_token):
+    """把回复切成“token”（按固定字符数近似）"""
+    return [text[i:i + chars_per_token] for i in range(0, len(text), chars_per_token)]
+
+
+def iter_chunks(config, tokens):
+    """
+    按配置的速率产出内容片段
+
+    先等待首个token时间，之后按token速率推送；速率很高时把多个token合并为一个片段
+    """
+    time.sleep(config.ttft)
+    if config.token_rate <= 0:
+        yield "".join(tokens)
+        return
+    per_chunk = max(1, int(config.token_rate * MIN_FRAME_INTERVAL))
+    interval = per_chunk / config.token_rate
+    for start in range(0, len(tokens), per_chunk):
+        if start:
+            time.sleep(interval)
+        yield "".join(tokens[start:start + per_chunk])
+
+
+def usage_for(prompt_text, tokens):
+    """估算token用量"""
+    prompt_tokens = max(1, len(prompt_text) // 2)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(tokens),
+        "total_tokens": prompt_tokens + len(tokens),
+    }
+
+
+# ==================== WebSocket帧编解码 ====================
+def ws_accept_key(key):
+    """计算握手响应中的 Sec-WebSocket-Accept"""
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode('ascii')).digest()).decode('ascii')
+
+
+def ws_encode_frame(payload, opcode=OP_TEXT):
+    """编码一个服务端帧（服务端发出的帧不加掩码）"""
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack("!H", length)
+    else:
+        header += bytes([127]) + struct.pack("!Q", length)
+    return header + payload
+
+
+def ws_read_frame(stream):
+    """
+    读取一个客户端帧
+
+    返回:
+        (操作码, 负载字节)；连接关闭时返回 (None, b'')
+    """
+    head = stream.read(2)
+    if len(head) < 2:
+        return None, b''
+    opcode = head[0] & 0x0F
+    masked = head[1] & 0x80
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", stream.read(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", stream.read(8))[0]
+    mask = stream.read(4) if masked else b''
+    payload = stream.read(length)
+    if masked:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+# ==================== 请求处理 ====================
+class MockSparkHandler(BaseHTTPRequestHandler):
+    """同时处理HTTP接口、WebSocket升级和统计查询"""
+
+    protocol_version = "HTTP/1.1"
+    config = None
+    stats = None
+
+    def log_message(self, format, *args):
+        # 压测时每个请求一行访问日志会成为瓶颈，默认关闭
+        pass
+
+    # ---------- 公共 ----------
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _should(self, rate):
+        return rate > 0 and self.config.random.random() < rate
+
+    # ---------- GET：统计 / WebSocket ----------
+    def do_GET(self):
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+            self._handle_websocket()
+        elif self.path.startswith("/stats"):
+            self._send_json(200, self.stats.snapshot())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_HEAD(self):
+        # 预热连接时可能发送HEAD请求
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    # ---------- HTTP：/chat/completions ----------
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request_data = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"code": 10003, "message": "请求体不是合法JSON"})
+            return
+
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._send_json(401, {"code": 11200, "message": "授权错误：缺少APIpassword"})
+            return
+
+        if not self.stats.enter(self.config.max_concurrent):
+            self._send_json(429, {"code": THROTTLE_CODE, "message": "授权错误：秒级流控超限"})
+            return
+        try:
+            self._handle_completion(request_data)
+        finally:
+            self.stats.leave()
+
+    def _handle_completion(self, request_data):
+        config = self.config
+        sid = f"mock{uuid.uuid4().hex[:12]}"
+        prompt_text = "".join(m.get("content", "") for m in request_data.get("messages", []))
+        tokens = split_tokens(build_reply(config.reply_items, prompt_text), config.chars_per_token)
+
+        if self._should(config.error_rate):
+            self.stats.incr("errors_injected")
+            time.sleep(config.ttft)
+            self._send_json(config.error_http_status, {
+                "code": config.error_code, "message": "模拟错误", "sid": sid,
+            })
+            return
+
+        if not request_data.get("stream"):
+            # 非流式：生成完毕后一次性返回
+            content = "".join(iter_chunks(config, tokens))
+            self._send_json(200, {
+                "code": 0, "message": "Success", "sid": sid,
+                "choices": [{"message": {"role": "assistant", "content": content}, "index": 0}],
+                "usage": usage_for(prompt_text, tokens),
+            })
+            self.stats.incr("completed")
+            return
+
+        # 流式：Server-Sent Events，分块传输
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(data):
+            payload = f"data: {data}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(payload):X}\r\n".encode('ascii') + payload + b"\r\n")
+            self.wfile.flush()
+
+        disconnect_at = self._disconnect_point(tokens)
+        for index, chunk in enumerate(iter_chunks(config, tokens)):
+            if disconnect_at is not None and index >= disconnect_at:
+                self._abort_connection()
+                return
+            send_event(json.dumps({
+                "code": 0, "message": "Success", "sid": sid,
+                "choices": [{"delta": {"role": "assistant", "content": chunk}, "index": 0}],
+            }, ensure_ascii=False))
+        send_event(json.dumps({
+            "code": 0, "message": "Success", "sid": sid,
+            "choices": [{"delta": {"role": "assistant", "content": ""}, "index": 0, "finish_reason": "stop"}],
+            "usage": usage_for(prompt_text, tokens),
+        }, ensure_ascii=False))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.stats.incr("completed")
+
+    def _disconnect_point(self, tokens):
+        """按配置决定是否中途断开，返回在第几个片段断开（不断开返回None）"""
+        if not self._should(self.config.disconnect_rate):
+            return None
+        self.stats.incr("disconnected")
+        return self.config.random.randint(0, max(0, len(tokens) // 4))
+
+    def _abort_connection(self):
+        """不发送结束标记直接断开TCP连接"""
+        self.close_connection = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # ---------- WebSocket：v3.5 帧协议 ----------
+    def _handle_websocket(self):
+        key = self.headers.get("Sec-WebSocket-Key")
+        if not key:
+            self._send_json(400, {"error": "missing Sec-WebSocket-Key"})
+            return
+
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", ws_accept_key(key))
+        self.end_headers()
+        self.close_connection = True
+
+        # 读取客户端发来的请求消息
+        while True:
+            opcode, payload = ws_read_frame(self.rfile)
+            if opcode is None or opcode == OP_CLOSE:
+                return
+            if opcode == OP_PING:
+                self.wfile.write(ws_encode_frame(payload, OP_PONG))
+                continue
+            if opcode == OP_TEXT:
+                break
+
+        def send(data):
+            self.wfile.write(ws_encode_frame(json.dumps(data, ensure_ascii=False).encode('utf-8')))
+            self.wfile.flush()
+
+        def close():
+            self.wfile.write(ws_encode_frame(struct.pack("!H", 1000), OP_CLOSE))
+            self.wfile.flush()
+
+        sid = f"cht{uuid.uuid4().hex[:12]}"
+        try:
+            request_data = json.loads(payload)
+            app_id = request_data["header"]["app_id"]
+            texts = request_data["payload"]["message"]["text"]
+        except (ValueError, KeyError, TypeError):
+            send({"header": {"code": 10003, "message": "请求格式错误", "sid": sid, "status": 2}})
+            close()
+            return
+
+        if not app_id or (self.config.app_id is not None and app_id != self.config.app_id):
+            send({"header": {"code": APPID_MISMATCH_CODE, "message": "app_id与APPID不匹配", "sid": sid, "status": 2}})
+            close()
+            return
+
+        if not self.stats.enter(self.config.max_concurrent):
+            send({"header": {"code": THROTTLE_CODE, "message": "授权错误：秒级流控超限", "sid": sid, "status": 2}})
+            close()
+            return
+
+        try:
+            config = self.config
+            if self._should(config.error_rate):
+                self.stats.incr("errors_injected")
+                time.sleep(config.ttft)
+                send({"header": {"code": config.error_code, "message": "模拟错误", "sid": sid, "status": 2}})
+                close()
+                return
+
+            prompt_text = "".join(t.get("content", "") for t in texts)
+            tokens = split_tokens(build_reply(config.reply_items, prompt_text), config.chars_per_token)
+            chunks = list(iter_chunks(config, tokens)) if config.token_rate <= 0 else None
+            disconnect_at = self._disconnect_point(tokens)
+
+            seq = 0
+            for chunk in chunks or iter_chunks(config, tokens):
+                if disconnect_at is not None and seq >= disconnect_at:
+                    self._abort_connection()
+                    return
+                status = 0 if seq == 0 else 1
+                send({
+                    "header": {"code": 0, "message": "Success", "sid": sid, "status": status},
+                    "payload": {"choices": {"status": status, "seq": seq, "text": [
+                        {"content": chunk, "role": "assistant", "index": 0}
+                    ]}},
+                })
+                seq += 1
+
+            send({
+                "header": {"code": 0, "message": "Success", "sid": sid, "status": 2},
+                "payload": {
+                    "choices": {"status": 2, "seq": seq, "text": [{"content": "", "role": "assistant", "index": 0}]},
+                    "usage": {"text": dict(usage_for(prompt_text, tokens), question_tokens=0)},
+                },
+            })
+            close()
+            self.stats.incr("completed")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（例如请求被取消）
+            pass
+        finally:
+            self.stats.leave()
+
+
+class MockSparkServer(ThreadingHTTPServer):
+    """每个连接一个线程的模拟服务，支持数百个并发连接"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def create_server(host="127.0.0.1", port=8765, config=None):
+    """
+    创建模拟服务（不启动），可在测试或压测脚本中于后台线程运行
+
+    返回:
+        MockSparkServer实例，调用 serve_forever() 开始服务
+    """
+    handler = type("ConfiguredMockSparkHandler", (MockSparkHandler,), {
+        "config": config or MockConfig(),
+        "stats": MockStats(),
+    })
+    return MockSparkServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地星火大模型模拟服务（HTTP + WebSocket）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--token-rate", type=float, default=50.0, help="生成速度（token/秒），0表示一次性返回")
+    parser.add_argument("--ttft", type=float, default=0.5, help="首个token等待时间（秒）")
+    parser.add_argument("--chars-per-token", type=int, default=2, help="每个token对应的字符数")
+    parser.add_argument("--reply-items", type=int, default=5, help="回复中每个列表字段的条目数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的比例（0~1）")
+    parser.add_argument("--error-code", type=int, default=10013, help="注入的错误码")
+    parser.add_argument("--error-http-status", type=int, default=200, help="HTTP接口注入错误时的状态码")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="并发上限，超过时返回限流错误，0表示不限")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="流式输出中途断开的比例（0~1）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，便于复现")
+    parser.add_argument("--app-id", default=None, help="WebSocket请求必须携带的app_id（应用的SPARK_APPID），默认接受任意非空值")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        token_rate=args.token_rate, ttft=args.ttft, chars_per_token=args.chars_per_token,
+        reply_items=args.reply_items, error_rate=args.error_rate, error_code=args.error_code,
+        error_http_status=args.error_http_status, max_concurrent=args.max_concurrent,
+        disconnect_rate=args.disconnect_rate, seed=args.seed, app_id=args.app_id,
+    )
+    server = create_server(args.host, args.port, config)
+    print(f"🧪 星火模拟服务已启动: http://{args.host}:{args.port}")
+    print(f"   HTTP:      POST http://{args.host}:{args.port}/v2/chat/completions")
+    print(f"   WebSocket: ws://{args.host}:{args.port}/v3.5/chat")
+    print(f"   统计:      GET  http://{args.host}:{args.port}/stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 模拟服务已停止")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+星火大模型调用的跨进程限流
+
+星火API的QPS配额按账号计算，而gunicorn的每个worker各自调用、互不知道对方的请求量，
+扩容worker后很容易超过配额被上游限流。所有进程的客户端（HTTP、WebSocket、异步HTTP）
+在发起调用前从同一个令牌桶取得调用时间：
+1. 令牌桶状态保存在共享的SQLite文件中（同一主机的所有进程，或放在共享卷上供多台主机共用）
+2. 采用预约方式（GCRA）：每个调用在事务中预约下一个可用的时间点，按到达先后排队，
+   各进程公平地分享配额，不会因为轮询抢令牌而饿死
+3. 预约的等待时间超过 RATE_LIMIT_MAX_WAIT 或请求期限的剩余时间时不排队，直接返回429
+
+等待期间请求被取消时，已预约的时间点不退还（宁可少用配额，不会超过配额）。
+多台主机共用时依赖主机时钟同步。
+
+作者：AI助手
+日期：2025年
+"""
+
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from admission import AdmissionRejected
+from log_config import get_logger, log_event
+from metrics import ADMISSION_REJECTED, RATE_LIMIT_STORE_FALLBACKS, STAGE_RATE_LIMIT_WAIT, observe_stage
+from state_files import connect_state_db, state_path
+
+
+# ==================== 配置 ====================
+SPARK_QPS = float(os.getenv("SPARK_QPS", "0"))                  # 账号每秒调用次数上限（所有进程合计），0表示不限制
+SPARK_BURST = float(os.getenv("SPARK_BURST", "0"))              # 允许的突发调用数，0表示与QPS相同（至少1）
+RATE_LIMIT_DB = os.getenv(
+    "RATE_LIMIT_DB", state_path("summary_ratelimit.db")
+)                                                               # 令牌桶状态文件，为空时只在本进程内限流
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "30"))  # 排队等待配额的最长时间（秒）
+RATE_LIMIT_BUCKET = "spark"
+
+# 拒绝原因（与准入控制的拒绝共用指标）
+REJECT_RATE_LIMITED = "rate_limited"
+
+logger = get_logger(__name__)
+
+
+class RateLimiter:
+    """
+    按预约时间排队的令牌桶
+
+    状态只有一个数：理论到达时间tat。调用在now到达时：
+        开始时间 = max(tat, now) - (burst - 1) * 间隔
+        新的tat  = max(tat, now) + 间隔
+    开始时间晚于now的调用等待到开始时间。
+    """
+
+    def __init__(self, qps=None, burst=None, path=None, bucket=RATE_LIMIT_BUCKET):
+        """
+        参数:
+            qps: 每秒调用次数上限，默认 SPARK_QPS，不大于0时不限流
+            burst: 突发调用数，默认 SPARK_BURST
+            path: 状态文件，默认 RATE_LIMIT_DB，为空字符串时只在本进程内限流
+            bucket: 令牌桶名称（同一文件可保存多个账号的令牌桶）
+        """
+        self.qps = SPARK_QPS if qps is None else qps
+        burst = SPARK_BURST if burst is None else burst
+        self.burst = max(1.0, burst or self.qps)
+        self.path = RATE_LIMIT_DB if path is None else path
+        self.bucket = bucket
+        self._tat = 0.0  # 只在本进程内限流时使用
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return self.qps > 0
+
+    def _connect(self):
+        """每个线程一个连接；自动提交，事务由 BEGIN IMMEDIATE 显式开始"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = connect_state_db(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tat REAL NOT NULL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _schedule(self, tat, now, max_wait):
+        """
+        计算本次调用的等待时间和新的tat
+
+        返回:
+            (等待秒数, 新的tat)；等待超过max_wait时新的tat为None（不预约）
+        """
+        interval = 1.0 / self.qps
+        tat = max(tat, now)
+        wait = max(0.0, tat - (self.burst - 1) * interval - now)
+        if wait > max_wait:
+            return wait, None
+        return wait, tat + interval
+
+    def reserve(self, max_wait):
+        """
+        预约一次调用
+
+        参数:
+            max_wait: 能接受的最长等待时间（秒）
+
+        返回:
+            (等待秒数, 是否预约成功)
+        """
+        if not self.path:
+            return self._reserve_local(max_wait)
+
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tat FROM buckets WHERE name = ?", (self.bucket,)).fetchone()
+            wait, tat = self._schedule(row[0] if row else 0.0, now, max_wait)
+            if tat is not None:
+                conn.execute("INSERT OR REPLACE INTO buckets (name, tat) VALUES (?, ?)", (self.bucket, tat))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait, tat is not None
+
+    def _reserve_local(self, max_wait):
+        """在本进程内预约（未配置状态文件，或状态文件暂时不可用时）"""
+        with self._lock:
+            wait, tat = self._schedule(self._tat, time.time(), max_wait)
+            if tat is not None:
+                self._tat = tat
+        return wait, tat is not None
+
+    def _max_wait(self, deadline):
+        if deadline is None:
+            return RATE_LIMIT_MAX_WAIT
+        return min(RATE_LIMIT_MAX_WAIT, deadline.time_left())
+
+    def _reserve_or_reject(self, deadline):
+        """
+        预约，等待过久时抛出 AdmissionRejected
+
+        状态文件暂时不可用（长时间锁定、磁盘错误等）时只有这一次调用退回本进程内限流，之后的调用仍使用共享的状态文件
+        """
+        max_wait = self._max_wait(deadline)
+        try:
+            wait, reserved = self.reserve(max_wait)
+        except sqlite3.Error as e:
+            RATE_LIMIT_STORE_FALLBACKS.inc()
+            log_event(logger, logging.WARNING, "rate_limit_store_failed", error=str(e), fallback="local")
+            wait, reserved = self._reserve_local(max_wait)
+        if not reserved:
+            ADMISSION_REJECTED.labels(reason=REJECT_RATE_LIMITED).inc()
+            retry_after = max(1, math.ceil(wait))
+            log_event(logger, logging.WARNING, "rate_limited", wait_ms=round(wait * 1000), retry_after=retry_after)
+            raise AdmissionRejected(REJECT_RATE_LIMITED, retry_after)
+        return wait
+
+    def acquire(self, deadline=None):
+        """
+        等待到预约的调用时间（线程中使用）
+
+        参数:
+            deadline: 当前请求的期限，等待期间被取消时立即停止等待
+
+        抛出:
+            AdmissionRejected, DeadlineExceeded
+        """
+        if not self.enabled:
+            return
+        wait = self._reserve_or_reject(deadline)
+        if wait <= 0:
+            return
+        started = time.perf_counter()
+        cancelled = threading.Event()
+        unregister = deadline.on_cancel(cancelled.set) if deadline is not None else None
+        try:
+            cancelled.wait(wait)
+        finally:
+            if unregister is not None:
+                unregister()
+        observe_stage(STAGE_RATE_LIMIT_WAIT, time.perf_counter() - started, started)
+        if deadline is not None:
+            deadline.check()
+
+    async def acquire_async(self, deadline=None):
+        """acquire() 的协程版本，等待时不占用线程"""
+        if not self.enabled:
+            return
+        wait = await asyncio.to_thread(self._reserve_or_reject, deadline)
+        if wait <= 0:
+            return
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        cancelled = asyncio.Event()
+        unregister = (
+            deadline.on_cancel(lambda: loop.call_soon_threadsafe(cancelled.set)) if deadline is not None else None
+        )
+        try:
+            await asyncio.wait_for(cancelled.wait(), wait)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if unregister is not None:
+                unregister()
+        observe_stage(STAGE_RATE_LIMIT_WAIT, time.perf_counter() - started, started)
+        if deadline is not None:
+            deadline.check()
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter():
+    """本进程所有客户端共用的限流器（按环境变量配置）"""
+    global _shared_limiter
+    if _shared_limiter is None:
+        with _shared_lock:
+            if _shared_limiter is None:
+                _shared_limiter = RateLimiter()
+    return _shared_limiter
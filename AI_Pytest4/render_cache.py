@@ -0,0 +1,255 @@
+"""
+已生成Word文档的磁盘缓存
+
+相同的模板 + 相同的AI提取结果一定渲染出相同的文档，
+因此可以按内容寻址把渲染结果保存在磁盘上：
+1. 缓存键 = sha256(渲染格式版本 + 模板文件哈希 + 规范化后的占位符取值)
+2. 文件以 <缓存键>.docx 命名，缓存键同时作为HTTP的ETag
+3. 总大小超过上限时按最近最少使用（LRU）顺序淘汰
+
+作者：AI助手
+日期：2025年
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+# 缓存键只允许64位十六进制字符，防止通过下载接口访问任意路径
+CACHE_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# 渲染格式版本：相同输入渲染出的文档结构变化时递增，使旧的缓存文件不再命中
+# 2: 列表字段展开为每个条目一段（document_renderer.render_list_paragraph）
+# 3: 列表条目中的制表符写为 <w:tab/>
+# 4: 占位符替换保留所在run的字符格式，独占一段的文本字段按原型段落写入（与预编译模板一致）
+RENDER_FORMAT_VERSION = 4
+
+# 模板文件哈希的记忆表：路径 -> (修改时间, 文件大小, 哈希)
+_file_hash_memo = {}
+_file_hash_lock = threading.Lock()
+
+
+def file_sha256(path):
+    """
+    计算文件的sha256哈希，文件未变化时直接返回上次的结果
+
+    参数:
+        path: 文件路径
+
+    返回:
+        十六进制哈希字符串
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    with _file_hash_lock:
+        memo = _file_hash_memo.get(path)
+        if memo and memo[0] == signature:
+            return memo[1]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    file_hash = digest.hexdigest()
+
+    with _file_hash_lock:
+        _file_hash_memo[path] = (signature, file_hash)
+    return file_hash
+
+
+def make_cache_key(template_hash, placeholder_values):
+    """
+    根据模板哈希和占位符取值计算缓存键
+
+    参数:
+        template_hash: 模板文件的sha256
+        placeholder_values: 占位符 -> 替换文本 的字典
+
+    返回:
+        64位十六进制缓存键
+    """
+    canonical = json.dumps(placeholder_values, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.sha256()
+    digest.update(f'v{RENDER_FORMAT_VERSION}'.encode('ascii'))
+    digest.update(b'\0')
+    digest.update(template_hash.encode('ascii'))
+    digest.update(b'\0')
+    digest.update(canonical.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    按内容寻址的.docx渲染结果缓存
+
+    - 文件写入采用“临时文件 + 原子重命名”，并发写同一个键也不会读到半个文件
+    - 命中时更新文件修改时间，重启后仍能按修改时间恢复LRU顺序
+    - 多个进程共享同一目录时，各自维护LRU视图，被别的进程删除的文件视为未命中
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        """
+        初始化缓存
+
+        参数:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节），小于等于0表示关闭缓存
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # 缓存键 -> 文件大小，越靠后越新
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_existing()
+
+    @property
+    def enabled(self):
+        """缓存是否启用"""
+        return self.max_bytes > 0
+
+    def _load_existing(self):
+        """扫描缓存目录，按修改时间从旧到新恢复LRU顺序"""
+        found = []
+        for name in os.listdir(self.cache_dir):
+            key, ext = os.path.splitext(name)
+            if ext != '.docx' or not CACHE_KEY_PATTERN.match(key):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            found.append((stat.st_mtime, key, stat.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict_locked()
+
+    def path_for(self, key):
+        """返回缓存键对应的文件路径"""
+        return os.path.join(self.cache_dir, f"{key}.docx")
+
+    def get(self, key):
+        """
+        查找缓存文件
+
+        参数:
+            key: 缓存键
+
+        返回:
+            命中时返回文件路径，未命中返回None
+        """
+        if not self.enabled or not CACHE_KEY_PATTERN.match(key):
+            return None
+
+        path = self.path_for(key)
+        with self._lock:
+            try:
+                # 更新修改时间，标记为最近使用
+                os.utime(path)
+                size = os.path.getsize(path)
+            except OSError:
+                self._forget_locked(key)
+                return None
+
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # 其他进程写入的文件，纳入本进程的LRU视图
+                self._entries[key] = size
+                self._total_bytes += size
+            return path
+
+    def put(self, key, data):
+        """
+        写入缓存文件并按需淘汰旧文件
+
+        参数:
+            key: 缓存键
+            data: .docx文件内容
+
+        返回:
+            缓存文件路径
+        """
+        tmp_file, tmp_path = self.create_temp()
+        try:
+            with tmp_file:
+                tmp_file.write(data)
+        except BaseException:
+            self.discard_temp(tmp_path)
+            raise
+        return self.put_file(key, tmp_path)
+
+    def create_temp(self):
+        """
+        在缓存目录中创建临时文件，写完后用 put_file() 登记为缓存
+
+        返回:
+            (以二进制写方式打开的文件对象, 临时文件路径)
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        return os.fdopen(fd, 'wb'), tmp_path
+
+    def discard_temp(self, tmp_path):
+        """删除未完成的临时文件"""
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    def put_file(self, key, tmp_path):
+        """
+        把已写完并关闭的临时文件原子地重命名为缓存文件，并按需淘汰旧文件
+
+        参数:
+            key: 缓存键
+            tmp_path: create_temp() 返回的临时文件路径
+
+        返回:
+            缓存文件路径
+        """
+        path = self.path_for(key)
+        try:
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self.discard_temp(tmp_path)
+            raise
+
+        with self._lock:
+            self._forget_locked(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            # 刚写入的文件不参与本次淘汰，保证调用方拿到的路径有效
+            self._evict_locked(keep=key)
+        return path
+
+    def _forget_locked(self, key):
+        """从LRU视图中移除一个键（调用方需持有锁）"""
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict_locked(self, keep=None):
+        """淘汰最久未使用的文件直到总大小不超过上限（调用方需持有锁）"""
+        while self._total_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            if key == keep:
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(key)
+                continue
+            self._forget_locked(key)
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
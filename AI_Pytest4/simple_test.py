@@ -69,7 +69,7 @@ def main():
         print(f"APIKey: {apikey[:8]}...")
         
         try:
-            from app import SparkWebSocketClient, SPARK_DOMAIN, SPARK_HOST, SPARK_API_PATH
+            from spark_ws_client import SparkWebSocketClient, SPARK_DOMAIN, SPARK_HOST, SPARK_API_PATH
             
             client = SparkWebSocketClient(
                 appid, apikey, apisecret,
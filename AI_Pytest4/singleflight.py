@@ -0,0 +1,463 @@
+"""
+单飞合并（single-flight）
+
+多个用户同时提交相同内容时（例如同一份会议记录被多人上传），只调用一次星火大模型，
+其余请求等待这次调用的结果：
+1. 合并键 = 调用方式（协议、地址、模型）+ 规范化后的输入内容（统一换行、去掉行尾空白）
+2. 同一进程内：第一个请求（leader）调用大模型，其余线程和协程（follower）等待其结果
+3. 同一主机的多个进程（gunicorn多worker）：通过共享的SQLite文件登记正在进行的调用，
+   其他进程的leader发现已有调用时轮询其结果，不再重复调用
+
+leader因自身原因失败（超时、客户端断开、准入被拒）时放弃这次调用，等待者重新竞争成为leader；
+大模型返回的错误由所有等待者共享。调用方进程退出或超过租约时间仍未完成时，登记被视为失效，可被接管。
+设置 SINGLEFLIGHT_DB 为空字符串时只在进程内合并。
+
+作者：AI助手
+日期：2025年
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from admission import AdmissionRejected
+from deadline import DEADLINE_UPSTREAM_SECONDS, DeadlineExceeded
+from log_config import get_logger, log_event
+from metrics import SINGLEFLIGHT_REQUESTS, STAGE_UPSTREAM_SHARED, observe_stage
+from state_files import connect_state_db, state_path
+
+
+# ==================== 配置 ====================
+SINGLEFLIGHT_DB = os.getenv(
+    "SINGLEFLIGHT_DB", state_path("summary_singleflight.db")
+)                                                                                       # 进程间共享的登记文件，为空时只在进程内合并
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.2"))      # 等待其他进程结果时的轮询间隔（秒）
+SINGLEFLIGHT_LEASE_SECONDS = float(os.getenv("SINGLEFLIGHT_LEASE_SECONDS", str(DEADLINE_UPSTREAM_SECONDS + 30)))  # 登记的最长有效时间
+SINGLEFLIGHT_RESULT_TTL = 60  # 已完成的登记保留时间（秒），供仍在轮询的进程读取结果
+
+# 请求角色（指标标签）
+ROLE_LEADER = "leader"
+ROLE_FOLLOWER = "follower"
+ROLE_REMOTE = "remote"
+
+# 只与leader自身请求有关的错误：其他请求不应共享，而应重新调用
+_LEADER_ONLY_ERRORS = (DeadlineExceeded, AdmissionRejected)
+
+logger = get_logger(__name__)
+
+
+class SharedFlightError(Exception):
+    """其他进程的同一调用失败（携带其错误信息）"""
+
+
+def process_owner():
+    """当前进程在共享登记中的标识 "主机名:进程号"（gunicorn各worker不同）"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def owner_exited(owner):
+    """登记方是同一主机上已经退出的进程（其他主机的进程无法判断，视为仍在运行）"""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def normalize_input(text):
+    """统一换行符并去掉行尾和首尾空白，只有这些差别的输入视为相同"""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def client_signature(client):
+    """客户端的调用方式标识，没有 signature() 方法时使用类名"""
+    signature = getattr(client, "signature", None)
+    return signature() if signature is not None else type(client).__name__
+
+
+def flight_key(user_input, signature):
+    """
+    计算合并键
+
+    参数:
+        user_input: 发送给大模型的用户输入
+        signature: 调用方式标识，见 client_signature()
+
+    返回:
+        十六进制SHA-256摘要
+    """
+    digest = hashlib.sha256()
+    digest.update(signature.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_input(user_input).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _Flight:
+    """进程内一次正在进行的调用"""
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        self.done = threading.Event()
+        self._futures = []  # 等待中的协程：(事件循环, Future)
+        self._lock = threading.Lock()
+
+    def finish(self):
+        """标记完成并唤醒所有等待者（可在任意线程调用）"""
+        with self._lock:
+            self.done.set()
+            futures, self._futures = self._futures, []
+        for loop, future in futures:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def future(self, loop):
+        """协程等待完成用的Future"""
+        future = loop.create_future()
+        with self._lock:
+            if self.done.is_set():
+                future.set_result(None)
+            else:
+                self._futures.append((loop, future))
+        return future
+
+    def outcome(self):
+        """返回结果或抛出leader的错误"""
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _FlightStore:
+    """
+    进程间共享的调用登记（SQLite）
+
+    表 flights 每次调用一行（同一合并键最多一行处于running）：
+        owner: 调用方 "主机名:进程号"
+        status: running | done | failed | abandoned
+        result / error: 调用结果或错误信息
+    等待者按行id轮询，之后相同输入的新调用另起一行，不会覆盖正在等待的结果。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.owner = process_owner()
+        self._local = threading.local()
+
+    def _connect(self):
+        """每个线程一个连接；自动提交，事务由 BEGIN IMMEDIATE 显式开始"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = connect_state_db(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS flights ("
+                " id INTEGER PRIMARY KEY, key TEXT NOT NULL, owner TEXT NOT NULL, status TEXT NOT NULL,"
+                " started_at REAL NOT NULL, finished_at REAL, result TEXT, error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS flights_key ON flights (key, status)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _stale(owner, started_at, now):
+        """登记方已退出或超过租约时间"""
+        return now - started_at > SINGLEFLIGHT_LEASE_SECONDS or owner_exited(owner)
+
+    def claim(self, key):
+        """
+        登记本进程开始调用
+
+        返回:
+            (是否登记成功, 行id)：成功时本进程是leader，否则行id为其他进程正在进行的调用
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM flights WHERE finished_at < ?", (now - SINGLEFLIGHT_RESULT_TTL,))
+            for flight_id, owner, started_at in conn.execute(
+                "SELECT id, owner, started_at FROM flights WHERE key = ? AND status = 'running'", (key,)
+            ).fetchall():
+                if not self._stale(owner, started_at, now):
+                    conn.execute("COMMIT")
+                    return False, flight_id
+                conn.execute("UPDATE flights SET status = 'abandoned', finished_at = ? WHERE id = ?", (now, flight_id))
+            flight_id = conn.execute(
+                "INSERT INTO flights (key, owner, status, started_at) VALUES (?, ?, 'running', ?)",
+                (key, self.owner, now),
+            ).lastrowid
+            conn.execute("COMMIT")
+            return True, flight_id
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def finish(self, flight_id, status, result=None, error=None):
+        """记录本进程调用的结果（status: done | failed | abandoned）"""
+        self._connect().execute(
+            "UPDATE flights SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?",
+            (status, time.time(), result, error, flight_id),
+        )
+
+    def poll(self, flight_id):
+        """
+        查看其他进程的调用
+
+        返回:
+            (状态, 结果, 错误)；调用已放弃或登记已失效时状态为None，调用方应重新登记
+        """
+        row = self._connect().execute(
+            "SELECT owner, status, started_at, result, error FROM flights WHERE id = ?", (flight_id,)
+        ).fetchone()
+        if row is None or row[1] == "abandoned":
+            return None, None, None
+        if row[1] == "running" and self._stale(row[0], row[2], time.time()):
+            return None, None, None
+        return row[1], row[3], row[4]
+
+
+class SingleFlight:
+    """
+    合并相同输入的并发调用
+
+    属性:
+        store: 进程间登记，未启用时为None
+    """
+
+    def __init__(self, db_path=None):
+        """
+        参数:
+            db_path: 进程间登记文件，默认 SINGLEFLIGHT_DB，为空字符串时只在进程内合并
+        """
+        path = SINGLEFLIGHT_DB if db_path is None else db_path
+        self.store = _FlightStore(path) if path else None
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """加入或发起进程内的调用，返回 (是否为leader, _Flight)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return False, flight
+            flight = self._flights[key] = _Flight()
+            return True, flight
+
+    def _leave(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish()
+
+    def do(self, key, func, deadline=None):
+        """
+        执行func，或等待正在进行的相同调用的结果（线程中使用）
+
+        参数:
+            key: 合并键，见 flight_key()
+            func: 实际调用大模型的函数（无参数），返回模型回复原文
+            deadline: 当前请求的期限，等待期间超时或被取消时停止等待
+
+        返回:
+            模型回复原文
+
+        抛出:
+            func抛出的异常、DeadlineExceeded、SharedFlightError
+        """
+        while True:
+            leader, flight = self._join(key)
+            if leader:
+                return self._lead(key, flight, func, deadline)
+            started = time.perf_counter()
+            while not flight.done.wait(self._wait_slice(deadline)):
+                if deadline is not None:
+                    deadline.check()
+            if not flight.abandoned:
+                return self._shared(flight, started, ROLE_FOLLOWER)
+            if deadline is not None:
+                deadline.check()
+
+    async def do_async(self, key, coro_func, deadline=None):
+        """do() 的协程版本，等待时不占用线程；coro_func 为返回协程的无参数函数"""
+        loop = asyncio.get_running_loop()
+        while True:
+            leader, flight = self._join(key)
+            if leader:
+                return await self._lead_async(key, flight, coro_func, deadline)
+            started = time.perf_counter()
+            future = flight.future(loop)
+            while not flight.done.is_set():
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), self._wait_slice(deadline))
+                except asyncio.TimeoutError:
+                    if deadline is not None:
+                        deadline.check()
+            if not flight.abandoned:
+                return self._shared(flight, started, ROLE_FOLLOWER)
+            if deadline is not None:
+                deadline.check()
+
+    @staticmethod
+    def _wait_slice(deadline):
+        """每次等待的时长：到期前定期醒来检查请求是否已被取消"""
+        if deadline is None:
+            return SINGLEFLIGHT_POLL_INTERVAL
+        return max(min(SINGLEFLIGHT_POLL_INTERVAL, deadline.time_left()), 0.001)
+
+    @staticmethod
+    def _shared(flight, started, role):
+        """记录等待耗时并返回共享的结果"""
+        SINGLEFLIGHT_REQUESTS.labels(role=role).inc()
+        observe_stage(STAGE_UPSTREAM_SHARED, time.perf_counter() - started, started)
+        return flight.outcome()
+
+    def _lead(self, key, flight, func, deadline):
+        """进程内的leader：登记后调用，或等待其他进程的结果"""
+        try:
+            while True:
+                claimed, flight_id = self._claim(key)
+                if claimed:
+                    flight.result = self._run(flight_id, func)
+                    return flight.result
+                started = time.perf_counter()
+                while True:
+                    status, result, error = self._poll(flight_id)
+                    if status != "running":
+                        break
+                    time.sleep(self._wait_slice(deadline))
+                    if deadline is not None:
+                        deadline.check()
+                if status is not None:
+                    flight.result, flight.error = self._remote_outcome(status, result, error)
+                    return self._shared(flight, started, ROLE_REMOTE)
+        except _LEADER_ONLY_ERRORS:
+            flight.abandoned = True
+            raise
+        except Exception as e:
+            flight.error = e
+            raise
+        except BaseException:
+            flight.abandoned = True  # KeyboardInterrupt、SystemExit等：等待者重新发起调用，不共享
+            raise
+        finally:
+            self._leave(key, flight)
+
+    async def _lead_async(self, key, flight, coro_func, deadline):
+        """_lead() 的协程版本，SQLite操作放到线程池"""
+        try:
+            while True:
+                claimed, flight_id = await asyncio.to_thread(self._claim, key)
+                if claimed:
+                    flight.result = await self._run_async(flight_id, coro_func)
+                    return flight.result
+                started = time.perf_counter()
+                while True:
+                    status, result, error = await asyncio.to_thread(self._poll, flight_id)
+                    if status != "running":
+                        break
+                    await asyncio.sleep(self._wait_slice(deadline))
+                    if deadline is not None:
+                        deadline.check()
+                if status is not None:
+                    flight.result, flight.error = self._remote_outcome(status, result, error)
+                    return self._shared(flight, started, ROLE_REMOTE)
+        except _LEADER_ONLY_ERRORS:
+            flight.abandoned = True
+            raise
+        except BaseException as e:
+            if isinstance(e, Exception):
+                flight.error = e
+            else:
+                flight.abandoned = True  # 协程被取消
+            raise
+        finally:
+            self._leave(key, flight)
+
+    @staticmethod
+    def _remote_outcome(status, result, error):
+        """其他进程的调用结果 -> (结果, 错误)"""
+        if status == "done":
+            return result, None
+        return None, SharedFlightError(error or "上游调用失败")
+
+    def _claim(self, key):
+        """
+        进程间登记；未启用或登记文件不可用时按本进程为leader处理
+
+        返回:
+            (是否为leader, 行id)
+        """
+        if self.store is None:
+            return True, None
+        try:
+            return self.store.claim(key)
+        except sqlite3.Error as e:
+            log_event(logger, logging.WARNING, "singleflight_store_failed", op="claim", error=str(e))
+            return True, None
+
+    def _poll(self, flight_id):
+        try:
+            return self.store.poll(flight_id)
+        except sqlite3.Error as e:
+            log_event(logger, logging.WARNING, "singleflight_store_failed", op="poll", error=str(e))
+            return None, None, None
+
+    def _record(self, flight_id, status, result=None, error=None):
+        if flight_id is None:
+            return
+        try:
+            self.store.finish(flight_id, status, result, error)
+        except sqlite3.Error as e:
+            log_event(logger, logging.WARNING, "singleflight_store_failed", op="finish", error=str(e))
+
+    def _run(self, flight_id, func):
+        """作为leader调用，并把结果登记供其他进程读取"""
+        SINGLEFLIGHT_REQUESTS.labels(role=ROLE_LEADER).inc()
+        try:
+            result = func()
+        except _LEADER_ONLY_ERRORS:
+            self._record(flight_id, "abandoned")
+            raise
+        except Exception as e:
+            self._record(flight_id, "failed", error=str(e))
+            raise
+        except BaseException:
+            self._record(flight_id, "abandoned")
+            raise
+        self._record(flight_id, "done", result=result)
+        return result
+
+    async def _run_async(self, flight_id, coro_func):
+        SINGLEFLIGHT_REQUESTS.labels(role=ROLE_LEADER).inc()
+        try:
+            result = await coro_func()
+        except _LEADER_ONLY_ERRORS:
+            await asyncio.to_thread(self._record, flight_id, "abandoned")
+            raise
+        except asyncio.CancelledError:
+            self._record(flight_id, "abandoned")
+            raise
+        except Exception as e:
+            await asyncio.to_thread(self._record, flight_id, "failed", None, str(e))
+            raise
+        await asyncio.to_thread(self._record, flight_id, "done", result)
+        return result
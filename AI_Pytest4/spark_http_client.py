@@ -9,11 +9,93 @@
 日期：2025年
 """
 
+import asyncio
 import os
 import json
+import logging
+import socket
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from typing import Dict, Any, Optional
 
+try:
+    import httpx  # 可选依赖，仅ASGI部署的异步客户端使用
+except ImportError:
+    httpx = None
+
+from deadline import STAGE_UPSTREAM, current_deadline, deadline_stage
+from log_config import get_logger, log_event
+from metrics import (
+    STAGE_UPSTREAM_STREAM, STAGE_UPSTREAM_TTFT, observe_stage, record_token_usage, record_upstream_error
+)
+from rate_limiter import shared_rate_limiter
+
+logger = get_logger(__name__)
+
+# 连接池中每个主机保留的最大连接数，多线程部署时应不小于每个进程的线程数
+SPARK_HTTP_POOL_SIZE = int(os.getenv("SPARK_HTTP_POOL_SIZE", "32"))
+# 建立连接的超时（秒）；等待回复的超时为请求期限中upstream阶段的剩余时间
+SPARK_HTTP_CONNECT_TIMEOUT = float(os.getenv("SPARK_HTTP_CONNECT_TIMEOUT", "10"))
+
+class _CancellableConnectionMixin:
+    """
+    等待回复期间请求被取消（超时或客户端断开）时关闭socket
+
+    非流式接口在生成完毕前不返回任何数据，requests没有办法中途放弃等待；
+    关闭socket后阻塞的读取立即出错返回，不再为已取消的请求占用线程
+    """
+
+    def getresponse(self, *args, **kwargs):
+        deadline = current_deadline()
+        if deadline is None:
+            return super().getresponse(*args, **kwargs)
+        unregister = deadline.on_cancel(self._abort)
+        try:
+            return super().getresponse(*args, **kwargs)
+        finally:
+            unregister()
+
+    def _abort(self):
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # 连接已关闭
+
+
+class _CancellableHTTPConnection(_CancellableConnectionMixin, HTTPConnection):
+    pass
+
+
+class _CancellableHTTPSConnection(_CancellableConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _CancellableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CancellableHTTPConnection
+
+
+class _CancellableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CancellableHTTPSConnection
+
+
+class CancellableHTTPAdapter(HTTPAdapter):
+    """连接池中的连接在请求被取消时关闭，见 _CancellableConnectionMixin"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CancellableHTTPConnectionPool,
+            "https": _CancellableHTTPSConnectionPool,
+        }
+
+
 class SparkHTTPClient:
     """
     科大讯飞星火大模型HTTP客户端类
@@ -24,7 +106,7 @@ class SparkHTTPClient:
     - 错误处理
     """
     
-    def __init__(self, api_password: str, base_url: str = None, model: str = "x1"):
+    def __init__(self, api_password: str, base_url: str = None, model: str = "x1", rate_limiter=None):
         """
         初始化HTTP客户端
         
@@ -32,31 +114,130 @@ class SparkHTTPClient:
             api_password: HTTP协议的APIpassword
             base_url: API基础URL
             model: 模型名称
+            rate_limiter: 调用配额限流器，默认所有进程共用的 shared_rate_limiter()
         """
         self.api_password = api_password
         self.base_url = base_url or "https://spark-api-open.xf-yun.com/v2"
         self.model = model
         self.endpoint = "/chat/completions"
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
         
         # 检查必要参数
         if not self.api_password:
             raise ValueError("API password is required for HTTP protocol")
+
+        # 复用连接：同一主机的后续请求不再重复DNS解析和TLS握手；请求被取消时关闭正在等待的连接
+        self._session = requests.Session()
+        adapter = CancellableHTTPAdapter(pool_connections=1, pool_maxsize=SPARK_HTTP_POOL_SIZE)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
     
-    def send_request(self, user_input_text: str) -> str:
+    def send_request(self, user_input_text: str, prompt: str = None) -> str:
         """
         发送请求到星火大模型并获取响应
         
         参数:
             user_input_text: 用户输入的原始文本
+            prompt: 完整的提示词（例如增量提取，见 incremental.py），默认按用户输入构造
             
         返回:
             AI生成的JSON格式响应内容
         """
-        print(f"📝 用户输入长度: {len(user_input_text)} 字符")
+        url, headers, payload = self._build_request(user_input_text, prompt)
         
+        with deadline_stage(STAGE_UPSTREAM) as deadline:
+            # 等待账号的调用配额（所有进程共用）
+            self.rate_limiter.acquire(deadline)
+            try:
+                # 发送HTTP请求，等待回复的时间不超过本阶段剩余的期限
+                # （非流式接口在生成完毕前不返回任何数据，读超时即等待回复的总时长）
+                time_left = deadline.time_left()
+                request_started_at = time.perf_counter()
+                response = self._session.post(
+                    url, 
+                    headers=headers, 
+                    json=payload,
+                    timeout=(min(SPARK_HTTP_CONNECT_TIMEOUT, time_left), time_left)
+                )
+                
+                log_event(logger, logging.DEBUG, "http_response", status=response.status_code)
+
+                # 非流式响应：收到响应头之前模型已生成完毕，响应头耗时即首个token等待，
+                # 其余时间为读取响应体
+                self._observe_timing(request_started_at, response.elapsed.total_seconds())
+                
+                return self._extract_content(response.status_code, response.content)
+                
+            except requests.exceptions.Timeout:
+                record_upstream_error("http", "timeout")
+                deadline.check()  # 期限已到时抛出 DeadlineExceeded
+                raise Exception("请求超时，请检查网络连接或稍后重试")
+            except requests.exceptions.ConnectionError:
+                record_upstream_error("http", "connection")
+                deadline.check()  # 被取消时连接已由 _CancellableConnectionMixin 关闭
+                raise Exception("网络连接错误，请检查网络连接")
+            except requests.exceptions.RequestException as e:
+                record_upstream_error("http", "request")
+                raise Exception(f"HTTP请求异常: {str(e)}")
+            except json.JSONDecodeError as e:
+                raise Exception(f"响应JSON解析失败: {str(e)}")
+            except Exception as e:
+                if "API请求失败" in str(e) or "HTTP请求失败" in str(e):
+                    raise  # 重新抛出已知错误
+                else:
+                    raise Exception(f"未知错误: {str(e)}")
+
+    def warmup(self, connections: int = 1) -> int:
+        """
+        预热：解析API主机的DNS，并预先建立若干个连接放入连接池
+
+        发送的是HEAD请求，不消耗模型配额；任何HTTP状态码都说明连接已建立
+
+        参数:
+            connections: 预先建立的连接数，为0时只解析DNS
+
+        返回:
+            成功建立的连接数
+        """
+        host = urlsplit(self.base_url).hostname
+        socket.getaddrinfo(host, None)
+
+        def open_connection(_):
+            try:
+                self._session.head(self.base_url, timeout=10)
+                return True
+            except requests.exceptions.RequestException as e:
+                log_event(logger, logging.WARNING, "http_warmup_failed", host=host, error=str(e))
+                return False
+
+        connections = min(connections, SPARK_HTTP_POOL_SIZE)
+        if connections <= 0:
+            return 0
+        # 并发发送，连接池才会建立多个连接（串行发送只会反复复用同一个连接）
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            opened = sum(pool.map(open_connection, range(connections)))
+        log_event(logger, logging.INFO, "http_warmup", host=host, connections=opened)
+        return opened
+
+    def signature(self) -> str:
+        """
+        标识调用方式的字符串（协议、地址、模型），相同输入和相同签名的调用结果可以共享
+        """
+        return f"http|{self.base_url}{self.endpoint}|{self.model}"
+
+    def _build_request(self, user_input_text: str, prompt: str = None):
+        """
+        构造请求URL、请求头和请求体
+
+        参数:
+            user_input_text: 用户输入的原始文本
+            prompt: 完整的提示词，为None时按用户输入构造
+
+        返回:
+            (url, headers, payload)
+        """
         # 构造请求URL
         url = f"{self.base_url}{self.endpoint}"
-        print(f"🔗 请求URL: {url}")
         
         # 构造请求头
         headers = {
@@ -65,7 +246,8 @@ class SparkHTTPClient:
         }
         
         # 构造提示词
-        prompt = self._create_spark_prompt(user_input_text)
+        if prompt is None:
+            prompt = self._create_spark_prompt(user_input_text)
         
         # 构造请求体
         payload = {
@@ -95,74 +277,69 @@ class SparkHTTPClient:
             "max_tokens": 4096
         }
         
-        print(f"📋 请求体构造完成")
+        log_event(logger, logging.INFO, "http_request", url=url, model=self.model,
+                  input_chars=len(user_input_text), prompt_chars=len(prompt))
+        return url, headers, payload
+
+    @staticmethod
+    def _observe_timing(request_started_at: float, first_byte_seconds: float):
+        """记录首个token等待时间和读取响应体的耗时"""
+        observe_stage(STAGE_UPSTREAM_TTFT, first_byte_seconds, request_started_at)
+        observe_stage(STAGE_UPSTREAM_STREAM,
+                      max(time.perf_counter() - request_started_at - first_byte_seconds, 0.0),
+                      request_started_at + first_byte_seconds)
+
+    def _extract_content(self, status_code: int, body: bytes) -> str:
+        """
+        检查响应状态并提取模型回复
+
+        参数:
+            status_code: HTTP状态码
+            body: 响应体字节
+
+        返回:
+            模型回复内容
+        """
+        # 检查HTTP状态码
+        if status_code != 200:
+            record_upstream_error("http", f"http_{status_code}")
+            error_msg = f"HTTP请求失败，状态码: {status_code}"
+            try:
+                error_detail = json.loads(body)
+                error_msg += f", 错误详情: {error_detail}"
+            except:
+                error_msg += f", 响应内容: {body.decode('utf-8', errors='replace')}"
+            raise Exception(error_msg)
+        
+        # 解析响应
+        response_data = json.loads(body)
         
-        try:
-            # 发送HTTP请求
-            print("🚀 发送HTTP请求...")
-            response = requests.post(
-                url, 
-                headers=headers, 
-                json=payload,
-                timeout=60  # 60秒超时
-            )
-            
-            print(f"📡 收到响应，状态码: {response.status_code}")
-            
-            # 检查HTTP状态码
-            if response.status_code != 200:
-                error_msg = f"HTTP请求失败，状态码: {response.status_code}"
-                try:
-                    error_detail = response.json()
-                    error_msg += f", 错误详情: {error_detail}"
-                except:
-                    error_msg += f", 响应内容: {response.text}"
-                raise Exception(error_msg)
-            
-            # 解析响应
-            response_data = response.json()
-            print(f"✅ 响应解析成功")
-            
-            # 检查API错误码
-            if response_data.get('code', 0) != 0:
-                error_code = response_data.get('code', '未知')
-                error_msg = response_data.get('message', '未知错误')
-                raise Exception(f"API请求失败，错误码: {error_code}, 错误信息: {error_msg}")
-            
-            # 提取响应内容
-            if 'choices' not in response_data or not response_data['choices']:
-                raise Exception("响应中缺少choices字段或为空")
-            
-            choice = response_data['choices'][0]
-            if 'message' not in choice or 'content' not in choice['message']:
-                raise Exception("响应格式错误，缺少message.content字段")
-            
-            content = choice['message']['content']
-            print(f"📄 成功获取AI响应，长度: {len(content)} 字符")
-            
-            # 打印token使用情况
-            if 'usage' in response_data:
-                usage = response_data['usage']
-                print(f"📊 Token使用情况:")
-                print(f"   输入: {usage.get('prompt_tokens', 0)} tokens")
-                print(f"   输出: {usage.get('completion_tokens', 0)} tokens")
-                print(f"   总计: {usage.get('total_tokens', 0)} tokens")
-            
-            return content
-            
-        except requests.exceptions.Timeout:
-            raise Exception("请求超时，请检查网络连接或稍后重试")
-        except requests.exceptions.ConnectionError:
-            raise Exception("网络连接错误，请检查网络连接")
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"HTTP请求异常: {str(e)}")
-        except json.JSONDecodeError as e:
-            raise Exception(f"响应JSON解析失败: {str(e)}")
-        except Exception as e:
-            if "API请求失败" in str(e) or "HTTP请求失败" in str(e):
-                raise  # 重新抛出已知错误
-            else:
-                raise Exception(f"未知错误: {str(e)}")
+        # 检查API错误码
+        if response_data.get('code', 0) != 0:
+            error_code = response_data.get('code', '未知')
+            error_msg = response_data.get('message', '未知错误')
+            record_upstream_error("http", error_code)
+            raise Exception(f"API请求失败，错误码: {error_code}, 错误信息: {error_msg}")
+        
+        # 提取响应内容
+        if 'choices' not in response_data or not response_data['choices']:
+            raise Exception("响应中缺少choices字段或为空")
+        
+        choice = response_data['choices'][0]
+        if 'message' not in choice or 'content' not in choice['message']:
+            raise Exception("响应格式错误，缺少message.content字段")
+        
+        content = choice['message']['content']
+
+        # 记录token使用情况
+        usage = response_data.get('usage') or {}
+        record_token_usage("http", usage)
+        log_event(logger, logging.INFO, "http_completed", chars=len(content),
+                  prompt_tokens=usage.get('prompt_tokens', 0),
+                  completion_tokens=usage.get('completion_tokens', 0),
+                  total_tokens=usage.get('total_tokens', 0))
+        
+        return content
     
     def _create_spark_prompt(self, user_input_text: str) -> str:
         """
@@ -211,6 +388,118 @@ class SparkHTTPClient:
         return prompt
 
 
+class AsyncSparkHTTPClient(SparkHTTPClient):
+    """
+    基于httpx的异步HTTP客户端
+
+    请求构造和响应解析与 SparkHTTPClient 完全一致，只是等待大模型生成时不占用线程，
+    单个ASGI进程可以同时保持数百个调用。所有请求共用一个连接池。
+    """
+
+    def __init__(self, api_password: str, base_url: str = None, model: str = "x1",
+                 max_connections: int = 500, rate_limiter=None):
+        """
+        参数:
+            api_password: HTTP协议的APIpassword
+            base_url: API基础URL
+            model: 模型名称
+            max_connections: 连接池的最大连接数
+            rate_limiter: 调用配额限流器，默认所有进程共用的 shared_rate_limiter()
+        """
+        if httpx is None:
+            raise ImportError("异步客户端需要安装httpx: pip install httpx")
+        super().__init__(api_password, base_url, model, rate_limiter)
+        self._client = httpx.AsyncClient(
+            # 只限制建立连接的时间，等待回复的时间由请求期限控制
+            timeout=httpx.Timeout(None, connect=SPARK_HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=100),
+        )
+
+    async def send_request_async(self, user_input_text: str, prompt: str = None) -> str:
+        """
+        异步发送请求到星火大模型并获取响应
+
+        参数:
+            user_input_text: 用户输入的原始文本
+            prompt: 完整的提示词，默认按用户输入构造
+
+        返回:
+            AI生成的JSON格式响应内容
+        """
+        url, headers, payload = self._build_request(user_input_text, prompt)
+
+        with deadline_stage(STAGE_UPSTREAM) as deadline:
+            await self.rate_limiter.acquire_async(deadline)
+            loop = asyncio.get_running_loop()
+            request_started_at = time.perf_counter()
+            exchange = asyncio.ensure_future(self._exchange(url, headers, payload, request_started_at))
+            # 超时或客户端断开时取消正在等待的请求，httpx随之关闭连接（回调在监视线程中执行）
+            unregister = deadline.on_cancel(lambda: loop.call_soon_threadsafe(exchange.cancel))
+            try:
+                status_code, body, first_byte_seconds = await exchange
+
+                log_event(logger, logging.DEBUG, "http_response", status=status_code)
+                self._observe_timing(request_started_at, first_byte_seconds)
+
+                return self._extract_content(status_code, body)
+
+            except asyncio.CancelledError:
+                if not deadline.cancelled:
+                    raise  # 整个请求被取消（例如服务器关闭）
+                record_upstream_error("http", deadline.reason)
+                deadline.check()
+                raise
+            except httpx.TimeoutException:
+                record_upstream_error("http", "timeout")
+                raise Exception("请求超时，请检查网络连接或稍后重试")
+            except httpx.TransportError:
+                record_upstream_error("http", "connection")
+                raise Exception("网络连接错误，请检查网络连接")
+            except httpx.HTTPError as e:
+                record_upstream_error("http", "request")
+                raise Exception(f"HTTP请求异常: {str(e)}")
+            except json.JSONDecodeError as e:
+                raise Exception(f"响应JSON解析失败: {str(e)}")
+            except Exception as e:
+                if "API请求失败" in str(e) or "HTTP请求失败" in str(e):
+                    raise  # 重新抛出已知错误
+                else:
+                    raise Exception(f"未知错误: {str(e)}")
+            finally:
+                unregister()
+
+    async def _exchange(self, url, headers, payload, request_started_at):
+        """
+        发送请求并读取完整的响应
+
+        返回:
+            (HTTP状态码, 响应体字节, 首字节耗时秒数)
+        """
+        async with self._client.stream("POST", url, headers=headers, json=payload) as response:
+            first_byte_seconds = time.perf_counter() - request_started_at
+            body = await response.aread()
+        return response.status_code, body, first_byte_seconds
+
+    async def warmup_async(self, connections: int = 1) -> int:
+        """异步客户端的预热，见 SparkHTTPClient.warmup"""
+        async def open_connection():
+            try:
+                await self._client.head(self.base_url, timeout=10)
+                return True
+            except httpx.HTTPError as e:
+                log_event(logger, logging.WARNING, "http_warmup_failed", error=str(e))
+                return False
+
+        results = await asyncio.gather(*(open_connection() for _ in range(connections)))
+        opened = sum(results)
+        log_event(logger, logging.INFO, "http_warmup", connections=opened, client="async")
+        return opened
+
+    async def aclose(self):
+        """关闭连接池"""
+        await self._client.aclose()
+
+
 def create_spark_client():
     """
     根据环境变量配置创建合适的星火大模型客户端
@@ -241,10 +530,7 @@ def create_spark_client():
     
     else:
         # 使用WebSocket协议（原有实现）
-        from app import SparkWebSocketClient, APPID, APIKey, APISecret, SPARK_DOMAIN, SPARK_HOST, SPARK_API_PATH
+        from spark_ws_client import create_ws_client
         
         print(f"🔗 使用WebSocket协议连接星火大模型")
-        return SparkWebSocketClient(
-            APPID, APIKey, APISecret, 
-            SPARK_DOMAIN, SPARK_HOST, SPARK_API_PATH
-        )
+        return create_ws_client()
@@ -0,0 +1,575 @@
+"""
+科大讯飞星火大模型WebSocket客户端
+
+从 app.py 中独立出来，测试脚本和HTTP客户端的工厂函数可以直接导入，不必加载整个Web应用。
+websocket-client 只在使用WebSocket协议时才会被导入。
+
+作者：AI助手
+日期：2025年
+"""
+
+import base64            # Base64编码，用于API认证
+import datetime          # 日期时间处理
+import hashlib           # 哈希算法，用于API签名
+import hmac              # HMAC签名算法
+import json              # JSON数据处理
+import logging           # 日志级别常量
+import os                # 操作系统接口，用于环境变量
+import socket            # 预热时解析DNS，按期限建立连接
+import ssl               # SSL安全连接
+import time              # 计时，用于阶段耗时统计
+from urllib.parse import urlencode  # URL编码工具
+
+import websocket         # WebSocket客户端，用于与星火大模型通信
+
+from deadline import STAGE_UPSTREAM, deadline_stage
+from log_config import frame_sampled, get_logger, log_event, redact
+from metrics import (
+    STAGE_UPSTREAM_HANDSHAKE, STAGE_UPSTREAM_STREAM, STAGE_UPSTREAM_TTFT,
+    observe_stage, record_token_usage, record_upstream_error
+)
+from rate_limiter import shared_rate_limiter
+
+logger = get_logger(__name__)
+
+# 星火大模型API的服务器配置（可选，有默认值）
+SPARK_HOST = os.getenv("SPARK_HOST", "spark-api.xf-yun.com")      # API主机地址
+SPARK_DOMAIN = os.getenv("SPARK_DOMAIN", "generalv3.5")           # 模型版本域名
+SPARK_API_PATH = os.getenv("SPARK_API_PATH", "/v3.5/chat")        # API路径
+SPARK_WS_SCHEME = os.getenv("SPARK_WS_SCHEME", "wss")             # 连接本地模拟服务时设为ws
+SPARK_URL = f"{SPARK_WS_SCHEME}://{SPARK_HOST}{SPARK_API_PATH}"   # 完整的WebSocket URL
+
+
+# ==================== 工具函数 ====================
+def generate_spark_auth_url(host, path, api_key, api_secret):
+    """
+    生成科大讯飞星火大模型的签名认证URL
+    
+    这个函数实现了讯飞API要求的签名认证流程：
+    1. 获取当前GMT时间
+    2. 构造待签名字符串
+    3. 使用HMAC-SHA256算法签名
+    4. Base64编码
+    5. 构造最终的认证URL
+    
+    参数:
+        host: API主机地址
+        path: API路径
+        api_key: API密钥
+        api_secret: API密钥
+    
+    返回:
+        完整的带认证参数的WebSocket URL
+    """
+    # 获取当前时间，必须是GMT格式（格林威治标准时间）
+    now = datetime.datetime.now(datetime.timezone.utc)
+    date = now.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+    # 构造待签名的字符串，格式固定
+    signature_origin = f"host: {host}\ndate: {date}\nGET {path} HTTP/1.1"
+
+    # 使用HMAC-SHA256算法对待签名字符串进行签名
+    signature_sha256 = hmac.new(
+        api_secret.encode('utf-8'),           # 密钥
+        signature_origin.encode('utf-8'),     # 待签名数据
+        hashlib.sha256                        # 签名算法
+    ).digest()
+    
+    # 将签名结果进行Base64编码
+    signature_base64 = base64.b64encode(signature_sha256).decode('utf-8')
+
+    # 构造Authorization头部信息
+    authorization_origin = (
+        f'api_key="{api_key}", '
+        f'algorithm="hmac-sha256", '
+        f'headers="host date request-line", '
+        f'signature="{signature_base64}"'
+    )
+    
+    # 对Authorization信息进行Base64编码
+    authorization_base64 = base64.b64encode(authorization_origin.encode('utf-8')).decode('utf-8')
+
+    # 构造URL参数
+    params = {
+        "host": host,
+        "date": date,
+        "authorization": authorization_base64
+    }
+    
+    # 返回完整的认证URL（按传入的host和path拼接，签名与实际连接的地址保持一致）
+    return f"{SPARK_WS_SCHEME}://{host}{path}?{urlencode(params)}"
+
+
+# ==================== WebSocket客户端类 ====================
+class SparkWebSocketClient:
+    """
+    科大讯飞星火大模型WebSocket客户端类
+    
+    这个类封装了与星火大模型的WebSocket通信逻辑，包括：
+    - 连接建立和认证
+    - 消息发送和接收
+    - 响应内容拼接
+    - 错误处理
+    """
+    
+    def __init__(self, appid, api_key, api_secret, domain, host, api_path, rate_limiter=None):
+        """
+        初始化WebSocket客户端
+        
+        参数:
+            appid: 应用ID
+            api_key: API密钥
+            api_secret: API密钥
+            domain: 模型域名
+            host: 主机地址
+            api_path: API路径
+            rate_limiter: 调用配额限流器，默认所有进程共用的 shared_rate_limiter()
+        """
+        self.appid = appid
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.domain = domain
+        self.host = host
+        self.api_path = api_path
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        
+        # 用于存储AI响应的变量
+        self.result_content = ""      # 拼接AI的完整响应内容
+        self.is_completed = False     # 标记响应是否完成
+        self.error_message = None     # 存储错误信息
+        self.user_input_prompt = ""   # 存储用户输入的提示词
+        self.frame_count = 0          # 本次请求收到的消息帧数，用于逐帧日志采样
+
+        # 本次请求各时间点（perf_counter），用于拆分建立连接、首个token等待和流式接收耗时
+        self.connect_started_at = None
+        self.opened_at = None
+        self.first_token_at = None
+        self.last_token_at = None
+
+    def on_open(self, ws):
+        """
+        WebSocket连接建立时的回调函数
+        
+        当WebSocket连接成功建立后，这个函数会被自动调用
+        主要任务是构造请求消息并发送给星火大模型
+        """
+        self.opened_at = time.perf_counter()
+        log_event(logger, logging.DEBUG, "ws_open")
+        
+        # 构建发送给星火大模型的请求消息（JSON格式）
+        message_json = {
+            "header": {
+                "app_id": self.appid,  # 应用ID
+            },
+            "parameter": {
+                "chat": {
+                    "domain": self.domain,      # 模型版本
+                    "temperature": 0.5,         # 控制生成内容的随机性，0-1之间，越小越确定
+                    "max_tokens": 4096,         # 最大生成Token数量
+                    "top_k": 4,                # 从k个最可能的词中选择
+                }
+            },
+            "payload": {
+                "message": {
+                    "text": [
+                        # 系统角色：定义AI助手的身份和任务
+                        {
+                            "role": "system", 
+                            "content": (
+                                "你是一个专业的企业年度总结报告智能助手。"
+                                "你的任务是根据用户提供的原始工作内容，"
+                                "提炼并总结出年度总结报告的关键信息，"
+                                "并以结构化的JSON格式输出。"
+                                "确保内容真实、简洁、客观。"
+                                "如果某个部分信息不足，请留空或简要说明。"
+                                "对于列表形式的字段，请输出JSON数组。"
+                            )
+                        },
+                        # 用户角色：包含用户输入和具体的JSON格式要求
+                        {
+                            "role": "user", 
+                            "content": self.user_input_prompt
+                        }
+                    ]
+                }
+            }
+        }
+        
+        # 将消息转换为JSON字符串并发送
+        try:
+            message_str = json.dumps(message_json, ensure_ascii=False)
+            ws.send(message_str)
+            log_event(logger, logging.DEBUG, "ws_request_sent", bytes=len(message_str))
+        except Exception as e:
+            self.error_message = f"发送请求消息失败: {str(e)}"
+            log_event(logger, logging.ERROR, "ws_send_failed", error=str(e))
+            self.is_completed = True
+            ws.close()
+
+    def on_message(self, ws, message):
+        """
+        接收到WebSocket消息时的回调函数
+
+        星火大模型会分多次发送响应内容，这个函数负责：
+        1. 解析每次收到的消息
+        2. 检查是否有错误
+        3. 拼接响应内容
+        4. 判断是否响应完成
+        """
+        try:
+            # 逐帧调试日志按采样率记录，且只记录帧大小，不记录内容
+            self.frame_count += 1
+            if logger.isEnabledFor(logging.DEBUG) and frame_sampled(self.frame_count):
+                log_event(logger, logging.DEBUG, "ws_frame", index=self.frame_count, bytes=len(message))
+
+            # 解析收到的JSON消息
+            response_data = json.loads(message)
+
+            # 检查响应数据结构
+            if 'header' not in response_data:
+                self.error_message = "响应数据缺少header字段"
+                log_event(logger, logging.ERROR, "ws_bad_frame", error=self.error_message,
+                          keys=",".join(sorted(response_data)))
+                self.is_completed = True
+                ws.close()
+                return
+
+            header = response_data['header']
+
+            # 检查API调用是否成功（错误码为0表示成功）
+            if header.get('code', -1) != 0:
+                error_code = header.get('code', '未知')
+                error_msg = header.get('message', '未知错误')
+                self.error_message = f"API请求失败，错误码: {error_code}, 错误信息: {error_msg}"
+                log_event(logger, logging.ERROR, "ws_api_error", code=error_code, message=error_msg)
+                record_upstream_error("websocket", error_code)
+                self.is_completed = True
+                ws.close()
+                return
+
+            # 检查payload字段是否存在
+            if 'payload' not in response_data:
+                self.error_message = "响应数据缺少payload字段"
+                log_event(logger, logging.ERROR, "ws_bad_frame", error=self.error_message,
+                          keys=",".join(sorted(response_data)))
+                self.is_completed = True
+                ws.close()
+                return
+
+            payload = response_data['payload']
+
+            # 检查choices字段是否存在
+            if 'choices' not in payload:
+                self.error_message = "payload中缺少choices字段"
+                log_event(logger, logging.ERROR, "ws_bad_frame", error=self.error_message,
+                          keys=",".join(sorted(payload)))
+                self.is_completed = True
+                ws.close()
+                return
+
+            # 获取响应内容
+            choices = payload['choices']
+
+            # 检查status字段
+            if 'status' not in choices:
+                self.error_message = "choices中缺少status字段"
+                log_event(logger, logging.ERROR, "ws_bad_frame", error=self.error_message,
+                          keys=",".join(sorted(choices)))
+                self.is_completed = True
+                ws.close()
+                return
+
+            status = choices['status']  # 0：开始；1：进行中；2：结束
+
+            # 检查text字段
+            if 'text' not in choices or not choices['text']:
+                log_event(logger, logging.DEBUG, "ws_empty_text", index=self.frame_count)
+                # 不是致命错误，继续处理
+            else:
+                # 拼接AI生成的内容（星火模型会分多次发送内容）
+                if len(choices['text']) > 0 and 'content' in choices['text'][0]:
+                    content = choices['text'][0]['content']
+                    self.result_content += content
+                    self.last_token_at = time.perf_counter()
+                    if self.first_token_at is None:
+                        self.first_token_at = self.last_token_at
+
+            # 如果状态为2，表示响应结束
+            if status == 2:
+                # 最后一帧携带本次调用的token用量
+                usage = payload.get('usage', {}).get('text')
+                if usage:
+                    record_token_usage("websocket", usage)
+
+                log_event(logger, logging.INFO, "ws_completed", frames=self.frame_count,
+                          chars=len(self.result_content))
+                self.is_completed = True
+                ws.close()  # 关闭WebSocket连接
+
+        except json.JSONDecodeError as e:
+            self.error_message = f"JSON解析错误: {str(e)}"
+            log_event(logger, logging.ERROR, "ws_frame_json_error", error=str(e), frame=redact(message))
+            self.is_completed = True
+            ws.close()
+        except KeyError as e:
+            self.error_message = f"响应数据结构错误，缺少字段: {str(e)}"
+            log_event(logger, logging.ERROR, "ws_bad_frame", error=self.error_message, frame=redact(message))
+            self.is_completed = True
+            ws.close()
+        except Exception as e:
+            self.error_message = f"处理响应消息时出错: {str(e)}"
+            log_event(logger, logging.ERROR, "ws_frame_error", error=str(e),
+                      error_type=type(e).__name__, frame=redact(message))
+            self.is_completed = True
+            ws.close()
+
+    def on_error(self, ws, error):
+        """WebSocket发生错误时的回调函数"""
+        self.error_message = f"WebSocket错误: {error}"
+        log_event(logger, logging.ERROR, "ws_error", error=str(error))
+        record_upstream_error("websocket", type(error).__name__)
+        self.is_completed = True
+
+    def on_close(self, ws, close_status_code, close_msg):
+        """WebSocket连接关闭时的回调函数"""
+        log_event(logger, logging.DEBUG, "ws_closed", status=close_status_code, message=close_msg)
+        self.is_completed = True  # 确保即使异常关闭也能标记为完成
+
+    def send_request(self, user_input_text, prompt=None):
+        """
+        发送请求到星火大模型并等待响应
+
+        这是客户端的主要方法，负责：
+        1. 重置状态变量
+        2. 生成认证URL
+        3. 构造提示词
+        4. 建立WebSocket连接
+        5. 等待响应完成
+        6. 返回结果或抛出异常
+
+        参数:
+            user_input_text: 用户输入的原始文本
+            prompt: 完整的提示词（例如增量提取，见 incremental.py），默认按用户输入构造
+
+        返回:
+            AI生成的JSON格式响应内容
+        """
+        # 重置每次请求的状态
+        self.result_content = ""
+        self.is_completed = False
+        self.error_message = None
+        self.frame_count = 0
+        self.opened_at = None
+        self.first_token_at = None
+        self.last_token_at = None
+
+        # 检查API凭证
+        if not self.appid or not self.api_key or not self.api_secret:
+            raise Exception("API凭证未配置，请检查环境变量 SPARK_APPID, SPARK_APIKEY, SPARK_APISECRET")
+
+        # 生成带认证信息的WebSocket URL
+        try:
+            auth_url = generate_spark_auth_url(self.host, self.api_path, self.api_key, self.api_secret)
+        except Exception as e:
+            raise Exception(f"生成认证URL失败: {str(e)}")
+
+        # 构造包含JSON格式要求的完整提示词
+        self.user_input_prompt = prompt if prompt is not None else self._create_spark_prompt(user_input_text)
+        log_event(logger, logging.INFO, "ws_request", host=self.host,
+                  input_chars=len(user_input_text), prompt_chars=len(self.user_input_prompt))
+
+        with deadline_stage(STAGE_UPSTREAM) as deadline:
+            # 等待账号的调用配额（所有进程共用）
+            self.rate_limiter.acquire(deadline)
+            sock = None
+            unregister = None
+            try:
+                # 按本阶段剩余的期限建立连接，超时或客户端断开时直接关闭socket，
+                # run_forever随之返回（websocket-client本身没有总超时）
+                self.connect_started_at = time.perf_counter()
+                sock = self._open_socket(deadline.time_left())
+
+                # 创建WebSocket应用实例
+                ws = websocket.WebSocketApp(
+                    auth_url,
+                    on_open=self.on_open,       # 连接建立时的回调
+                    on_message=self.on_message, # 收到消息时的回调
+                    on_error=self.on_error,     # 发生错误时的回调
+                    on_close=self.on_close,     # 连接关闭时的回调
+                    socket=sock                 # 使用已建立的连接
+                )
+                unregister = deadline.on_cancel(lambda: self._abort(ws, sock))
+
+                # 运行WebSocket连接，直到完成、出错或被取消
+                ws.run_forever()
+            except Exception as e:
+                self.error_message = f"WebSocket连接异常: {str(e)}"
+                log_event(logger, logging.ERROR, "ws_run_failed", error=str(e))
+            finally:
+                if unregister is not None:
+                    unregister()
+                if sock is not None:
+                    sock.close()
+                self._record_upstream_spans()
+
+            if deadline.cancelled or (self.error_message and deadline.time_left() <= 0):
+                # 已收到的部分内容不完整，丢弃；记录收到的帧数和字符数供排查
+                log_event(logger, logging.WARNING, "ws_cancelled", frames=self.frame_count,
+                          chars=len(self.result_content))
+                record_upstream_error("websocket", deadline.reason or "deadline")
+                deadline.check()
+
+        # 检查是否有错误发生
+        if self.error_message:
+            raise Exception(self.error_message)
+
+        # 检查是否收到了响应内容
+        if not self.result_content.strip():
+            raise Exception("未收到AI模型的有效响应内容")
+
+        return self.result_content
+
+    def signature(self):
+        """
+        标识调用方式的字符串（协议、地址、模型），相同输入和相同签名的调用结果可以共享
+        """
+        return f"websocket|{self.host}{self.api_path}|{self.domain}"
+
+    def _split_host(self):
+        """拆分主机名和端口（未指定端口时按协议使用默认端口）"""
+        hostname, _, port = self.host.partition(":")
+        return hostname, int(port) if port else (443 if SPARK_WS_SCHEME == "wss" else 80)
+
+    def _open_socket(self, timeout):
+        """
+        建立TCP连接（wss协议时完成TLS握手），连接和握手的时间都不超过timeout秒
+
+        注意：ssl.CERT_NONE 仅用于开发和调试（与原来传给run_forever的参数一致）
+        生产环境应该改为ssl.CERT_REQUIRED以确保安全
+
+        返回:
+            已连接的socket，交给WebSocketApp完成WebSocket握手
+        """
+        hostname, port = self._split_host()
+        sock = socket.create_connection((hostname, port), timeout=max(timeout, 0.001))
+        try:
+            if SPARK_WS_SCHEME == "wss":
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                sock = context.wrap_socket(sock, server_hostname=hostname)
+            # 之后的等待由期限控制：到期时 _abort 关闭连接
+            sock.settimeout(None)
+            return sock
+        except Exception:
+            sock.close()
+            raise
+
+    @staticmethod
+    def _abort(ws, sock):
+        """
+        取消进行中的调用：停止事件循环并关闭socket
+
+        在监视线程中调用；shutdown会唤醒阻塞在读取上的run_forever
+        """
+        ws.keep_running = False
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # 连接已关闭
+
+    def warmup(self, connections=1):
+        """
+        预热：解析API主机的DNS
+
+        WebSocket协议每次调用都会新建连接（连接在回复结束后由服务端关闭），无法预先建立连接池，
+        这里只提前完成DNS解析和websocket-client的导入
+
+        返回:
+            预先建立的连接数（总是0）
+        """
+        hostname, port = self._split_host()
+        socket.getaddrinfo(hostname, port)
+        log_event(logger, logging.INFO, "ws_warmup", host=self.host)
+        return 0
+
+    def _record_upstream_spans(self):
+        """
+        记录本次调用的细分阶段耗时
+
+        - upstream_handshake: 发起连接到连接建立（DNS、TCP、TLS、WebSocket握手）
+        - upstream_ttft: 连接建立（请求已发送）到收到第一个内容片段
+        - upstream_stream: 第一个到最后一个内容片段
+        """
+        if self.opened_at is None:
+            return
+        observe_stage(STAGE_UPSTREAM_HANDSHAKE, self.opened_at - self.connect_started_at, self.connect_started_at)
+        if self.first_token_at is not None:
+            observe_stage(STAGE_UPSTREAM_TTFT, self.first_token_at - self.opened_at, self.opened_at)
+            observe_stage(STAGE_UPSTREAM_STREAM, self.last_token_at - self.first_token_at, self.first_token_at)
+
+    def _create_spark_prompt(self, user_input_text):
+        """
+        构造发送给星火大模型的提示词
+
+        这个方法创建一个详细的提示词，要求AI：
+        1. 分析用户输入的内容
+        2. 提取年度总结的关键信息
+        3. 按照指定的JSON格式输出结果
+
+        参数:
+            user_input_text: 用户输入的原始文本
+
+        返回:
+            格式化的提示词字符串
+        """
+        prompt = f"""
+请根据以下用户输入的文本内容，生成一份年度总结报告的关键信息。
+如果某个字段没有对应内容，请使用空字符串或空列表。
+
+用户输入内容：
+『{user_input_text}』
+
+请严格按照以下JSON格式输出，确保字段名称不变：
+{{
+  "年度总结概述": "根据上述内容，总结年度工作亮点、整体表现和主要成就，用一句话概括。",
+  "主要成就与贡献": [
+    "条目1：具体完成了什么，取得了什么成果",
+    "条目2：...",
+    "..."
+  ],
+  "遇到的挑战及解决方案": [
+    "条目1：遇到了什么困难，如何解决的",
+    "条目2：...",
+    "..."
+  ],
+  "个人成长与学习": [
+    "条目1：学习了什么新知识/技能，如何应用",
+    "条目2：...",
+    "..."
+  ],
+  "未来展望与计划": [
+    "条目1：明年的主要工作目标",
+    "条目2：...",
+    "..."
+  ],
+  "姓名": "（请根据上下文推断或留空）",
+  "报告日期": "（请根据上下文推断或填写当前日期，格式如：YYYY年MM月DD日）"
+}}
+"""
+        return prompt
+
+
+def create_ws_client():
+    """
+    按环境变量创建WebSocket客户端
+
+    凭证在调用时读取（而不是导入时），调用前加载的.env同样生效
+
+    返回:
+        SparkWebSocketClient实例
+    """
+    return SparkWebSocketClient(
+        os.getenv("SPARK_APPID"), os.getenv("SPARK_APIKEY"), os.getenv("SPARK_APISECRET"),
+        SPARK_DOMAIN, SPARK_HOST, SPARK_API_PATH
+    )
@@ -112,8 +112,8 @@ def start_application():
     
     try:
         # 导入并运行Flask应用
-        from app import app
-        app.run(debug=True, host='0.0.0.0', port=5000)
+        from app import create_app
+        create_app().run(debug=True, host='0.0.0.0', port=5000)
     except KeyboardInterrupt:
         print("\n\n👋 应用已停止")
     except Exception as e:
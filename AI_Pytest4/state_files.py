@@ -0,0 +1,85 @@
+"""
+本地状态文件（SQLite）的位置与权限
+
+任务表、幂等登记、单飞登记、片段缓存和限流状态保存在SQLite文件中，其中含有用户输入、
+大模型的提取结果和生成的文档。为避免同一主机上的其他用户读取或预先占用这些文件：
+1. 默认放在系统临时目录下本用户专属的目录 STATE_DIR 中，目录以0700权限创建，
+   已存在但不属于当前用户（或不是目录）时拒绝使用
+2. 文件以0600权限创建，已存在的本用户文件收紧为0600；SQLite的WAL和共享内存文件沿用该权限
+显式配置的路径（例如多主机共用的共享卷）同样以0600权限创建文件，所在目录的权限由部署方负责。
+
+作者：AI助手
+日期：2025年
+"""
+
+import os
+import sqlite3
+import stat
+import tempfile
+
+
+def _user_tag():
+    """区分用户的目录后缀（类Unix系统为uid）"""
+    if hasattr(os, "getuid"):
+        return str(os.getuid())
+    return os.getenv("USERNAME", "user")
+
+
+# ==================== 配置 ====================
+STATE_DIR = os.getenv(
+    "STATE_DIR", os.path.join(tempfile.gettempdir(), f"ai_summary-{_user_tag()}")
+)  # 状态文件的默认目录（仅当前用户可访问）
+
+
+def state_path(name):
+    """
+    默认状态文件的路径
+
+    参数:
+        name: 文件名
+
+    返回:
+        STATE_DIR 下的路径（目录在第一次打开文件时创建）
+    """
+    return os.path.join(STATE_DIR, name)
+
+
+def _ensure_private_dir(directory):
+    """创建或检查状态目录：必须是当前用户所有的目录，权限收紧为0700"""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or (hasattr(os, "getuid") and st.st_uid != os.getuid()):
+        raise PermissionError(f"状态目录 {directory} 不是当前用户所有的目录")
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        os.chmod(directory, 0o700)
+
+
+def connect_state_db(path, timeout):
+    """
+    打开状态文件：文件以0600权限创建，位于 STATE_DIR 时先创建或检查该目录
+
+    参数:
+        path: 数据库文件路径
+        timeout: 等待数据库锁的秒数
+
+    返回:
+        自动提交模式的 sqlite3.Connection（事务由调用方以 BEGIN IMMEDIATE 显式开始）
+
+    抛出:
+        sqlite3.OperationalError: 目录或文件无法创建、不属于当前用户
+    """
+    try:
+        directory = os.path.dirname(os.path.abspath(path))
+        if directory == os.path.abspath(STATE_DIR):
+            _ensure_private_dir(directory)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            st = os.fstat(fd)
+            if hasattr(os, "fchmod") and stat.S_IMODE(st.st_mode) & 0o077 and st.st_uid == os.getuid():
+                os.fchmod(fd, 0o600)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        # 与数据库本身的错误一样处理（各状态文件的调用方已有相应的退回逻辑）
+        raise sqlite3.OperationalError(f"无法打开状态文件 {path}: {e}") from e
+    return sqlite3.connect(path, timeout=timeout, isolation_level=None)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Word模板编译器（构建时运行）
+
+检查模板中的占位符，并把模板编译为服务器启动时直接加载的预编译产物：
+1. 校验模板能被python-docx解析，占位符都是服务器会填充的字段、位于会被填充的位置
+2. 缺少占位符或出现未知占位符时报错退出（--allow-missing 允许只包含部分字段的短版模板）
+3. 规范化被Word拆到多个run中的占位符：合并为一个run，沿用第一个run的字符格式
+4. 把 word/document.xml 在占位符处切分为静态XML片段，和占位符位置一起写入
+   与模板同名的 .compiled.json 文件
+
+服务器加载模板时（template_registry.py），产物与模板内容一致则直接读取JSON，
+不再用python-docx解析模板；生成文档时只拼接片段（document_renderer.render_precompiled）。
+产物与模板不一致（模板修改后没有重新编译）时忽略产物，按原来的方式解析和填充。
+
+使用方法：
+    python template_compiler.py                           # 编译默认模板和多模板目录中的所有模板
+    python template_compiler.py report_templates/短版.docx --allow-missing
+    python template_compiler.py --check                   # 只检查，产物缺失或过期时以非零状态退出
+
+作者：AI助手
+日期：2025年
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+from copy import deepcopy
+
+from document_renderer import PLACEHOLDER_FIELDS, TABLE_PLACEHOLDERS, isolate_placeholder, list_item_prototype
+from template_registry import ARTIFACT_FORMAT, PLACEHOLDER_PATTERN, artifact_path
+
+
+# ==================== 配置 ====================
+SUMMARY_TEMPLATE_DIR = os.getenv("SUMMARY_TEMPLATE_DIR", "report_templates")  # 多模板目录（与 app.py 相同）
+DEFAULT_TEMPLATE_PATH = os.getenv("DEFAULT_TEMPLATE_PATH", "年度总结模板.docx")  # 默认模板（与 app.py 相同）
+
+# 正文部件在.docx中的路径
+DOCUMENT_PART = "word/document.xml"
+
+# 切分XML时临时写在占位符位置的标记（Unicode私用区字符，不会出现在模板中）
+SLOT_MARKER = "\ue000{}\ue001"
+SLOT_PATTERN = re.compile("\ue000(\\d+)\ue001")
+
+
+class TemplateCompileError(ValueError):
+    """模板不能编译，problems 列出所有问题"""
+
+    def __init__(self, problems):
+        super().__init__("；".join(problems))
+        self.problems = problems
+
+
+def _slot_run(paragraph, placeholder, slot_index):
+    """
+    把段落中的一个占位符放入单独的run（见 document_renderer.isolate_placeholder），文本替换为切分标记
+
+    返回:
+        处理成功返回True；占位符位于超链接等无法处理的位置时返回False
+    """
+    from docx.oxml.ns import qn  # 延迟导入，见 content_parsing.extract_docx_text
+
+    run = isolate_placeholder(paragraph, placeholder)
+    if run is None:
+        return False
+    run.text = SLOT_MARKER.format(slot_index)
+    run.find(qn('w:t')).set(qn('xml:space'), 'preserve')
+    return True
+
+
+def _slot_paragraph(paragraph, slot_index):
+    """
+    把独占一段的占位符段落替换为条目原型段落（见 document_renderer.list_item_prototype），
+    文本为切分标记
+
+    返回:
+        条目前的项目符号
+    """
+    from docx.oxml.ns import qn
+
+    empty_paragraph, run, bullet = list_item_prototype(paragraph)
+    text = run.makeelement(qn('w:t'))
+    text.set(qn('xml:space'), 'preserve')
+    text.text = SLOT_MARKER.format(slot_index)
+    run.append(text)
+    empty_paragraph.append(run)
+    paragraph._p.addnext(empty_paragraph)
+    paragraph._p.getparent().remove(paragraph._p)
+    return bullet
+
+
+def _split_segments(xml, slots):
+    """
+    在切分标记处切开正文XML
+
+    参数:
+        xml: 带切分标记的正文XML字符串
+        slots: 按标记编号排列的占位符信息（编号顺序是处理顺序，不一定是文档中的顺序）
+
+    返回:
+        静态XML字符串与占位符字典交替的片段列表（按文档顺序）
+    """
+    pieces = SLOT_PATTERN.split(xml)  # [XML, 编号, XML, 编号, ..., XML]
+    segments = [pieces[0]]
+    for index in range(1, len(pieces), 2):
+        slot, after = slots[int(pieces[index])], pieces[index + 1]
+        if 'bullet' in slot:
+            # 独占一段的占位符：整个段落的开头和结尾作为每个条目的前缀和后缀
+            before = segments[-1]
+            paragraph_start = max(before.rfind('<w:p>'), before.rfind('<w:p '))
+            paragraph_end = after.index('</w:p>') + len('</w:p>')
+            slot = dict(slot, prefix=before[paragraph_start:], suffix=after[:paragraph_end])
+            segments[-1], after = before[:paragraph_start], after[paragraph_end:]
+        segments.extend((slot, after))
+    return segments
+
+
+def compile_template(data, allow_missing=False):
+    """
+    编译模板
+
+    参数:
+        data: 模板.docx内容（bytes）
+        allow_missing: 是否允许模板只包含部分占位符
+
+    返回:
+        预编译产物（可直接写为JSON的字典）
+
+    抛出:
+        TemplateCompileError: 模板不能解析、缺少占位符、出现未知占位符或占位符位于不会被填充的位置
+    """
+    from docx import Document  # 延迟导入，见 content_parsing.extract_docx_text
+    from docx.opc.oxml import serialize_part_xml
+    from docx.oxml.ns import qn
+
+    try:
+        doc = Document(io.BytesIO(data))
+    except Exception as e:
+        raise TemplateCompileError([f"无法解析模板: {e}"])
+
+    known = {placeholder for placeholder, _ in PLACEHOLDER_FIELDS}
+    problems = []
+    found = set()
+    slots = []
+    reported = set()  # 已报告问题的段落，其中剩下的占位符不再按文本框等位置重复报告
+
+    def compile_paragraph(paragraph, location, in_table):
+        if paragraph._p in reported:
+            return
+        reported_before = len(problems)
+        text = paragraph.text
+        placeholders = PLACEHOLDER_PATTERN.findall(text)
+        for placeholder in placeholders:
+            found.add(placeholder)
+            if placeholder not in known:
+                problems.append(f"{location}: 未知占位符 {placeholder}")
+            elif in_table and placeholder not in TABLE_PLACEHOLDERS:
+                problems.append(f"{location}: {placeholder} 不会在此位置被填充（表格中只填充 {'、'.join(TABLE_PLACEHOLDERS)}）")
+        if len(problems) > reported_before:
+            reported.add(paragraph._p)
+            return
+
+        # 与 fill_template 一致：正文中独占一段的占位符按段落展开
+        if not in_table and len(placeholders) == 1 and text.strip() == placeholders[0]:
+            slots.append({"placeholder": placeholders[0], "location": location,
+                          "bullet": _slot_paragraph(paragraph, len(slots))})
+            return
+        for placeholder in placeholders:
+            if _slot_run(paragraph, placeholder, len(slots)):
+                slots.append({"placeholder": placeholder, "location": location})
+            else:
+                problems.append(f"{location}: {placeholder} 位于超链接、域代码等无法替换的位置")
+                reported.add(paragraph._p)
+
+    for index, paragraph in enumerate(doc.paragraphs, 1):
+        compile_paragraph(paragraph, f"正文第{index}段", in_table=False)
+
+    # 合并单元格会在 row.cells 中重复出现，第二次遇到时占位符已替换为切分标记
+    for table_index, table in enumerate(doc.tables, 1):
+        for row_index, row in enumerate(table.rows, 1):
+            for column_index, cell in enumerate(row.cells, 1):
+                for paragraph in cell.paragraphs:
+                    location = f"表格{table_index}第{row_index}行第{column_index}列"
+                    compile_paragraph(paragraph, location, in_table=True)
+
+    # 已处理的占位符都换成了切分标记，剩下的（已报告问题的段落除外）位于文本框、嵌套表格或页眉页脚中，不会被填充
+    leftovers = [("正文", ''.join(node.itertext()))
+                 for node in doc.element.body.iter(qn('w:p')) if node not in reported]
+    for section_index, section in enumerate(doc.sections, 1):
+        for part in (section.header, section.footer):
+            if not part.is_linked_to_previous:
+                leftovers.extend((f"第{section_index}节页眉页脚", p.text) for p in part.paragraphs)
+    for location, text in leftovers:
+        for placeholder in PLACEHOLDER_PATTERN.findall(text):
+            found.add(placeholder)
+            problems.append(f"{location}: {placeholder} 位于文本框、嵌套表格或页眉页脚中，不会被填充")
+
+    if not allow_missing:
+        problems.extend(f"缺少占位符 {placeholder}" for placeholder, _ in PLACEHOLDER_FIELDS if placeholder not in found)
+    if problems:
+        raise TemplateCompileError(problems)
+
+    xml = serialize_part_xml(doc.element).decode('utf-8')
+    return {
+        "format": ARTIFACT_FORMAT,
+        "source_sha256": hashlib.sha256(data).hexdigest(),
+        "document_part": DOCUMENT_PART,
+        "placeholders": sorted(found),
+        "segments": _split_segments(xml, slots),
+    }
+
+
+def _default_targets():
+    """默认编译的模板：默认模板和多模板目录中的所有.docx"""
+    targets = [DEFAULT_TEMPLATE_PATH] if os.path.exists(DEFAULT_TEMPLATE_PATH) else []
+    if os.path.isdir(SUMMARY_TEMPLATE_DIR):
+        targets.extend(
+            os.path.join(SUMMARY_TEMPLATE_DIR, name) for name in sorted(os.listdir(SUMMARY_TEMPLATE_DIR))
+            if name.lower().endswith('.docx') and not name.startswith('~$')
+        )
+    return targets
+
+
+def compile_file(path, allow_missing=False, check=False):
+    """
+    编译一个模板文件并写入预编译产物，结果打印到标准输出
+
+    模板生成脚本（create_template.py、generate_template.py）生成模板后也调用这里
+
+    参数:
+        path: 模板文件路径
+        allow_missing: 是否允许模板只包含部分占位符
+        check: 只检查模板和产物，不写入文件
+
+    返回:
+        模板可以编译（check 时还要求产物与模板一致）返回True，否则返回False
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        artifact = compile_template(data, allow_missing=allow_missing)
+    except (OSError, TemplateCompileError) as e:
+        print(f"❌ {path}")
+        for problem in getattr(e, "problems", [str(e)]):
+            print(f"   - {problem}")
+        return False
+
+    output = artifact_path(path)
+    content = json.dumps(artifact, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if check:
+        try:
+            with open(output, 'rb') as f:
+                up_to_date = f.read() == content
+        except OSError:
+            up_to_date = False
+        if not up_to_date:
+            print(f"❌ {path}: 预编译产物 {output} 缺失或已过期，请重新运行 python template_compiler.py")
+            return False
+        print(f"✅ {path}")
+    else:
+        # 先写临时文件再重命名，运行中的服务器不会读到半个文件
+        with open(output + ".tmp", 'wb') as f:
+            f.write(content)
+        os.replace(output + ".tmp", output)
+        print(f"✅ {path} -> {output}（{len(content)} 字节）")
+
+    for segment in artifact["segments"]:
+        if isinstance(segment, dict):
+            print(f"   {segment['location']}: {segment['placeholder']}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查并预编译Word模板")
+    parser.add_argument("templates", nargs="*", help="模板文件，默认为默认模板和多模板目录中的所有模板")
+    parser.add_argument("--allow-missing", action="store_true", help="允许模板只包含部分占位符（短版模板）")
+    parser.add_argument("--check", action="store_true", help="只检查模板和产物，不写入文件；产物缺失或过期时失败")
+    args = parser.parse_args()
+
+    targets = args.templates or _default_targets()
+    if not targets:
+        print("❌ 没有找到模板文件")
+        return 1
+
+    failed = 0
+    for path in targets:
+        if not compile_file(path, allow_missing=args.allow_missing, check=args.check):
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
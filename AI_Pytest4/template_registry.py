@@ -0,0 +1,347 @@
+"""
+Word模板注册表
+
+支持多个年度总结模板（例如按部门区分、长版/短版），主要功能：
+1. 启动时扫描模板目录，预先编译所有.docx模板
+2. 运行中定期检查文件变化，自动重新编译新增或修改的模板
+3. 请求通过模板ID选择模板，不再每次检查文件是否存在
+
+模板ID即文件名（不含扩展名），例如 report_templates/研发部-长版.docx 的ID为“研发部-长版”。
+根目录下原有的 年度总结模板.docx 注册为默认模板 default。
+
+.docx本质上是zip包，同一套生成脚本产生的模板大多共享样式、主题、字体等部件，
+注册表把各模板的zip部件按内容哈希放入共享部件池，相同部件只保存一份，
+模板数量增加时内存只随“不同的部件”增长。
+
+模板旁边有与之匹配的预编译产物（template_compiler.py 生成的 <模板名>.compiled.json）时，
+直接读取产物中的占位符和正文XML片段，不再用python-docx解析模板。
+
+作者：AI助手
+日期：2025年
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zipfile
+
+from log_config import get_logger, log_event
+
+
+logger = get_logger(__name__)
+
+# 默认模板ID
+DEFAULT_TEMPLATE_ID = "default"
+
+# 模板中的占位符格式：[[字段名]]
+PLACEHOLDER_PATTERN = re.compile(r'\[\[[^\[\]]+\]\]')
+
+# 预编译产物的格式版本：片段结构变化时递增，旧版本的产物视为过期
+ARTIFACT_FORMAT = 1
+
+# 预编译产物的文件名后缀：年度总结模板.docx -> 年度总结模板.compiled.json
+ARTIFACT_SUFFIX = ".compiled.json"
+
+
+def artifact_path(template_path):
+    """模板对应的预编译产物路径"""
+    return os.path.splitext(template_path)[0] + ARTIFACT_SUFFIX
+
+
+class TemplateNotFoundError(KeyError):
+    """请求的模板ID不存在"""
+
+
+class _PartPool:
+    """
+    模板zip部件的共享池
+
+    按内容哈希保存部件字节并记录引用计数，
+    模板被移除或重新编译时释放不再被引用的部件。
+    模板直接持有部件字节对象的引用，正在使用旧版本模板的请求不受释放影响
+    """
+
+    def __init__(self):
+        self._parts = {}  # 哈希 -> [字节, 引用计数]
+
+    def intern(self, data):
+        """放入一个部件，返回 (哈希, 共享的字节对象)"""
+        part_hash = hashlib.sha256(data).hexdigest()
+        entry = self._parts.get(part_hash)
+        if entry:
+            entry[1] += 1
+        else:
+            entry = self._parts[part_hash] = [data, 1]
+        return part_hash, entry[0]
+
+    def release(self, part_hash):
+        """释放一个部件引用"""
+        entry = self._parts.get(part_hash)
+        if entry:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._parts[part_hash]
+
+    @property
+    def total_bytes(self):
+        """池中所有部件的总大小"""
+        return sum(len(entry[0]) for entry in self._parts.values())
+
+
+class CompiledTemplate:
+    """
+    预编译的模板
+
+    属性:
+        template_id: 模板ID
+        path: 模板文件路径
+        sha256: 模板内容哈希（使用预编译产物时包含产物内容），用作文档缓存键的一部分
+        placeholders: 模板中出现的占位符集合
+        parts: (zip内路径, 部件哈希, 共享的部件字节) 列表
+        segments: 预编译的正文XML片段，没有可用的预编译产物时为None
+        document_part: 片段对应的zip内路径
+    """
+
+    def __init__(self, template_id, path, signature, sha256, placeholders, parts,
+                 segments=None, document_part=None):
+        self.template_id = template_id
+        self.path = path
+        self.signature = signature
+        self.sha256 = sha256
+        self.placeholders = placeholders
+        self.parts = parts
+        self.segments = segments
+        self.document_part = document_part
+
+    def open_stream(self):
+        """
+        从共享部件池重新组装.docx，返回可交给python-docx读取的字节流
+
+        组装时使用不压缩的存储方式，避免每次请求都付出压缩开销
+        """
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zf:
+            for name, _, data in self.parts:
+                zf.writestr(name, data)
+        buffer.seek(0)
+        return buffer
+
+    def to_dict(self):
+        """转换为接口返回用的字典"""
+        return {
+            "id": self.template_id,
+            "placeholders": sorted(self.placeholders),
+            "precompiled": self.segments is not None,
+        }
+
+
+class TemplateRegistry:
+    """
+    模板注册表
+
+    线程安全；get()/list() 时按 reload_interval 节流检查文件变化
+    """
+
+    def __init__(self, template_dir, default_path=None, reload_interval=2.0):
+        """
+        初始化注册表并编译所有模板
+
+        参数:
+            template_dir: 模板目录
+            default_path: 默认模板文件路径（注册为default）
+            reload_interval: 检查文件变化的最小间隔（秒），小于等于0表示每次都检查
+        """
+        self.template_dir = template_dir
+        self.default_path = default_path
+        self.reload_interval = reload_interval
+
+        self._pool = _PartPool()
+        self._templates = {}
+        self._lock = threading.Lock()
+        self._last_scan = 0.0
+
+        self.refresh(force=True)
+
+    def _discover(self):
+        """扫描模板文件，返回 模板ID -> 路径 的字典"""
+        found = {}
+        if self.default_path and os.path.exists(self.default_path):
+            found[DEFAULT_TEMPLATE_ID] = self.default_path
+
+        if os.path.isdir(self.template_dir):
+            for name in sorted(os.listdir(self.template_dir)):
+                stem, ext = os.path.splitext(name)
+                # 跳过Word打开文档时产生的 ~$ 临时文件
+                if ext.lower() != '.docx' or name.startswith('~$'):
+                    continue
+                found.setdefault(stem, os.path.join(self.template_dir, name))
+        return found
+
+    def refresh(self, force=False):
+        """
+        检查模板文件变化并重新编译
+
+        参数:
+            force: 忽略节流间隔，立即检查
+        """
+        now = time.monotonic()
+        if not force and now - self._last_scan < self.reload_interval:
+            return
+
+        with self._lock:
+            if not force and now - self._last_scan < self.reload_interval:
+                return
+            self._last_scan = now
+
+            discovered = self._discover()
+
+            # 移除已删除的模板
+            for template_id in list(self._templates):
+                if template_id not in discovered:
+                    self._drop_locked(template_id)
+                    log_event(logger, logging.INFO, "template_removed", template=template_id)
+
+            # 编译新增或修改过的模板
+            for template_id, path in discovered.items():
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                # 预编译产物新增、重新生成或删除时也需要重新加载
+                try:
+                    artifact_stat = os.stat(artifact_path(path))
+                    artifact_signature = (artifact_stat.st_mtime_ns, artifact_stat.st_size)
+                except OSError:
+                    artifact_signature = None
+                signature = (stat.st_mtime_ns, stat.st_size, artifact_signature)
+
+                current = self._templates.get(template_id)
+                if current and current.path == path and current.signature == signature:
+                    continue
+
+                try:
+                    compiled = self._compile(template_id, path, signature)
+                except Exception as e:
+                    # 编译失败时保留旧版本（如果有），避免半写入的文件导致模板不可用
+                    log_event(logger, logging.ERROR, "template_compile_failed",
+                              template=template_id, path=path, error=str(e))
+                    continue
+
+                if current:
+                    self._drop_locked(template_id)
+                self._templates[template_id] = compiled
+                log_event(logger, logging.INFO, "template_reloaded" if current else "template_loaded",
+                          template=template_id, placeholders=len(compiled.placeholders),
+                          precompiled=compiled.segments is not None)
+
+    def _load_artifact(self, template_id, path, source_sha256):
+        """
+        读取与模板匹配的预编译产物
+
+        返回:
+            (产物字典, 产物文件内容)；没有产物或产物已过期时返回 (None, None)
+        """
+        try:
+            with open(artifact_path(path), 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None, None
+        try:
+            artifact = json.loads(raw)
+        except ValueError:
+            artifact = {}
+        if artifact.get("format") != ARTIFACT_FORMAT or artifact.get("source_sha256") != source_sha256:
+            # 模板修改后没有重新编译（或产物已损坏）：模板仍可使用，只是加载和渲染走较慢的python-docx路径
+            log_event(logger, logging.WARNING, "template_artifact_stale",
+                      template=template_id, artifact=artifact_path(path))
+            return None, None
+        return artifact, raw
+
+    def _compile(self, template_id, path, signature):
+        """
+        读取模板文件和预编译产物，并把部件放入共享池
+
+        没有可用的预编译产物时用python-docx解析模板，校验模板可用并收集占位符
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data)
+
+        artifact, raw = self._load_artifact(template_id, path, digest.hexdigest())
+        if artifact is not None:
+            placeholders = set(artifact["placeholders"])
+            # 同一模板用两种方式渲染出的文档略有差别，缓存键随产物变化
+            digest.update(raw)
+        else:
+            from docx import Document  # 延迟导入，见 content_parsing.extract_docx_text
+
+            doc = Document(io.BytesIO(data))
+            texts = [paragraph.text for paragraph in doc.paragraphs]
+            for table in doc.tables:
+                for row in table.rows:
+                    for cell in row.cells:
+                        texts.extend(paragraph.text for paragraph in cell.paragraphs)
+            placeholders = set(PLACEHOLDER_PATTERN.findall("\n".join(texts)))
+
+        parts = []
+        try:
+            with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                for info in zf.infolist():
+                    parts.append((info.filename, *self._pool.intern(zf.read(info))))
+        except BaseException:
+            for _, part_hash, _ in parts:
+                self._pool.release(part_hash)
+            raise
+
+        return CompiledTemplate(
+            template_id, path, signature,
+            digest.hexdigest(),
+            placeholders, parts,
+            segments=artifact["segments"] if artifact else None,
+            document_part=artifact["document_part"] if artifact else None
+        )
+
+    def _drop_locked(self, template_id):
+        """移除模板并释放其部件（调用方需持有锁）"""
+        template = self._templates.pop(template_id)
+        for _, part_hash, _ in template.parts:
+            self._pool.release(part_hash)
+
+    def get(self, template_id=None):
+        """
+        按ID获取预编译模板
+
+        参数:
+            template_id: 模板ID，为空时使用默认模板
+
+        返回:
+            CompiledTemplate对象
+
+        异常:
+            TemplateNotFoundError: 模板不存在
+        """
+        self.refresh()
+        template_id = template_id or DEFAULT_TEMPLATE_ID
+        with self._lock:
+            template = self._templates.get(template_id)
+        if template is None:
+            raise TemplateNotFoundError(template_id)
+        return template
+
+    def list(self):
+        """返回所有已加载模板，默认模板排在最前"""
+        self.refresh()
+        with self._lock:
+            templates = list(self._templates.values())
+        return sorted(templates, key=lambda t: (t.template_id != DEFAULT_TEMPLATE_ID, t.template_id))
+
+    @property
+    def shared_bytes(self):
+        """共享部件池占用的字节数"""
+        with self._lock:
+            return self._pool.total_bytes
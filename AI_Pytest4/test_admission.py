@@ -0,0 +1,100 @@
+"""
+准入控制（admission.py）的测试：排队、名额交接、队列已满/排队超时时拒绝，以及接口返回的429和Retry-After
+
+作者：AI助手
+日期：2025年
+"""
+
+import threading
+import time
+
+import pytest
+
+from admission import REJECT_QUEUE_FULL, REJECT_QUEUE_TIMEOUT, AdmissionController, AdmissionRejected
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+def test_queued_request_gets_released_slot():
+    """名额已满时排队，前一个调用结束后名额直接交给队首"""
+    controller = AdmissionController(max_inflight=1, max_queue=1, queue_timeout=5)
+    admitted = threading.Event()
+
+    def queued():
+        with controller.slot():
+            admitted.set()
+
+    with controller.slot():
+        worker = threading.Thread(target=queued)
+        worker.start()
+        _wait_until(lambda: len(controller._waiters) == 1)
+        assert not admitted.is_set()
+    worker.join(5)
+
+    assert admitted.is_set()
+    assert controller.inflight == 0 and not controller._waiters
+
+
+def test_full_queue_rejected_with_retry_after():
+    """队列已满时立即拒绝，Retry-After = 积压数 × 平均服务时间 ÷ 名额数"""
+    controller = AdmissionController(max_inflight=1, max_queue=1, queue_timeout=5)
+    controller.service_time = 3.0
+    release = threading.Event()
+
+    def queued():
+        with controller.slot():
+            release.wait(5)
+
+    with controller.slot():
+        worker = threading.Thread(target=queued)
+        worker.start()
+        _wait_until(lambda: len(controller._waiters) == 1)
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            controller.precheck()
+        assert rejected.value.reason == REJECT_QUEUE_FULL
+        assert rejected.value.retry_after == 6
+
+        with pytest.raises(AdmissionRejected):
+            with controller.slot():
+                pass
+    release.set()
+    worker.join(5)
+
+
+def test_queue_timeout_rejected():
+    controller = AdmissionController(max_inflight=1, max_queue=4, queue_timeout=0.05)
+    with controller.slot():
+        with pytest.raises(AdmissionRejected) as rejected:
+            with controller.slot():
+                pass
+    assert rejected.value.reason == REJECT_QUEUE_TIMEOUT
+    assert rejected.value.retry_after >= 1
+    assert controller.inflight == 0 and not controller._waiters
+
+
+def test_service_time_tracks_successful_calls():
+    controller = AdmissionController(max_inflight=2, max_queue=0)
+    controller.service_time = 10.0
+    with controller.slot():
+        pass
+    assert controller.service_time < 10.0
+
+
+def test_endpoint_returns_429_with_retry_after(summary_app, spark_client):
+    """名额和队列都已满时，接口在读取输入前返回429，Retry-After为整数秒，且不调用大模型"""
+    services = summary_app.extensions["summary"]
+    services.admission = AdmissionController(max_inflight=1, max_queue=0)
+
+    with services.admission.slot():
+        with summary_app.test_client() as client:
+            response = client.post("/extract", data={"text_input": "工作记录"})
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert spark_client.calls == []
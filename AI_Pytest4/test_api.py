@@ -77,13 +77,10 @@ def test_api_connection():
 
         else:
             # 测试WebSocket协议
-            from app import SparkWebSocketClient, APPID, APIKey, APISecret, SPARK_DOMAIN, SPARK_HOST, SPARK_API_PATH
+            from spark_ws_client import SPARK_API_PATH, SPARK_DOMAIN, SPARK_HOST, create_ws_client
 
             print(f"🔗 WebSocket配置: {SPARK_HOST}{SPARK_API_PATH}, 域名: {SPARK_DOMAIN}")
-            client = SparkWebSocketClient(
-                APPID, APIKey, APISecret,
-                SPARK_DOMAIN, SPARK_HOST, SPARK_API_PATH
-            )
+            client = create_ws_client()
         
         # 发送一个简单的测试请求
         test_input = "今年我完成了一个重要项目，学习了新技术，明年计划继续提升。"
@@ -0,0 +1,111 @@
+"""
+幂等键（idempotency.py）的测试：登记、保存结果、失败后删除，以及重复请求返回409时不影响第一次请求
+
+作者：AI助手
+日期：2025年
+"""
+
+import threading
+
+import pytest
+
+from idempotency import (
+    CONFLICT_IN_PROGRESS, CONFLICT_MISMATCH, IdempotencyConflict, IdempotencyStore, request_fingerprint
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(str(tmp_path / "idempotency.db"))
+
+
+def test_begin_complete_replay(store):
+    fingerprint = request_fingerprint("default", "工作记录")
+    result, token = store.begin("k1", fingerprint)
+    assert result is None and token
+
+    store.complete("k1", token, {"姓名": "张三"})
+
+    assert store.begin("k1", fingerprint) == ({"姓名": "张三"}, None)
+
+
+def test_fingerprint_ignores_line_endings():
+    assert request_fingerprint("default", "第一行\r\n第二行  \n") == request_fingerprint("default", "第一行\n第二行")
+    assert request_fingerprint("default", "工作记录") != request_fingerprint("other", "工作记录")
+
+
+def test_in_progress_and_mismatch(store):
+    store.begin("k1", request_fingerprint("default", "工作记录"))
+
+    with pytest.raises(IdempotencyConflict) as in_progress:
+        store.begin("k1", request_fingerprint("default", "工作记录"))
+    assert in_progress.value.reason == CONFLICT_IN_PROGRESS
+
+    with pytest.raises(IdempotencyConflict) as mismatch:
+        store.begin("k1", request_fingerprint("default", "另一份记录"))
+    assert mismatch.value.reason == CONFLICT_MISMATCH
+
+
+def test_release_allows_retry(store):
+    fingerprint = request_fingerprint("default", "工作记录")
+    _, token = store.begin("k1", fingerprint)
+
+    store.release("k1", token)
+
+    result, retry_token = store.begin("k1", fingerprint)
+    assert result is None and retry_token != token
+
+
+def test_only_registering_request_can_release_or_complete(store):
+    """其他令牌（例如登记过期后被重新登记）不能删除或覆盖当前的登记"""
+    fingerprint = request_fingerprint("default", "工作记录")
+    _, token = store.begin("k1", fingerprint)
+
+    store.release("k1", "other-token")
+    store.complete("k1", "other-token", {"姓名": "错误"})
+    with pytest.raises(IdempotencyConflict):
+        store.begin("k1", fingerprint)
+
+    store.complete("k1", token, {"姓名": "张三"})
+    store.release("k1", token)  # 已保存结果的登记不会被删除
+    assert store.begin("k1", fingerprint) == ({"姓名": "张三"}, None)
+
+
+def _extract(flask_app, results, key="k1"):
+    with flask_app.test_client() as client:
+        response = client.post("/extract", data={"text_input": "工作记录"}, headers={"Idempotency-Key": key})
+        results.append(response)
+
+
+def test_duplicate_request_gets_409_without_dropping_first(summary_app, spark_client):
+    """第一次请求仍在处理时重复请求返回409；重复请求结束后第一次请求的登记仍有效，之后的重试复用其结果"""
+    spark_client.gate.clear()
+    first = []
+    worker = threading.Thread(target=_extract, args=(summary_app, first))
+    worker.start()
+    assert spark_client.started.wait(5)
+
+    duplicates = []
+    _extract(summary_app, duplicates)
+    _extract(summary_app, duplicates)
+    assert [r.status_code for r in duplicates] == [409, 409]
+    assert duplicates[0].headers["Retry-After"].isdigit()
+
+    spark_client.gate.set()
+    worker.join(10)
+    assert first[0].status_code == 200
+
+    replayed = []
+    _extract(summary_app, replayed)
+    assert replayed[0].status_code == 200
+    assert replayed[0].headers["Idempotent-Replayed"] == "true"
+    assert replayed[0].get_json()["extracted_content"] == first[0].get_json()["extracted_content"]
+    assert len(spark_client.calls) == 1
+
+
+def test_same_key_different_input_gets_422(summary_app):
+    with summary_app.test_client() as client:
+        assert client.post("/extract", data={"text_input": "工作记录"},
+                           headers={"Idempotency-Key": "k1"}).status_code == 200
+        assert client.post("/extract", data={"text_input": "另一份记录"},
+                           headers={"Idempotency-Key": "k1"}).status_code == 422
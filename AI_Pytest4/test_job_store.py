@@ -0,0 +1,120 @@
+"""
+持久化任务（job_store.py）的测试：租约过期后由其他进程认领并从最后完成的阶段继续
+
+两个 JobStore 共用同一个任务表文件，相当于两个worker；第一个的 owner 设为其他主机，
+停止续约（_unhold）即相当于该worker退出。
+
+作者：AI助手
+日期：2025年
+"""
+
+import time
+
+import pytest
+
+import job_store
+from job_store import STAGE_EXTRACTED, STATUS_DONE, STATUS_FAILED, STATUS_RUNNING, JobBusy, JobStore
+
+LEASE_SECONDS = 0.2
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_store, "JOB_LEASE_SECONDS", LEASE_SECONDS)
+    path = str(tmp_path / "jobs.db")
+    crashed = JobStore(path)
+    crashed.owner = "other-host:1"
+    return crashed, JobStore(path)
+
+
+def _crash(store, job):
+    """worker退出：不再续约"""
+    store._unhold(job.job_id)
+
+
+def test_lease_expiry_and_resume(stores):
+    crashed, survivor = stores
+    job = crashed.start("default", "工作记录", "k1")
+    crashed.save_extracted(job, {"姓名": "张三"})
+    _crash(crashed, job)
+
+    assert survivor.claim_expired() is None  # 租约未过期
+    time.sleep(LEASE_SECONDS * 1.5)
+    resumed = survivor.claim_expired()
+
+    assert resumed.job_id == job.job_id
+    assert resumed.stage == STAGE_EXTRACTED
+    assert resumed.extracted == {"姓名": "张三"}
+    assert resumed.attempts == 2
+    assert resumed.user_input == ""  # 保存提取结果后不再保留输入原文
+
+    survivor.save_document(resumed, "doc", b"docx")
+    assert survivor.get(job.job_id).status == STATUS_DONE
+
+
+def test_lost_lease_cannot_overwrite(stores):
+    """租约被接管后，原进程的写入不生效"""
+    crashed, survivor = stores
+    job = crashed.start("default", "工作记录")
+    _crash(crashed, job)
+    time.sleep(LEASE_SECONDS * 1.5)
+    assert survivor.claim_expired().job_id == job.job_id
+
+    crashed.save_document(job, "stale", b"stale")
+
+    stored = survivor.get(job.job_id)
+    assert stored.status == STATUS_RUNNING and stored.document is None
+
+
+def test_retry_with_same_key_resumes_job(stores):
+    """同一幂等键的重试：租约有效时返回JobBusy，过期后接续原任务"""
+    crashed, survivor = stores
+    job = crashed.start("default", "工作记录", "k1")
+    crashed.save_extracted(job, {"姓名": "张三"})
+
+    with pytest.raises(JobBusy):
+        survivor.start("default", "工作记录", "k1")
+
+    _crash(crashed, job)
+    time.sleep(LEASE_SECONDS * 1.5)
+    resumed = survivor.start("default", "工作记录", "k1")
+
+    assert resumed.job_id == job.job_id
+    assert resumed.extracted == {"姓名": "张三"}
+
+
+def test_heartbeat_keeps_lease(stores):
+    crashed, survivor = stores
+    crashed.start("default", "工作记录")
+    time.sleep(LEASE_SECONDS * 2)
+    assert survivor.claim_expired() is None
+
+
+def test_abandoned_after_max_attempts(stores, monkeypatch):
+    monkeypatch.setattr(job_store, "JOB_MAX_ATTEMPTS", 1)
+    crashed, survivor = stores
+    job = crashed.start("default", "工作记录")
+    _crash(crashed, job)
+    time.sleep(LEASE_SECONDS * 1.5)
+
+    assert survivor.claim_expired() is None
+    assert survivor.get(job.job_id).status == STATUS_FAILED
+
+
+def test_unexpected_error_fails_job(summary_app, monkeypatch):
+    """生成过程中未预料的异常：返回500，任务标记为失败并释放租约（不再由心跳续约）"""
+    import app as summary_app_module
+
+    def broken_run_job(job, stream=True, incremental=False):
+        raise KeyError("模型返回的结构异常")
+
+    monkeypatch.setattr(summary_app_module, "_run_job", broken_run_job)
+    with summary_app.test_client() as client:
+        response = client.post("/generate_summary", data={"text_input": "工作记录"})
+
+    assert response.status_code == 500
+    assert "error" in response.get_json()
+    jobs = summary_app.extensions["summary"].jobs
+    (job_id,), = jobs._connect().execute("SELECT id FROM jobs").fetchall()
+    assert jobs.get(job_id).status == STATUS_FAILED
+    assert job_id not in jobs._held
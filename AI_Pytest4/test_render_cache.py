@@ -0,0 +1,90 @@
+"""
+文档缓存（render_cache.py）的测试：缓存键的计算与校验、按LRU顺序淘汰
+
+作者：AI助手
+日期：2025年
+"""
+
+import os
+
+from render_cache import CACHE_KEY_PATTERN, RenderCache, make_cache_key
+
+
+TEMPLATE_HASH = "ab" * 32
+
+
+def _key(n):
+    return make_cache_key(TEMPLATE_HASH, {"[[姓名]]": f"用户{n}"})
+
+
+def test_cache_key_is_stable_and_order_independent():
+    """相同的模板和取值得到相同的键，与字典顺序无关；模板或取值不同时键不同"""
+    values = {"[[姓名]]": "张三", "[[年度总结概述]]": "概述"}
+    reordered = {"[[年度总结概述]]": "概述", "[[姓名]]": "张三"}
+
+    key = make_cache_key(TEMPLATE_HASH, values)
+    assert CACHE_KEY_PATTERN.match(key)
+    assert make_cache_key(TEMPLATE_HASH, reordered) == key
+    assert make_cache_key("cd" * 32, values) != key
+    assert make_cache_key(TEMPLATE_HASH, {**values, "[[姓名]]": "李四"}) != key
+
+
+def test_invalid_keys_are_never_looked_up(tmp_path):
+    """不是64位小写十六进制的键（例如路径）直接视为未命中，不访问缓存目录以外的文件"""
+    cache = RenderCache(str(tmp_path / "cache"), 1024)
+    outside = tmp_path / "secret.docx"
+    outside.write_bytes(b"secret")
+
+    assert cache.get("../secret") is None
+    assert cache.get(_key(1).upper()) is None
+    assert cache.get(_key(1)[:-1]) is None
+    assert cache.get(_key(1)) is None  # 合法但未写入
+
+
+def test_put_and_get(tmp_path):
+    cache = RenderCache(str(tmp_path), 1024)
+    path = cache.put(_key(1), b"docx")
+
+    assert cache.get(_key(1)) == path
+    with open(path, "rb") as f:
+        assert f.read() == b"docx"
+
+
+def test_lru_eviction(tmp_path):
+    """总大小超过上限时淘汰最久未使用的文件，读取过的文件视为最近使用"""
+    cache = RenderCache(str(tmp_path), 250)
+    cache.put(_key(1), b"a" * 100)
+    cache.put(_key(2), b"b" * 100)
+    assert cache.get(_key(1)) is not None  # 1变为最近使用
+
+    cache.put(_key(3), b"c" * 100)
+
+    assert cache.get(_key(2)) is None
+    assert cache.get(_key(1)) is not None
+    assert cache.get(_key(3)) is not None
+    assert not os.path.exists(cache.path_for(_key(2)))
+
+
+def test_oversized_entry_is_kept_until_next_write(tmp_path):
+    """刚写入的文件即使超过上限也不会立即被删除，调用方拿到的路径有效"""
+    cache = RenderCache(str(tmp_path), 50)
+    path = cache.put(_key(1), b"x" * 100)
+    assert os.path.exists(path)
+
+    cache.put(_key(2), b"y" * 10)
+    assert cache.get(_key(1)) is None
+    assert cache.get(_key(2)) is not None
+
+
+def test_lru_order_restored_from_disk(tmp_path):
+    """重启后按文件修改时间恢复LRU顺序，超过上限的旧文件被淘汰"""
+    cache = RenderCache(str(tmp_path), 1000)
+    for n in range(3):
+        path = cache.put(_key(n), b"z" * 100)
+        os.utime(path, (1000 + n, 1000 + n))
+
+    restarted = RenderCache(str(tmp_path), 250)
+
+    assert restarted.get(_key(0)) is None
+    assert restarted.get(_key(1)) is not None
+    assert restarted.get(_key(2)) is not None
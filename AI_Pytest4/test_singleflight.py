@@ -0,0 +1,153 @@
+"""
+单飞合并（singleflight.py）的测试：相同输入的并发调用只执行一次，结果和错误由所有等待者共享
+
+作者：AI助手
+日期：2025年
+"""
+
+import threading
+import time
+
+from admission import AdmissionRejected
+from singleflight import SharedFlightError, SingleFlight, flight_key
+
+
+KEY = flight_key("工作记录", "FakeSparkClient")
+
+# 其他线程加入正在进行的调用所需的时间
+JOIN_DELAY = 0.3
+
+
+class _Interrupted(BaseException):
+    """模拟 KeyboardInterrupt、SystemExit 等不属于 Exception 的异常"""
+
+
+class _Upstream:
+    """计数的模拟调用：gate设置前一直等待"""
+
+    def __init__(self, result="回复", error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.started = threading.Event()
+        self.gate = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _start(flight, func, outcomes):
+    """在新线程中调用 flight.do，结果或异常追加到outcomes"""
+    def call():
+        try:
+            outcomes.append(flight.do(KEY, func))
+        except BaseException as e:
+            outcomes.append(e)
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    return thread
+
+
+def _finish(upstream, threads):
+    """等其他线程加入后放行调用，并等待所有线程结束"""
+    assert upstream.started.wait(5)
+    time.sleep(JOIN_DELAY)
+    upstream.gate.set()
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+def test_flight_key_normalizes_input():
+    assert flight_key("第一行\r\n第二行  ", "HTTP") == flight_key("第一行\n第二行", "HTTP")
+    assert flight_key("工作记录", "HTTP") != flight_key("工作记录", "WEBSOCKET")
+
+
+def test_concurrent_calls_coalesced_in_process():
+    flight = SingleFlight(db_path="")
+    upstream = _Upstream()
+    outcomes = []
+    _finish(upstream, [_start(flight, upstream, outcomes) for _ in range(5)])
+
+    assert upstream.calls == 1
+    assert outcomes == ["回复"] * 5
+
+
+def test_concurrent_calls_coalesced_across_processes(tmp_path):
+    """两个SingleFlight共用登记文件（相当于同一主机的两个worker），只有一个调用大模型"""
+    path = str(tmp_path / "singleflight.db")
+    workers = [SingleFlight(db_path=path), SingleFlight(db_path=path)]
+    upstream = _Upstream()
+    outcomes = []
+    _finish(upstream, [_start(workers[i % 2], upstream, outcomes) for i in range(4)])
+
+    assert upstream.calls == 1
+    assert outcomes == ["回复"] * 4
+
+
+def test_upstream_error_shared():
+    flight = SingleFlight(db_path="")
+    upstream = _Upstream(error=ValueError("上游错误"))
+    outcomes = []
+    _finish(upstream, [_start(flight, upstream, outcomes) for _ in range(3)])
+
+    assert upstream.calls == 1
+    assert len(outcomes) == 3
+    assert all(isinstance(e, ValueError) and str(e) == "上游错误" for e in outcomes)
+
+
+def test_remote_error_shared(tmp_path):
+    """其他进程的调用失败时，等待者得到 SharedFlightError（携带原错误信息）"""
+    path = str(tmp_path / "singleflight.db")
+    upstream = _Upstream(error=ValueError("上游错误"))
+    leader_outcomes, remote_outcomes = [], []
+    leader = _start(SingleFlight(db_path=path), upstream, leader_outcomes)
+    assert upstream.started.wait(5)
+    remote = _start(SingleFlight(db_path=path), upstream, remote_outcomes)
+    _finish(upstream, [leader, remote])
+
+    assert upstream.calls == 1
+    assert isinstance(leader_outcomes[0], ValueError)
+    assert isinstance(remote_outcomes[0], SharedFlightError)
+    assert "上游错误" in str(remote_outcomes[0])
+
+
+def test_leader_rejection_not_shared():
+    """leader因自身原因（准入被拒）失败时不共享该错误，等待者重新发起调用"""
+    flight = SingleFlight(db_path="")
+    rejected = _Upstream(error=AdmissionRejected("queue_full", 1))
+    retried = _Upstream()
+    retried.gate.set()
+    leader_outcomes, follower_outcomes = [], []
+    leader = _start(flight, rejected, leader_outcomes)
+    assert rejected.started.wait(5)
+    follower = _start(flight, retried, follower_outcomes)
+    _finish(rejected, [leader, follower])
+
+    assert isinstance(leader_outcomes[0], AdmissionRejected)
+    assert follower_outcomes == ["回复"]
+    assert retried.calls == 1
+
+
+def test_leader_interrupted_not_shared(tmp_path):
+    """leader被 BaseException 中断时登记为放弃，本进程和其他进程的等待者都重新发起调用"""
+    path = str(tmp_path / "singleflight.db")
+    flight = SingleFlight(db_path=path)
+    interrupted = _Upstream(error=_Interrupted())
+    retried = _Upstream()
+    retried.gate.set()
+    leader_outcomes, follower_outcomes, remote_outcomes = [], [], []
+    leader = _start(flight, interrupted, leader_outcomes)
+    assert interrupted.started.wait(5)
+    follower = _start(flight, retried, follower_outcomes)
+    remote = _start(SingleFlight(db_path=path), retried, remote_outcomes)
+    _finish(interrupted, [leader, follower, remote])
+
+    assert isinstance(leader_outcomes[0], _Interrupted)
+    assert follower_outcomes == ["回复"] and remote_outcomes == ["回复"]
@@ -0,0 +1,158 @@
+"""
+模板预编译（template_compiler.py）的测试：预编译渲染与python-docx渲染得到相同的文档，
+提交的预编译产物与模板一致，有问题的模板在编译时报错
+
+作者：AI助手
+日期：2025年
+"""
+
+import io
+import json
+import os
+import shutil
+import zipfile
+
+import pytest
+from lxml import etree
+
+from document_renderer import render_precompiled, render_summary_document
+from template_compiler import TemplateCompileError, compile_template
+from template_registry import DEFAULT_TEMPLATE_ID, TemplateRegistry, artifact_path
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "年度总结模板.docx")
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+EXTRACTED = {
+    "姓名": "张三 & <李四>\x0b",
+    "报告日期": "2025年12月31日",
+    "年度总结概述": "第一行\n第二行",
+    "主要成就与贡献": ["完成项目A", "提升效率\t10%", "多行条目\n第二行"],
+    "个人成长与学习": ["学习新技术"],
+    "遇到的挑战及解决方案": [],
+    "未来展望与计划": ["", "继续改进"],
+}
+
+
+def _serialize(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _format_placeholders(path):
+    """占位符所在的run改为粗体，并加一段占位符被拆到多个不同格式run中、前后还有其他文字的段落"""
+    from docx import Document
+
+    doc = Document(path)
+    cells = [cell for table in doc.tables for row in table.rows for cell in row.cells]
+    for paragraph in doc.paragraphs + [p for cell in cells for p in cell.paragraphs]:
+        if '[[' in paragraph.text:
+            for run in paragraph.runs:
+                run.bold = True
+    paragraph = doc.add_paragraph("报告人：")
+    paragraph.add_run("[[您的").bold = True
+    paragraph.add_run("姓名]]，").italic = True
+    paragraph.add_run("日期 [[报告日期]]")
+    doc.save(path)
+
+
+@pytest.fixture(params=["original", "formatted"])
+def template(request, tmp_path):
+    """从模板重新编译产物（不使用仓库中提交的产物），返回预编译的模板"""
+    path = str(tmp_path / "年度总结模板.docx")
+    shutil.copy(TEMPLATE_PATH, path)
+    if request.param == "formatted":
+        _format_placeholders(path)
+    with open(path, 'rb') as f:
+        artifact = compile_template(f.read())
+    with open(artifact_path(path), 'wb') as f:
+        f.write(_serialize(artifact))
+
+    compiled = TemplateRegistry(str(tmp_path / "templates"), path, 0).get(DEFAULT_TEMPLATE_ID)
+    assert compiled.segments is not None
+    return compiled
+
+
+def _parts(document):
+    with zipfile.ZipFile(io.BytesIO(document)) as zf:
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+def _canonical_body(xml):
+    """规范化正文XML：python-docx只在文本首尾有空白时才写 xml:space，其余属性与结构必须相同"""
+    root = etree.fromstring(xml)
+    for node in root.iter():
+        node.attrib.pop(XML_SPACE, None)
+    return etree.tostring(root, method="c14n")
+
+
+def test_precompiled_output_matches_python_docx(template):
+    precompiled = _parts(render_precompiled(template, EXTRACTED))
+    reference = _parts(render_summary_document(template.open_stream(), EXTRACTED))
+
+    assert precompiled.keys() == reference.keys()
+    for name in reference:
+        if name == template.document_part:
+            assert _canonical_body(precompiled[name]) == _canonical_body(reference[name])
+        else:
+            assert precompiled[name] == reference[name], name
+
+
+def test_precompiled_output_is_a_valid_document(template):
+    from docx import Document
+
+    doc = Document(io.BytesIO(render_precompiled(template, EXTRACTED)))
+    text = "\n".join(p.text for p in doc.paragraphs)
+    assert "[[" not in text
+    assert "• 提升效率\t10%" in text
+    assert "暂无相关内容" in text
+
+
+def test_committed_artifact_up_to_date():
+    """仓库中的预编译产物与模板一致（与 python template_compiler.py --check 相同）"""
+    with open(TEMPLATE_PATH, 'rb') as f:
+        expected = _serialize(compile_template(f.read()))
+    with open(artifact_path(TEMPLATE_PATH), 'rb') as f:
+        assert f.read() == expected
+
+
+def _docx(*paragraphs):
+    from docx import Document
+
+    doc = Document()
+    for text in paragraphs:
+        doc.add_paragraph(text)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def test_unknown_and_missing_placeholders_rejected():
+    with pytest.raises(TemplateCompileError) as error:
+        compile_template(_docx("[[姓名拼错]]"))
+    problems = "\n".join(error.value.problems)
+    assert "未知占位符 [[姓名拼错]]" in problems
+    assert "缺少占位符" in problems
+
+
+def test_partial_template_allowed_with_allow_missing():
+    artifact = compile_template(_docx("[[年度总结概述]]"), allow_missing=True)
+    assert artifact["placeholders"] == ["[[年度总结概述]]"]
+    assert [s["placeholder"] for s in artifact["segments"] if isinstance(s, dict)] == ["[[年度总结概述]]"]
+
+
+def test_problem_paragraph_does_not_hide_later_checks():
+    """一段中有问题的占位符不影响其他位置的检查，该段也不会再被当作文本框等位置重复报告"""
+    from docx import Document
+
+    doc = Document()
+    doc.add_paragraph("[[姓名拼错]]")
+    doc.add_paragraph("[[年度总结概述]]")
+    doc.sections[0].header.paragraphs[0].text = "[[报告日期]]"
+    buffer = io.BytesIO()
+    doc.save(buffer)
+
+    with pytest.raises(TemplateCompileError) as error:
+        compile_template(buffer.getvalue(), allow_missing=True)
+    assert error.value.problems == [
+        "正文第1段: 未知占位符 [[姓名拼错]]",
+        "第1节页眉页脚: [[报告日期]] 位于文本框、嵌套表格或页眉页脚中，不会被填充",
+    ]
@@ -0,0 +1,172 @@
+"""
+单请求追踪
+
+为每个请求记录各处理阶段的耗时（span），用于：
+1. 在响应头 Server-Timing 中返回阶段耗时，浏览器开发者工具的“时间”面板即可直接查看
+2. 可选地把每个请求的追踪记录以JSON行写入本地文件（SUMMARY_TRACE_FILE），供事后分析
+
+追踪对象保存在contextvars中，同一请求内任何位置都可以通过 record_span() 追加阶段耗时，
+不需要层层传参。
+
+作者：AI助手
+日期：2025年
+"""
+
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+
+# 追踪记录文件，为空时不写文件
+SUMMARY_TRACE_FILE = os.getenv("SUMMARY_TRACE_FILE", "")
+
+_current_trace = contextvars.ContextVar("summary_trace", default=None)
+
+
+class RequestTrace:
+    """
+    一个请求的追踪记录
+
+    属性:
+        request_id: 请求ID（同时通过 X-Request-Id 响应头返回）
+        spans: [(阶段名, 相对请求开始的偏移秒数, 耗时秒数)] 列表
+        attributes: 附加信息（接口名、状态码等）
+    """
+
+    def __init__(self, name, request_id=None):
+        self.name = name
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans = []
+        self.attributes = {}
+
+    def add_span(self, name, duration, start=None):
+        """
+        追加一个阶段
+
+        参数:
+            name: 阶段名
+            duration: 耗时（秒）
+            start: 阶段开始时的perf_counter值，默认按“刚刚结束”推算
+        """
+        if start is None:
+            start = time.perf_counter() - duration
+        self.spans.append((name, start - self._start, duration))
+
+    @property
+    def elapsed(self):
+        """请求开始至今的耗时（秒）"""
+        return time.perf_counter() - self._start
+
+    def stage_totals(self):
+        """
+        各阶段的总耗时（秒）
+
+        同名阶段出现多次时（例如重试）耗时累加
+        """
+        totals = {}
+        for name, _, duration in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration
+        return totals
+
+    def server_timing_header(self):
+        """
+        生成Server-Timing响应头
+
+        各阶段的总耗时，最后附加请求总耗时total
+        """
+        entries = [f"{name};dur={duration * 1000:.1f}" for name, duration in self.stage_totals().items()]
+        entries.append(f"total;dur={self.elapsed * 1000:.1f}")
+        return ", ".join(entries)
+
+    def to_record(self):
+        """转换为写入追踪文件的字典"""
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "total_ms": round(self.elapsed * 1000, 1),
+            "spans": [
+                {"name": name, "offset_ms": round(offset * 1000, 1), "dur_ms": round(duration * 1000, 1)}
+                for name, offset, duration in self.spans
+            ],
+            "attributes": self.attributes,
+        }
+
+
+def start_trace(name, request_id=None):
+    """为当前请求创建追踪对象"""
+    trace = RequestTrace(name, request_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    """返回当前请求的追踪对象，不在请求中时返回None"""
+    return _current_trace.get()
+
+
+def end_trace():
+    """
+    结束当前请求的追踪
+
+    配置了 SUMMARY_TRACE_FILE 时把记录交给后台线程写文件
+
+    返回:
+        结束的追踪对象（没有时返回None）
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    _current_trace.set(None)
+    if SUMMARY_TRACE_FILE:
+        _get_writer().submit(trace.to_record())
+    return trace
+
+
+def record_span(name, duration, start=None):
+    """向当前请求的追踪对象追加一个阶段，不在请求中时忽略"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, duration, start)
+
+
+class _TraceFileWriter:
+    """后台写追踪文件的线程，请求线程只负责入队"""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        self._queue.put(record)
+
+    def _run(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            while True:
+                record = self._queue.get()
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                # 队列空闲时才刷新，突发流量下合并写入
+                if self._queue.empty():
+                    f.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    """按需创建追踪文件写入线程（每个进程一个）"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = _TraceFileWriter(SUMMARY_TRACE_FILE)
+    return _writer
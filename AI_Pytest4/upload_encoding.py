@@ -0,0 +1,193 @@
+"""
+压缩上传的请求体（Content-Encoding: gzip）
+
+通过VPN访问时，上传大段文本本身就占了不少等待时间。前端把粘贴的文本和.txt文件
+用浏览器的 CompressionStream 压缩后上传（中文文本一般能压缩到原来的1/2到1/10，见 benchmarks/bench_upload.py），
+服务端在交给Flask解析表单之前解压：
+1. 边读边解压，解压结果超过1MB时写入临时文件，内存占用与上传大小无关
+2. 解压后的大小超过 UPLOAD_MAX_DECOMPRESSED_BYTES，或解压结果超过1MB后压缩比超过
+   UPLOAD_MAX_COMPRESSION_RATIO 时立即停止解压（防止压缩炸弹），返回413
+3. 数据损坏或不完整返回400，不支持的编码（br、deflate等）返回415，没有Content-Length的分块上传返回411
+4. 解压后替换 wsgi.input 和 Content-Length，并去掉 Content-Encoding 请求头，后续处理与未压缩的请求相同
+
+解压失败的请求不在中间件中直接返回，而是记录在environ中，由Flask的before_request返回JSON错误，
+这样仍然经过请求追踪和指标统计。
+
+作者：AI助手
+日期：2025年
+"""
+
+import io
+import logging
+import os
+import tempfile
+import time
+import zlib
+
+from log_config import get_logger, log_event
+
+
+# ==================== 配置 ====================
+UPLOAD_MAX_DECOMPRESSED_BYTES = int(os.getenv("UPLOAD_MAX_DECOMPRESSED_BYTES", str(20 * 1024 * 1024)))  # 解压后的请求体大小上限
+UPLOAD_MAX_COMPRESSION_RATIO = float(os.getenv("UPLOAD_MAX_COMPRESSION_RATIO", "50"))                  # 解压后/压缩前的大小比例上限
+UPLOAD_RATIO_CHECK_BYTES = 1024 * 1024   # 解压结果超过该大小后才检查压缩比（小文本的压缩比本来就可能很高）
+UPLOAD_READ_CHUNK_BYTES = 64 * 1024      # 每次读取的压缩数据大小
+UPLOAD_SPOOL_BYTES = 1024 * 1024         # 解压结果超过该大小时写入临时文件
+
+# environ中记录解压错误的键
+UPLOAD_ERROR_KEY = "summary.upload_error"
+
+logger = get_logger(__name__)
+
+
+class UploadDecodeError(Exception):
+    """
+    请求体不能解压
+
+    属性:
+        message: 返回给用户的错误信息
+        status: HTTP状态码（400、411、413或415）
+    """
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _iter_input(stream, content_length):
+    """按块读取原始请求体；有Content-Length时只读取声明的长度"""
+    remaining = content_length
+    while remaining is None or remaining > 0:
+        size = UPLOAD_READ_CHUNK_BYTES if remaining is None else min(UPLOAD_READ_CHUNK_BYTES, remaining)
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield chunk
+
+
+def gunzip_stream(chunks, output, max_bytes=None, max_ratio=None):
+    """
+    边读边解压gzip数据（支持多个gzip成员首尾相接）
+
+    每次解压的输出不超过一个读取块，超过上限时不会先把整个炸弹解压出来再判断
+
+    参数:
+        chunks: 压缩数据块的可迭代对象
+        output: 写入解压结果的文件对象
+        max_bytes: 解压结果的大小上限，默认 UPLOAD_MAX_DECOMPRESSED_BYTES
+        max_ratio: 压缩比上限，默认 UPLOAD_MAX_COMPRESSION_RATIO
+
+    返回:
+        (压缩数据字节数, 解压结果字节数)
+
+    抛出:
+        UploadDecodeError
+    """
+    max_bytes = UPLOAD_MAX_DECOMPRESSED_BYTES if max_bytes is None else max_bytes
+    max_ratio = UPLOAD_MAX_COMPRESSION_RATIO if max_ratio is None else max_ratio
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    compressed = 0
+    decompressed = 0
+    started = False
+
+    for chunk in chunks:
+        compressed += len(chunk)
+        data = chunk
+        while True:
+            if decompressor.eof:
+                # 上一个gzip成员结束，后面是下一个成员
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            started = True
+            try:
+                out = decompressor.decompress(data, UPLOAD_READ_CHUNK_BYTES)
+            except zlib.error as e:
+                raise UploadDecodeError(f"压缩数据损坏: {e}", 400)
+            decompressed += len(out)
+            if decompressed > max_bytes:
+                raise UploadDecodeError(f"解压后的内容超过 {max_bytes // (1024 * 1024)}MB 上限", 413)
+            if decompressed > UPLOAD_RATIO_CHECK_BYTES and decompressed > compressed * max_ratio:
+                raise UploadDecodeError("压缩比异常，拒绝解压", 413)
+            output.write(out)
+            # 一个成员结束后的数据在unused_data；输出受限时剩余的输入在unconsumed_tail，
+            # 输出恰好填满时zlib内部可能还有待输出的数据，需要继续调用
+            if decompressor.eof:
+                data = decompressor.unused_data
+                if not data:
+                    break
+            else:
+                data = decompressor.unconsumed_tail
+                if not data and len(out) < UPLOAD_READ_CHUNK_BYTES:
+                    break
+
+    if not started or not decompressor.eof:
+        raise UploadDecodeError("压缩数据不完整", 400)
+    return compressed, decompressed
+
+
+def decode_request_body(environ):
+    """
+    按Content-Encoding解压请求体，原地更新environ
+
+    参数:
+        environ: WSGI environ
+
+    抛出:
+        UploadDecodeError
+    """
+    encoding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+    if encoding in ("", "identity"):
+        return
+    if encoding not in ("gzip", "x-gzip"):
+        raise UploadDecodeError(f"不支持的Content-Encoding: {encoding}，仅支持gzip", 415)
+
+    content_length = environ.get("CONTENT_LENGTH")
+    content_length = int(content_length) if content_length and content_length.isdigit() else None
+    if content_length is None and not environ.get("wsgi.input_terminated"):
+        raise UploadDecodeError("压缩上传需要Content-Length", 411)
+
+    start = time.perf_counter()
+    body = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    try:
+        compressed, decompressed = gunzip_stream(_iter_input(environ["wsgi.input"], content_length), body)
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+
+    environ["wsgi.input"] = body
+    environ["CONTENT_LENGTH"] = str(decompressed)
+    environ.pop("wsgi.input_terminated", None)
+    del environ["HTTP_CONTENT_ENCODING"]
+    log_event(logger, logging.INFO, "upload_decompressed", compressed=compressed, decompressed=decompressed,
+              elapsed_ms=round((time.perf_counter() - start) * 1000, 1))
+
+
+class DecompressingMiddleware:
+    """
+    解压请求体的WSGI中间件
+
+    解压失败时把请求体替换为空，错误记录在 environ[UPLOAD_ERROR_KEY] 中，由应用返回错误响应
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        apply_request_encoding(environ)
+        return self.wsgi_app(environ, start_response)
+
+
+def apply_request_encoding(environ):
+    """解压请求体；失败时清空请求体并在environ中记录错误（ASGI入口也调用）"""
+    try:
+        decode_request_body(environ)
+    except UploadDecodeError as e:
+        log_event(logger, logging.WARNING, "upload_rejected", status=e.status, error=e.message)
+        environ[UPLOAD_ERROR_KEY] = e
+        environ["wsgi.input"] = io.BytesIO()
+        environ["CONTENT_LENGTH"] = "0"
+        environ.pop("wsgi.input_terminated", None)
+        environ.pop("HTTP_CONTENT_ENCODING", None)
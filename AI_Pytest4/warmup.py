@@ -0,0 +1,141 @@
+"""
+启动预热与就绪状态
+
+部署后的第一个请求要承担python-docx/lxml导入、模板编译、DNS解析和与星火API的TLS握手，
+明显慢于后续请求。应用启动时在后台执行预热：
+1. 编译所有模板
+2. 导入python-docx并完成一次模板解析和保存（加载lxml及相关代码路径）
+3. 启动Word文档进程池的子进程（docx_pool.py）
+4. 初始化文档缓存
+5. 创建星火大模型客户端，解析API主机DNS并预先建立连接池中的连接
+
+预热完成前 /ready 返回503，负载均衡器据此只把流量转发给已预热的实例。
+预建连接失败（例如上游暂时不可达）只记录警告，不影响就绪；其余步骤失败时保持未就绪。
+
+作者：AI助手
+日期：2025年
+"""
+
+import io
+import logging
+import os
+import threading
+import time
+
+from log_config import get_logger, log_event
+from template_registry import DEFAULT_TEMPLATE_ID
+
+
+WARMUP_MODE = os.getenv("WARMUP_MODE", "background").lower()                      # background | blocking | off
+WARMUP_UPSTREAM_CONNECTIONS = int(os.getenv("WARMUP_UPSTREAM_CONNECTIONS", "4"))  # 预先建立的上游连接数
+
+logger = get_logger(__name__)
+
+
+class Warmup:
+    """
+    预热任务及其状态
+
+    属性:
+        steps: 已完成的步骤 -> 耗时（毫秒）
+        error: 导致未就绪的错误信息
+    """
+
+    def __init__(self, services):
+        """
+        参数:
+            services: app.SummaryServices 实例
+        """
+        self.services = services
+        self.steps = {}
+        self.error = None
+        self._ready = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self, mode=None):
+        """
+        按模式启动预热（只执行一次）
+
+        参数:
+            mode: background（后台线程）、blocking（当前线程执行完再返回）或 off（不预热，直接就绪），
+                  默认使用 WARMUP_MODE
+        """
+        mode = mode or WARMUP_MODE
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        if mode == "off":
+            self._ready.set()
+        elif mode == "blocking":
+            self.run()
+        else:
+            threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+    def _step(self, name, func):
+        """执行一个步骤并记录耗时"""
+        start = time.perf_counter()
+        result = func()
+        self.steps[name] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+
+    def run(self):
+        """依次执行所有预热步骤"""
+        started = time.perf_counter()
+        try:
+            template = self._step("templates", self._load_templates)
+            self._step("docx", lambda: self._exercise_docx(template))
+            self._step("docx_pool", self.services.docx_pool.warmup)
+            self._step("render_cache", lambda: self.services.render_cache)
+            client = self._step("spark_client", self._create_client)
+            self._step("upstream_connections", lambda: self._open_connections(client))
+        except Exception as e:
+            self.error = str(e)
+            log_event(logger, logging.ERROR, "warmup_failed", error=self.error, steps=self.steps)
+            return
+
+        self._ready.set()
+        log_event(logger, logging.INFO, "warmup_done",
+                  total_ms=round((time.perf_counter() - started) * 1000, 1), **self.steps)
+
+    def _load_templates(self):
+        """编译所有模板，默认模板必须存在"""
+        return self.services.template_registry.get(DEFAULT_TEMPLATE_ID)
+
+    @staticmethod
+    def _exercise_docx(template):
+        """导入python-docx，并对默认模板完成一次解析和保存"""
+        from docx import Document
+
+        Document(template.open_stream()).save(io.BytesIO())
+
+    def _create_client(self):
+        client = self.services.spark_client
+        if client is None:
+            raise RuntimeError("星火大模型客户端初始化失败，请检查API配置")
+        return client
+
+    @staticmethod
+    def _open_connections(client):
+        """解析DNS并预建上游连接，失败只记录警告"""
+        warmup = getattr(client, "warmup", None)
+        if warmup is None:
+            return
+        try:
+            warmup(WARMUP_UPSTREAM_CONNECTIONS)
+        except Exception as e:
+            log_event(logger, logging.WARNING, "upstream_warmup_failed", error=str(e))
+
+    def status(self):
+        """/ready 接口返回的状态"""
+        return {
+            "ready": self.ready,
+            "steps_ms": dict(self.steps),
+            "error": self.error,
+        }